@@ -106,7 +106,8 @@ if __name__ == '__main__':
         os.makedirs(BLOCKDIR)
 
     iobd.IOBigData(
-        ram_pool_method=lambda: virtual_memory().available
+        ram_pool_method=lambda: virtual_memory().available,
+        ram_capacity_method=lambda: virtual_memory().total
     ).set_log(
         log=log.LOGGER if MEMORY_LOGS else lambda message: None
     )
@@ -142,7 +143,7 @@ if __name__ == '__main__':
             "\n\n Advanced commands:"
             "\n- update"
             "\n- serve"
-            "\n- migrate"
+            "\n- migrate [--dry-run]"
             "\n- storage:prune_blocks"
             "\n- test <test name>"
             "\n- rundev <repository path>"
@@ -273,10 +274,8 @@ if __name__ == '__main__':
                 os.system("chmod +x bash/reconfig.sh && ./bash/reconfig.sh")
 
             case 'migrate':
-                import os
                 from src.database.migrate import migrate
-                os.system(f"rm {DATABASE_FILE}")
-                migrate()
+                migrate(dry_run="--dry-run" in sys.argv)
 
             case 'storage:prune_blocks':
                 from src.commands.storage import prune_blocks
@@ -1,10 +1,11 @@
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
 from protos import celaut_pb2 as celaut
 from protos import gateway_pb2
 from src.balancers.estimated_cost_sorter.estimated_cost_sorter import estimated_cost_sorter
 from src.manager.manager import could_ve_this_sysreq
-from src.utils.cost_functions.general_cost_functions import compute_start_service_cost, compute_maintenance_cost
+from src.utils.cost_functions.general_cost_functions import compute_start_service_cost, compute_maintenance_cost, \
+    compute_execution_cost
 from src.utils.utils import to_gas_amount
 from src.utils.env import EnvManager
 
@@ -21,17 +22,21 @@ def configuration_balancer(
         initial_gas_amount: int
 ) -> Tuple[str, gateway_pb2.EstimatedCost]:
     posible_clauses: Dict[str, gateway_pb2.EstimatedCost] = {}
+    execution_cost: Optional[int] = None
 
     # TODO PARTE DE LOS CALCULOS INTERNOS DEL COMPUTO DE COSTES SON LOS MISMOS (EL COSTE DE CONSTRUCCIÓN DEL SERVICIO, ETC ...)
     for _i, clause in clauses.items():
         if not could_ve_this_sysreq(clause.max_sysreq):
             continue
+        if execution_cost is None:
+            execution_cost = compute_execution_cost(metadata=metadata)
 
         posible_clauses['local'] = gateway_pb2.EstimatedCost(
             cost=to_gas_amount(compute_start_service_cost(
                 metadata=metadata,
                 initial_gas_amount=initial_gas_amount,
-                resource=clause
+                resource=clause,
+                execution_cost=execution_cost
             )),
             min_maintenance_cost=to_gas_amount(compute_maintenance_cost(
                 system_resources=clause.min_sysreq
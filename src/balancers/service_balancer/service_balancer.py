@@ -1,24 +1,129 @@
-from typing import Optional, Dict, Generator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from hashlib import sha3_256
+from time import monotonic
+from typing import Optional, Dict, Generator, Tuple
 
-import grpc
 from bee_rpc import client as bee
 
 import protos.celaut_pb2 as celaut
-from protos import gateway_pb2, gateway_pb2_grpc
+from protos import gateway_pb2
 from protos.gateway_pb2_bee import StartService_input_indices
 from src.balancers.estimated_cost_sorter.estimated_cost_sorter import estimated_cost_sorter
 from src.virtualizers.docker import build
 from src.manager.manager import default_initial_cost, get_client_id_on_other_peer
 from src.utils import logger as log
 from src.utils.cost_functions.generate_estimated_cost import generate_estimated_cost
-from src.utils.utils import from_gas_amount, service_extended, peers_id_iterator, \
-    generate_uris_by_peer_id
+from src.utils.peer_channels import peer_stub
+from src.utils.tools.ttl_cache import TTLCache
+from src.utils.utils import from_gas_amount, service_extended, peers_id_iterator
+from src.utils.verify import get_service_hex_main_hash
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
 
 SEND_ONLY_HASHES_ASKING_COST = env_manager.get_env("SEND_ONLY_HASHES_ASKING_COST")
 EXTERNAL_COST_TIMEOUT = env_manager.get_env("EXTERNAL_COST_TIMEOUT")
+COST_QUOTES_DEADLINE = env_manager.get_env("COST_QUOTES_DEADLINE")
+COST_QUOTES_ENOUGH = int(env_manager.get_env("COST_QUOTES_ENOUGH"))
+COST_QUERY_CONCURRENCY = int(env_manager.get_env("COST_QUERY_CONCURRENCY"))
+COST_QUOTE_TTL = env_manager.get_env("COST_QUOTE_TTL")
+COST_QUOTE_CACHE_SIZE = int(env_manager.get_env("COST_QUOTE_CACHE_SIZE"))
+
+# Shared by every balancer call, the queries left behind when the quotes are collected don't hold the caller.
+_cost_executor = ThreadPoolExecutor(max_workers=COST_QUERY_CONCURRENCY, thread_name_prefix="cost-query")
+
+# Peer quotes by (PEER ID, SERVICE HASH, RESOURCES FINGERPRINT, INITIAL GAS).
+_quotes = TTLCache(max_size=COST_QUOTE_CACHE_SIZE, ttl=COST_QUOTE_TTL)
+
+
+def _initial_gas_amount(config: gateway_pb2.Configuration) -> int:
+    return from_gas_amount(config.initial_gas_amount) \
+        if config.HasField("initial_gas_amount") else default_initial_cost()
+
+
+def _quote_scope(metadata: celaut.Metadata, config: gateway_pb2.Configuration) -> Optional[Tuple[str, str, int]]:
+    """What a peer quote depends on besides the peer, None if the service has no hash to identify it."""
+    service_hash = get_service_hex_main_hash(metadata=metadata)
+    if not service_hash:
+        return None
+    fingerprint = sha3_256(config.resources.SerializeToString(deterministic=True)).hexdigest()
+    return service_hash, fingerprint, _initial_gas_amount(config)
+
+
+def _quote_ttl(estimated_cost: gateway_pb2.EstimatedCost) -> float:
+    """
+    A quote is kept up to a maintenance loop of the peer, when it prices the service again,
+    and shorter the more variance the peer gives to it.
+    """
+    ttl = min(COST_QUOTE_TTL, estimated_cost.maintenance_seconds_loop) \
+        if estimated_cost.maintenance_seconds_loop > 0 else COST_QUOTE_TTL
+    return ttl / (1 + max(0.0, estimated_cost.variance))
+
+
+def invalidate_cost_quote(peer_id: str, metadata: celaut.Metadata, config: gateway_pb2.Configuration):
+    """Forgets the quote of the peer for this launch, when the launch on it failed."""
+    scope = _quote_scope(metadata=metadata, config=config)
+    if scope:
+        _quotes.invalidate((peer_id, *scope))
+
+
+def _peer_cost(
+        peer_id: str,
+        metadata: celaut.Metadata,
+        config: Optional[gateway_pb2.Configuration],
+        recursion_guard_token: str,
+        deadline: float
+) -> gateway_pb2.EstimatedCost:
+    log.LOGGER('Check cost on peer ' + peer_id)
+    # First, so the time it takes to generate the client is left out of the cost call timeout.
+    client_id = get_client_id_on_other_peer(
+        peer_id=peer_id,
+        timeout=max(0, min(EXTERNAL_COST_TIMEOUT, deadline - monotonic()))
+    )
+    return next(bee.client_grpc(
+            method=peer_stub(peer_id=peer_id).GetServiceEstimatedCost,
+            indices_parser=gateway_pb2.EstimatedCost,
+            # No answer after the deadline is used, so the call doesn't go on beyond it.
+            timeout=max(0, min(EXTERNAL_COST_TIMEOUT, deadline - monotonic())),
+            partitions_message_mode_parser=True,
+            indices_serializer=StartService_input_indices,
+            input=service_extended(
+                config=config,
+                metadata=metadata,
+                send_only_hashes=SEND_ONLY_HASHES_ASKING_COST,
+                client_id=client_id,
+                recursion_guard_token=recursion_guard_token
+            ),
+            # TODO añadir initial_gas_amount y el resto de la configuracion inicial,
+            #  si es que se especifica.
+        ))
+
+
+def _gather_costs(queries: Dict[Future, str], deadline: float, cached: int = 0) -> Dict[str, gateway_pb2.EstimatedCost]:
+    """
+    Collects the peer quotes as they arrive, until COST_QUOTES_ENOUGH of them (0 waits for all), counting
+    the `cached` ones, or the deadline. The queries still pending are cancelled, or left to expire on their
+    own if they already started.
+    """
+    costs: Dict[str, gateway_pb2.EstimatedCost] = {}
+    pending = set(queries)
+    while pending and not (COST_QUOTES_ENOUGH and cached + len(costs) >= COST_QUOTES_ENOUGH):
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for query in done:
+            try:
+                costs[queries[query]] = query.result()
+            except Exception as e:
+                log.LOGGER('Error taking the cost on ' + queries[query] + ' : ' + str(e))
+
+    for query in pending:
+        query.cancel()
+    if pending:
+        log.LOGGER(f'Sorting {cached + len(costs)} peer quotes without waiting for other {len(pending)} peers.')
+    return costs
+
 
 def service_balancer(
         metadata: celaut.Metadata,
@@ -29,10 +134,33 @@ def service_balancer(
     # sorted by cost, tuple of celaut.Instances or 'local' , cost and clause of combination resources selected
     peers: Dict[str, gateway_pb2.EstimatedCost] = {}
 
-    initial_gas_amount: int = from_gas_amount(config.initial_gas_amount) \
-        if config.HasField("initial_gas_amount") else default_initial_cost()
+    initial_gas_amount: int = _initial_gas_amount(config)
     # TODO If there is noting on meta. Need to check the architecture on the buffer and write it on metadata.
 
+    # The peers without a fresh quote are asked all at once, and the local cost is computed meanwhile.
+    scope = _quote_scope(metadata=metadata, config=config)
+    version = _quotes.version
+    deadline = monotonic() + COST_QUOTES_DEADLINE
+    queries: Dict[Future, str] = {}
+    try:
+        for peer_id in peers_id_iterator(ignore_network=ignore_network):
+            if scope:
+                hit, quote = _quotes.get((peer_id, *scope))
+                if hit:
+                    peers[peer_id] = quote
+                    continue
+            queries[_cost_executor.submit(
+                _peer_cost,
+                peer_id=peer_id,
+                metadata=metadata,
+                config=config,
+                recursion_guard_token=recursion_guard_token,
+                deadline=deadline
+            )] = peer_id
+    except Exception as e:
+        log.LOGGER('Error iterating peers on service balancer ->>' + str(e))
+    cached = len(peers)
+
     try:
         peers['local'] = generate_estimated_cost(
                 metadata=metadata,
@@ -44,37 +172,15 @@ def service_balancer(
         pass
     except Exception as e:
         log.LOGGER('Error getting the local cost ' + str(e))
+        for query in queries:
+            query.cancel()
         raise e
 
-    try:
-        for peer_id in peers_id_iterator(ignore_network=ignore_network):
-            log.LOGGER('Check cost on peer ' + peer_id)
-            # TODO could use async or concurrency
-            try:
-                peers[peer_id] = next(bee.client_grpc(
-                        method=gateway_pb2_grpc.GatewayStub(
-                            grpc.insecure_channel(
-                                next(generate_uris_by_peer_id(peer_id))
-                            )
-                        ).GetServiceEstimatedCost,
-                        indices_parser=gateway_pb2.EstimatedCost,
-                        timeout=EXTERNAL_COST_TIMEOUT,
-                        partitions_message_mode_parser=True,
-                        indices_serializer=StartService_input_indices,
-                        input=service_extended(
-                            config=config,
-                            metadata=metadata,
-                            send_only_hashes=SEND_ONLY_HASHES_ASKING_COST,
-                            client_id=get_client_id_on_other_peer(peer_id=peer_id),
-                            recursion_guard_token=recursion_guard_token
-                        ),
-                        # TODO añadir initial_gas_amount y el resto de la configuracion inicial,
-                        #  si es que se especifica.
-                    ))
-            except Exception as e:
-                log.LOGGER('Error taking the cost on ' + peer_id + ' : ' + str(e))
-    except Exception as e:
-        log.LOGGER('Error iterating peers on service balancer ->>' + str(e))
+    quotes = _gather_costs(queries=queries, deadline=deadline, cached=cached)
+    if scope:
+        for peer_id, quote in quotes.items():
+            _quotes.set((peer_id, *scope), quote, version=version, ttl=_quote_ttl(quote))
+    peers.update(quotes)
 
     try:
         return estimated_cost_sorter(
@@ -1,4 +1,5 @@
 import sqlite3
+from src.database.gas_functions import to_scientific_notation
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
@@ -29,7 +30,7 @@ def list_peers():
         cursor.execute('''
             SELECT 
                 id, protocol_stack, client_id, 
-                gas_mantissa, gas_exponent, gas_last_update, 
+                gas, gas_last_update, 
                 reputation_proof_id, reputation_score, 
                 reputation_index, last_index_on_ledger 
             FROM peer
@@ -41,7 +42,7 @@ def list_peers():
             for peer in peers:
                 (
                     peer_id, protocol_stack, client_id,
-                    gas_mantissa, gas_exponent, gas_last_update,
+                    gas, gas_last_update,
                     reputation_proof_id, reputation_score,
                     reputation_index, last_index_on_ledger
                 ) = peer
@@ -50,8 +51,7 @@ def list_peers():
 ID: {peer_id}
 Protocol stack: {protocol_stack if protocol_stack else 'None'}
 Client ID: {client_id}
-Gas Mantissa: {gas_mantissa}
-Gas Exponent: {gas_exponent}
+Gas: {to_scientific_notation(gas)}
 Gas Last Update: {gas_last_update if gas_last_update else 'None'}
 Reputation Proof ID: {reputation_proof_id if reputation_proof_id else 'None'}
 Reputation Score: {reputation_score}
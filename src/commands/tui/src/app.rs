@@ -118,10 +118,15 @@ impl Identifiable for Tunnel {
     }
 }
 
+// Gas is stored as a decimal integer string.
+fn format_gas(gas: &str) -> String {
+    format!("{:e}", gas.parse::<f64>().unwrap_or(0.0))
+}
+
 fn get_peers() -> Result<Vec<Peer>> {
     Ok(Connection::open(DATABASE_FILE)?
         .prepare(
-            "SELECT p.id, u.ip, u.port, p.gas_mantissa, p.gas_exponent, p.reputation_proof_id
+            "SELECT p.id, u.ip, u.port, p.gas, p.reputation_proof_id
                 FROM peer p
                 JOIN slot s ON p.id = s.peer_id
                 JOIN uri u ON s.id = u.slot_id",
@@ -130,12 +135,10 @@ fn get_peers() -> Result<Vec<Peer>> {
             let id: String = row.get(0)?;
             let ip: String = row.get(1)?;
             let port: u16 = row.get(2)?;
-            let gas_mantissa: i64 = row.get(3)?;
-            let gas_exponent: i32 = row.get(4)?;
-            let rpi: Option<String> = row.get(5)?;
+            let gas: String = row.get(3)?;
+            let rpi: Option<String> = row.get(4)?;
 
-            let gas_value = gas_mantissa as f64 * 10f64.powi(gas_exponent as i32);
-            let gas = format!("{:e}", gas_value);
+            let gas = format_gas(&gas);
 
             Ok(Peer {
                 id,
@@ -149,14 +152,12 @@ fn get_peers() -> Result<Vec<Peer>> {
 
 fn get_clients() -> Result<Vec<Client>> {
     Ok(Connection::open(DATABASE_FILE)?
-        .prepare("SELECT id, gas_mantissa, gas_exponent FROM clients")?
+        .prepare("SELECT id, gas FROM clients")?
         .query_map([], |row| {
             let id: String = row.get(0)?;
-            let gas_mantissa: i64 = row.get(1)?;
-            let gas_exponent: i32 = row.get(2)?;
+            let gas: String = row.get(1)?;
 
-            let gas_value = gas_mantissa as f64 * 10f64.powi(gas_exponent as i32);
-            let gas = format!("{:e}", gas_value);
+            let gas = format_gas(&gas);
 
             Ok(Client {
                 id,
@@ -170,16 +171,14 @@ fn get_instances() -> Result<Vec<Container>> {
     let conn = Connection::open(DATABASE_FILE)?;
 
     let internal_instances = conn
-        .prepare("SELECT id, ip, gas_mantissa, gas_exponent FROM internal_services")?
+        .prepare("SELECT id, ip, gas FROM internal_services")?
         .query_map([], |row| {
             let id: String = row.get(0)?;
             let ip: String = row.get(1)?;
 
-            let gas_mantissa: i64 = row.get(2)?;
-            let gas_exponent: i32 = row.get(3)?;
+            let gas: String = row.get(2)?;
 
-            let gas_value = gas_mantissa as f64 * 10f64.powi(gas_exponent as i32);
-            let gas = format!("{:e}", gas_value);
+            let gas = format_gas(&gas);
 
             Ok(Container {
                 id, ip, gas 
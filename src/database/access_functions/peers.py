@@ -10,25 +10,29 @@ def get_peer_ids() -> Generator[str, None, None]:
 
 def get_peer_id_by_ip(ip: str) -> str:
     return next(fetch_query(
-        query="SELECT id FROM peer "
-              "WHERE id IN ("
-              "   SELECT peer_id FROM slot "
-              "   WHERE id IN ("
-              "       SELECT slot_id FROM uri "
-              "       WHERE ip = ?"
-              "   )"
-              ")",
+        query="SELECT p.id FROM uri u "
+              "JOIN slot s ON s.id = u.slot_id "
+              "JOIN peer p ON p.id = s.peer_id "
+              "WHERE u.ip = ? "
+              "LIMIT 1",
         params=(ip,)
     ))[0]
 
 
 def get_peer_directions(peer_id) -> Generator[Tuple[str, int], None, None]:
     for ip, port in fetch_query(
-            query="SELECT ip, port FROM uri "
-                  "WHERE slot_id IN ("
-                  "   SELECT id FROM slot "
-                  "   WHERE peer_id = ?"
-                  ")",
+            query="SELECT u.ip, u.port FROM slot s "
+                  "JOIN uri u ON u.slot_id = s.id "
+                  "WHERE s.peer_id = ?",
             params=(peer_id,)
     ):
         yield ip, port
+
+
+def get_all_peer_directions() -> Generator[Tuple[str, int], None, None]:
+    for ip, port in fetch_query(
+            query="SELECT DISTINCT u.ip, u.port FROM slot s "
+                  "JOIN uri u ON u.slot_id = s.id "
+                  "WHERE s.peer_id IS NOT NULL"
+    ):
+        yield ip, port
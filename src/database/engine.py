@@ -0,0 +1,228 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty
+from typing import Callable, Generator, Iterable, List, Optional
+
+from src.database.gas_functions import register_gas_functions
+from src.utils.env import EnvManager
+from src.utils.singleton import Singleton
+
+env_manager = EnvManager()
+
+DATABASE_FILE = env_manager.get_env("DATABASE_FILE")
+DATABASE_READ_POOL_SIZE = int(env_manager.get_env("DATABASE_READ_POOL_SIZE"))
+DATABASE_BUSY_TIMEOUT = env_manager.get_env("DATABASE_BUSY_TIMEOUT")
+DATABASE_STATEMENT_CACHE_SIZE = int(env_manager.get_env("DATABASE_STATEMENT_CACHE_SIZE"))
+
+# Statements that never modify the database, so they can run on a read connection.
+READ_ONLY_STATEMENTS = ("SELECT", "EXPLAIN")
+
+
+def is_read_only(query: str) -> bool:
+    """Returns True if the statement can be served by a read-only connection."""
+    return query.lstrip().upper().startswith(READ_ONLY_STATEMENTS)
+
+
+class QueryResult:
+    """
+    Materialized result of a statement.
+
+    The rows are fetched before the connection goes back to the pool, so the result can be consumed
+    from any thread without holding a connection. It keeps the part of the sqlite3.Cursor interface
+    used by the access layer (fetchone, fetchall, iteration, lastrowid and rowcount).
+    """
+
+    def __init__(self, rows: List[sqlite3.Row], lastrowid: Optional[int], rowcount: int):
+        self._rows = rows
+        self._index = 0
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+    def fetchone(self) -> Optional[sqlite3.Row]:
+        if self._index >= len(self._rows):
+            return None
+        row = self._rows[self._index]
+        self._index += 1
+        return row
+
+    def fetchall(self) -> List[sqlite3.Row]:
+        rows = self._rows[self._index:]
+        self._index = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+
+class SQLiteEngine(metaclass=Singleton):
+    """
+    Connection pool for the node database, shared by SQLConnection and the query_interface access functions.
+
+    The database runs in WAL mode, so readers do not block the writer and the writer does not block readers.
+     - Read-only statements are served by a bounded pool of `query_only` connections, so they run concurrently
+       across the gRPC workers and the manager thread.
+     - Every other statement goes through the single write connection, serialized by a lock since SQLite only
+       admits one writer at a time. It runs in autocommit mode, so each statement is committed on its own and
+       SELECTs never issue a commit.
+     - transaction() opens a BEGIN IMMEDIATE unit of work on the write connection. Every statement issued by
+       the same thread inside it, reads included, runs on that connection and is committed once at the end.
+    Connections live for the whole process, so the prepared statements cached on each of them are reused
+    across calls instead of paying the connect and parse costs on every query.
+    """
+
+    def __init__(self, database_file: str = DATABASE_FILE, read_pool_size: int = DATABASE_READ_POOL_SIZE):
+        self._database_file = database_file
+        self._readers: Queue = Queue()
+        self._reader_slots = threading.BoundedSemaphore(read_pool_size)
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.Lock()
+        self._local = threading.local()  # Holds the write connection while the thread is inside a transaction.
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self._database_file,
+            timeout=DATABASE_BUSY_TIMEOUT,
+            check_same_thread=False,
+            isolation_level=None,  # Autocommit, transactions are opened explicitly.
+            cached_statements=DATABASE_STATEMENT_CACHE_SIZE  # Prepared statements reused per connection.
+        )
+        connection.row_factory = sqlite3.Row
+        register_gas_functions(connection)
+        return connection
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        # Must be called with the writer lock held.
+        if self._writer is None:
+            self._writer = self._connect()
+            self._writer.execute("PRAGMA journal_mode=WAL")
+            # On WAL mode NORMAL is durable across application crashes and avoids a fsync per commit.
+            self._writer.execute("PRAGMA synchronous=NORMAL")
+        return self._writer
+
+    @contextmanager
+    def _reader(self) -> Generator[sqlite3.Connection, None, None]:
+        self._reader_slots.acquire()
+        try:
+            try:
+                connection = self._readers.get_nowait()
+            except Empty:
+                connection = self._connect()
+                connection.execute("PRAGMA query_only=ON")
+            try:
+                yield connection
+            finally:
+                self._readers.put(connection)
+        finally:
+            self._reader_slots.release()
+
+    @staticmethod
+    def _run(connection: sqlite3.Connection, query: str, params=()) -> QueryResult:
+        cursor = connection.execute(query, params)
+        try:
+            return QueryResult(rows=cursor.fetchall(), lastrowid=cursor.lastrowid, rowcount=cursor.rowcount)
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self) -> Generator[sqlite3.Connection, None, None]:
+        """
+        Unit of work with BEGIN IMMEDIATE semantics.
+
+        The write lock is taken when the unit of work starts, so a read-modify-write inside it can not interleave
+        with other writers. It commits on exit and rolls back if an exception is raised. Nested calls on the same
+        thread join the outermost transaction.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            yield connection
+            return
+
+        with self._writer_lock:
+            connection = self._writer_connection()
+            connection.execute("BEGIN IMMEDIATE")
+            self._local.connection = connection
+            self._local.callbacks = []
+            try:
+                yield connection
+            except BaseException:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                raise
+            else:
+                connection.execute("COMMIT")
+            finally:
+                self._local.connection = None
+                callbacks, self._local.callbacks = self._local.callbacks, []
+                for callback in callbacks:
+                    callback()
+
+    def in_transaction(self) -> bool:
+        """Returns True if the current thread is inside a unit of work."""
+        return getattr(self._local, "connection", None) is not None
+
+    def after_transaction(self, callback: Callable[[], None]):
+        """
+        Runs the callback once the unit of work of the current thread ends, committed or rolled back,
+        or right away outside of a unit of work.
+        """
+        if self.in_transaction():
+            self._local.callbacks.append(callback)
+        else:
+            callback()
+
+    def execute(self, query: str, params=()) -> QueryResult:
+        """
+        Executes a statement on the appropriate connection.
+
+        Args:
+            query (str): The SQL query to execute.
+            params (tuple): The parameters to bind to the query.
+
+        Returns:
+            QueryResult: The materialized result of the statement.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return self._run(connection, query, params)
+
+        if is_read_only(query):
+            with self._reader() as connection:
+                return self._run(connection, query, params)
+
+        with self._writer_lock:
+            return self._run(self._writer_connection(), query, params)
+
+    def executemany(self, query: str, seq_of_params: Iterable) -> int:
+        """
+        Executes a write statement once per parameter set, all of them in a single transaction.
+
+        Args:
+            query (str): The SQL statement to execute.
+            seq_of_params (Iterable): The parameter sets to bind to the statement.
+
+        Returns:
+            int: The total number of modified rows.
+        """
+        with self.transaction() as connection:
+            cursor = connection.executemany(query, seq_of_params)
+            try:
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    def close(self):
+        """Closes every pooled connection."""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except Empty:
+                break
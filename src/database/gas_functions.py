@@ -0,0 +1,71 @@
+"""
+Gas ledger arithmetic.
+
+Gas amounts are stored as decimal integer text, so a balance keeps every digit whatever its size
+(SQLite integers are limited to 64 bits). These functions are registered on every database connection,
+so a balance can be checked and modified by a single UPDATE statement instead of a read and a write.
+"""
+import sqlite3
+from typing import Callable, Dict, Optional, Tuple, Union
+
+GasValue = Optional[Union[str, int]]
+
+
+def _to_int(gas: GasValue) -> int:
+    return int(gas) if gas is not None else 0
+
+
+def gas_add(gas: GasValue, amount: GasValue) -> str:
+    return str(_to_int(gas) + _to_int(amount))
+
+
+def gas_sub(gas: GasValue, amount: GasValue) -> str:
+    return str(_to_int(gas) - _to_int(amount))
+
+
+def gas_cmp(gas: GasValue, amount: GasValue) -> int:
+    """Returns -1, 0 or 1 if gas is lower, equal or greater than amount."""
+    a, b = _to_int(gas), _to_int(amount)
+    return (a > b) - (a < b)
+
+
+def gas_accrued(rate: GasValue, since: Optional[float], until: float, period: float) -> str:
+    """
+    Gas accrued at `rate` gas per `period` seconds from `since` to `until`, rounded down.
+    The elapsed time is taken with millisecond resolution so a big rate keeps every digit.
+    """
+    if since is None or until <= since:
+        return "0"
+    return str(_to_int(rate) * round((until - since) * 1000) // round(period * 1000))
+
+
+def gas_combine(mantissa: Optional[int], exponent: Optional[int]) -> str:
+    """Converts the legacy mantissa and exponent columns into the decimal representation."""
+    return str(_to_int(mantissa) * (10 ** _to_int(exponent)))
+
+
+SQL_FUNCTIONS: Dict[str, Tuple[int, Callable]] = {
+    "gas_add": (2, gas_add),
+    "gas_sub": (2, gas_sub),
+    "gas_cmp": (2, gas_cmp),
+    "gas_combine": (2, gas_combine),
+    "gas_accrued": (4, gas_accrued),
+}
+
+
+def register_gas_functions(connection: sqlite3.Connection):
+    """Registers the gas arithmetic functions on a connection."""
+    for name, (num_params, function) in SQL_FUNCTIONS.items():
+        connection.create_function(name, num_params, function, deterministic=True)
+
+
+def to_scientific_notation(gas: GasValue, precision: int = 3) -> str:
+    """
+    Formats a gas amount in scientific notation without converting it to float,
+    so amounts beyond the float range are printed as well.
+    """
+    gas = _to_int(gas)
+    digits = str(abs(gas))
+    sign = "-" if gas < 0 else ""
+    decimals = digits[1:precision + 1].rstrip("0")
+    return f"{sign}{digits[0]}{'.' + decimals if decimals else ''}e{len(digits) - 1}"
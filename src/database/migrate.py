@@ -1,11 +1,14 @@
 import sqlite3
 import os
+from typing import Callable, List, NamedTuple
+from src.database.gas_functions import register_gas_functions
 from src.utils.env import EnvManager
 
 env_manager = EnvManager()
 
 DATABASE_FILE = env_manager.get_env("DATABASE_FILE")
 STORAGE = env_manager.get_env("STORAGE")
+DATABASE_BUSY_TIMEOUT = env_manager.get_env("DATABASE_BUSY_TIMEOUT")
 
 def create_directory(path):
     """Ensure the storage directory exists."""
@@ -18,7 +21,9 @@ def create_directory(path):
 def connect_to_database(db_file):
     """Connect to the SQLite database."""
     try:
-        conn = sqlite3.connect(db_file)
+        # Autocommit, the migration runner opens its own transaction.
+        conn = sqlite3.connect(db_file, timeout=DATABASE_BUSY_TIMEOUT, isolation_level=None)
+        register_gas_functions(conn)
         print("Connected to database.")
         return conn
     except sqlite3.Error as e:
@@ -33,20 +38,19 @@ def create_tables(cursor):
                 id TEXT PRIMARY KEY,
                 protocol_stack BLOB,
                 client_id TEXT,
-                gas_mantissa INTEGER,
-                gas_exponent INTEGER,
+                gas TEXT NOT NULL DEFAULT '0',
                 gas_last_update DATETIME DEFAULT NULL,
                 reputation_proof_id TEXT,
                 reputation_score INTEGER,
                 reputation_index INTEGER,
-                last_index_on_ledger INTEGER
+                last_index_on_ledger INTEGER,
+                instance_json TEXT
             )
         ''',
         "clients": '''
             CREATE TABLE IF NOT EXISTS clients (
                 id TEXT PRIMARY KEY,
-                gas_mantissa INTEGER,
-                gas_exponent INTEGER,
+                gas TEXT NOT NULL DEFAULT '0',
                 last_usage FLOAT NULL
             )
         ''',
@@ -108,10 +112,16 @@ def create_tables(cursor):
                 id TEXT PRIMARY KEY,
                 ip TEXT,
                 father_id TEXT,
-                gas_mantissa INTEGER,
-                gas_exponent INTEGER,
+                gas TEXT NOT NULL DEFAULT '0',
                 mem_limit INTEGER,
-                serialized_instance TEXT
+                serialized_instance TEXT,
+                gas_rate TEXT NOT NULL DEFAULT '0',
+                gas_settled_at FLOAT,
+                cpu_period INTEGER,
+                cpu_quota INTEGER,
+                blkio_weight INTEGER,
+                min_mem_limit INTEGER,
+                max_mem_limit INTEGER
             )
         ''',
         "external_services": '''
@@ -149,6 +159,19 @@ def create_tables(cursor):
                 cost REAL
             )
         ''',
+        "energy_consumption_rollup": '''
+            CREATE TABLE IF NOT EXISTS energy_consumption_rollup (
+                resolution INTEGER NOT NULL,  -- Bucket length in seconds.
+                bucket INTEGER NOT NULL,  -- Bucket start, in seconds since the epoch.
+                samples INTEGER NOT NULL,
+                cpu_percent REAL NOT NULL,  -- Sums over the samples, the averages are sum / samples.
+                memory_usage REAL NOT NULL,
+                power_consumption REAL NOT NULL,
+                max_power_consumption REAL NOT NULL,
+                cost REAL NOT NULL,
+                PRIMARY KEY (resolution, bucket)
+            ) WITHOUT ROWID
+        ''',
         "monitoring_config": '''
             CREATE TABLE IF NOT EXISTS monitoring_config (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -166,7 +189,195 @@ def create_tables(cursor):
         except sqlite3.Error as e:
             print(f"Error creating '{table_name}' table: {e}")
 
-def migrate():
+def upgrade_gas_columns(cursor):
+    """
+    Moves the gas balances of databases created with the mantissa/exponent representation
+    to the decimal text `gas` column.
+    """
+    for table_name in ("peer", "clients", "internal_services"):
+        columns = [row[1] for row in cursor.execute(f"PRAGMA table_info({table_name})")]
+        if "gas" in columns or "gas_mantissa" not in columns:
+            continue
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN gas TEXT NOT NULL DEFAULT '0'")
+        cursor.execute(f"UPDATE {table_name} SET gas = gas_combine(gas_mantissa, gas_exponent)")
+        print(f"Upgraded gas column of '{table_name}' table.")
+
+def create_indexes(cursor):
+    """
+    Create the secondary indexes used by the request path lookups.
+    Where it is cheap the index also holds the selected columns, so the lookup never reads the table.
+    """
+    indexes = {
+        # uri_exists (ip, port) and get_peer_id_by_ip (ip -> slot_id).
+        "idx_uri_ip_port": "CREATE INDEX IF NOT EXISTS idx_uri_ip_port ON uri (ip, port, slot_id)",
+        # get_peer_directions (slot_id -> ip, port).
+        "idx_uri_slot": "CREATE INDEX IF NOT EXISTS idx_uri_slot ON uri (slot_id, ip, port)",
+        # get_peer_directions and get_peer_id_by_ip (peer_id <-> slot id, the rowid is part of the index).
+        "idx_slot_peer": "CREATE INDEX IF NOT EXISTS idx_slot_peer ON slot (peer_id)",
+        # get_internal_service_id_by_uri (container ip -> id).
+        "idx_internal_services_ip": "CREATE INDEX IF NOT EXISTS idx_internal_services_ip ON internal_services (ip, id)",
+        # get_token_by_hashed_token (token_hash -> token).
+        "idx_external_services_token_hash": "CREATE INDEX IF NOT EXISTS idx_external_services_token_hash "
+                                            "ON external_services (token_hash, token)",
+        # get_deposit_tokens (status).
+        "idx_deposit_tokens_status": "CREATE INDEX IF NOT EXISTS idx_deposit_tokens_status ON deposit_tokens (status)",
+    }
+
+    for index_name, index_sql in indexes.items():
+        cursor.execute(index_sql)
+        print(f"Created '{index_name}' index.")
+
+def cache_peer_instances(cursor):
+    """
+    Add the cached instance JSON of each peer, submitted with its reputation to the ledger.
+    The triggers reset the cache of a peer whenever its protocol stack, slots or URIs change,
+    so it is rebuilt on the next submission.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(peer)")]
+    if "instance_json" not in columns:
+        cursor.execute("ALTER TABLE peer ADD COLUMN instance_json TEXT")
+
+    reset = "UPDATE peer SET instance_json = NULL WHERE id = {peer_id};"
+    slot_peer = "(SELECT peer_id FROM slot WHERE id = {row}.slot_id)"
+    triggers = {
+        "trg_peer_protocol_stack": ("AFTER UPDATE OF protocol_stack ON peer",
+                                    reset.format(peer_id="NEW.id")),
+        "trg_slot_insert": ("AFTER INSERT ON slot", reset.format(peer_id="NEW.peer_id")),
+        "trg_slot_update": ("AFTER UPDATE ON slot",
+                            reset.format(peer_id="OLD.peer_id") + reset.format(peer_id="NEW.peer_id")),
+        "trg_slot_delete": ("AFTER DELETE ON slot", reset.format(peer_id="OLD.peer_id")),
+        "trg_uri_insert": ("AFTER INSERT ON uri", reset.format(peer_id=slot_peer.format(row="NEW"))),
+        "trg_uri_update": ("AFTER UPDATE ON uri",
+                           reset.format(peer_id=slot_peer.format(row="OLD")) +
+                           reset.format(peer_id=slot_peer.format(row="NEW"))),
+        "trg_uri_delete": ("AFTER DELETE ON uri", reset.format(peer_id=slot_peer.format(row="OLD"))),
+    }
+
+    for trigger_name, (event, body) in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {trigger_name} {event} BEGIN {body} END")
+        print(f"Created '{trigger_name}' trigger.")
+
+def create_energy_indexes(cursor):
+    """
+    Index the energy samples by time, used by the aggregate queries and the retention policy.
+    The timestamps are stored as seconds since the epoch.
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_energy_consumption_timestamp ON energy_consumption (timestamp)")
+    print("Created 'idx_energy_consumption_timestamp' index.")
+
+def create_client_expiry_index(cursor):
+    """
+    Index the clients by the time they ran out of gas, so the expiry sweep only reads the expired ones.
+    The clients with gas have no last_usage (NULL), and are never matched by the sweep range.
+    """
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_last_usage ON clients (last_usage)")
+    print("Created 'idx_clients_last_usage' index.")
+
+def add_gas_accrual_columns(cursor):
+    """
+    Add the maintenance rate of each internal service and the time its balance was last settled,
+    the balance is charged lazily from them instead of on every manager tick.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(internal_services)")]
+    if "gas_rate" not in columns:
+        cursor.execute("ALTER TABLE internal_services ADD COLUMN gas_rate TEXT NOT NULL DEFAULT '0'")
+    if "gas_settled_at" not in columns:
+        cursor.execute("ALTER TABLE internal_services ADD COLUMN gas_settled_at FLOAT")
+    print("Added the gas accrual columns to 'internal_services' table.")
+
+def add_cpu_and_io_columns(cursor):
+    """
+    Add the CPU quota and block I/O weight of each internal service, enforced on its container and priced
+    with its memory limit.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(internal_services)")]
+    for column in ("cpu_period", "cpu_quota", "blkio_weight"):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE internal_services ADD COLUMN {column} INTEGER")
+    print("Added the CPU and block I/O columns to 'internal_services' table.")
+
+def add_memory_range_columns(cursor):
+    """
+    Add the memory range of each internal service, its limit is scaled between them by the autoscaler.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(internal_services)")]
+    for column in ("min_mem_limit", "max_mem_limit"):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE internal_services ADD COLUMN {column} INTEGER")
+    print("Added the memory range columns to 'internal_services' table.")
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Cursor], None]
+
+
+"""
+Numbered schema steps, applied in order over the base schema of create_tables().
+Every step must be idempotent, since a database may already have part of it, and must never be renumbered
+once released. New schema changes are appended as a new step.
+"""
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Decimal text gas columns", upgrade_gas_columns),
+    Migration(2, "Indexes for the request path lookups", create_indexes),
+    Migration(3, "Cached peer instances for the ledger submission", cache_peer_instances),
+    Migration(4, "Energy consumption time series", create_energy_indexes),
+    Migration(5, "Client expiry index", create_client_expiry_index),
+    Migration(6, "Lazy gas accrual of the internal services", add_gas_accrual_columns),
+    Migration(7, "CPU and block I/O system resources", add_cpu_and_io_columns),
+    Migration(8, "Elastic memory range", add_memory_range_columns),
+]
+
+
+def get_schema_version(cursor) -> int:
+    """Returns the schema version stored on the database, 0 if it was never versioned."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = cursor.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def set_schema_version(cursor, version: int):
+    cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+
+
+def run_migrations(conn: sqlite3.Connection, dry_run: bool = False) -> List[Migration]:
+    """
+    Apply the pending migrations in a single transaction.
+
+    BEGIN IMMEDIATE waits for the running node to release the write lock instead of failing, and readers
+    keep working during the upgrade, so the node does not need to be stopped. If any step fails nothing
+    is applied. On dry run the steps are executed and rolled back, so they are validated against the
+    real data without modifying it.
+
+    Returns:
+        List[Migration]: The migrations that were (or on dry run, would be) applied.
+    """
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        create_tables(cursor)
+        current_version = get_schema_version(cursor)
+        pending = [migration for migration in MIGRATIONS if migration.version > current_version]
+        print(f"Schema version {current_version}, {len(pending)} pending migrations.")
+
+        for migration in pending:
+            print(f"Applying migration {migration.version}: {migration.description}")
+            migration.apply(cursor)
+            set_schema_version(cursor, migration.version)
+
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+    if dry_run:
+        cursor.execute("ROLLBACK")
+        print("Dry run, no change was saved.")
+    else:
+        cursor.execute("COMMIT")
+    return pending
+
+
+def migrate(dry_run: bool = False):
     """Run the migration script."""
     create_directory(STORAGE)
 
@@ -174,14 +385,16 @@ def migrate():
     if conn is None:
         return
 
-    with conn:
-        cursor = conn.cursor()
-        create_tables(cursor)
-        conn.commit()
-        print("Database schema created and saved.")
-
-    conn.close()
-    print("Database connection closed.")
+    try:
+        run_migrations(conn, dry_run=dry_run)
+        if not dry_run:
+            print("Database schema created and saved.")
+    except sqlite3.Error as e:
+        print(f"Error migrating the database, no change was saved: {e}")
+    finally:
+        conn.close()
+        print("Database connection closed.")
 
 if __name__ == "__main__":
-    migrate()
+    import sys
+    migrate(dry_run="--dry-run" in sys.argv)
@@ -3,24 +3,30 @@ import os
 import math
 import uuid
 import sqlite3
+import threading
 import time
 from hashlib import sha3_256
-from threading import Lock
 from typing import Callable, Dict, Generator, List, Tuple, Optional
 from google.protobuf.json_format import MessageToJson
 
 import grpc
 from bee_rpc import client as bee
 
-from protos import gateway_pb2_grpc, gateway_pb2, celaut_pb2
+from protos import gateway_pb2, celaut_pb2
 from src.utils import logger as log, logger
 from src.utils.env import (
     SHA3_256_ID,
     DOCKER_CLIENT,
     EnvManager
 )
+from src.database.engine import SQLiteEngine, QueryResult
+from src.database.gas_functions import to_scientific_notation
 from src.utils.singleton import Singleton
-from src.utils.utils import from_gas_amount, generate_uris_by_peer_id
+from src.utils.peer_channels import peer_stub
+from src.utils.tools.deadline_heap import DeadlineHeap
+from src.utils.tools.ttl_cache import TTLCache
+from src.utils.peer_health import PeerHealth
+from src.utils.utils import from_gas_amount
 
 env_manager = EnvManager()
 
@@ -30,98 +36,118 @@ CLIENT_EXPIRATION_TIME = env_manager.get_env("CLIENT_EXPIRATION_TIME")
 STORAGE = env_manager.get_env("STORAGE")
 DATABASE_FILE = env_manager.get_env("DATABASE_FILE")
 DEFAULT_INTIAL_GAS_AMOUNT = env_manager.get_env("DEFAULT_INTIAL_GAS_AMOUNT")
+ALLOW_GAS_DEBT = env_manager.get_env("ALLOW_GAS_DEBT")
+GAS_RATE_TOLERANCE = env_manager.get_env("GAS_RATE_TOLERANCE")
+# The maintenance rate of an internal service is the gas it is charged every MANAGER_ITERATION_TIME seconds.
+MANAGER_ITERATION_TIME = env_manager.get_env("MANAGER_ITERATION_TIME")
+DATABASE_CACHE_SIZE = int(env_manager.get_env("DATABASE_CACHE_SIZE"))
+DATABASE_CACHE_TTL = env_manager.get_env("DATABASE_CACHE_TTL")
+ENERGY_RAW_RETENTION = env_manager.get_env("ENERGY_RAW_RETENTION")
+ENERGY_MINUTE_RETENTION = env_manager.get_env("ENERGY_MINUTE_RETENTION")
+ENERGY_HOUR_RETENTION = env_manager.get_env("ENERGY_HOUR_RETENTION")
+
+# Bucket lengths in seconds of the energy consumption rollups (1 minute and 1 hour).
+ENERGY_ROLLUP_RESOLUTIONS = (60, 3600)
+
+# Balance of an internal service at :now, its stored gas minus the maintenance accrued since it was settled.
+ACCRUED_GAS = "gas_accrued(gas_rate, gas_settled_at, :now, :period)"
+GAS_BALANCE = f"gas_sub(gas, {ACCRUED_GAS})"
+
+# Maintenance periods beyond which a balance is taken as never running out, its exhaustion time is not tracked.
+# The gas column is unbounded, past this the projected time would also overflow a float.
+MAX_EXHAUSTION_PERIODS = 10 ** 12
 
-# Define a maximum mantissa and exponent
-MAX_MANTISSA = 10**3  # Adjust this limit as needed
-MAX_EXPONENT = 1024  # Adjust this limit as needed
-
-
-def _combine_gas(mantissa: int, exponent: int) -> int:
-    """
-    Combines mantissa and exponent into a single gas amount.
-
-    Args:
-        mantissa (int): The mantissa of the gas amount.
-        exponent (int): The exponent of the gas amount.
-
-    Returns:
-        int: The combined gas amount.
-    """
-    return mantissa * (10 ** exponent)
-
+class SQLConnection(metaclass=Singleton):
 
-def _validate_gas(mantissa: int, exponent: int):
-    """
-    Validates the gas amount to ensure it is within acceptable limits.
+    def __init__(self):
+        """Initializes the SQLConnection, ensuring storage directory and binding it to the pooled database engine."""
+        if not os.path.exists(STORAGE):
+            os.makedirs(STORAGE)
+        self._engine = SQLiteEngine()
+        # Read-through cache of the lookups that do not change during the life of an id
+        # (its kind, father and instance), invalidated by the methods that add or remove the id.
+        self._cache = TTLCache(max_size=DATABASE_CACHE_SIZE, ttl=DATABASE_CACHE_TTL)
+        # Projected time each internal service runs out of gas, loaded on the first use.
+        self._exhaustion = DeadlineHeap()
+        self._exhaustion_loaded = False
+        self._exhaustion_lock = threading.Lock()
 
-    Args:
-        mantissa (int): The mantissa of the gas amount.
-        exponent (int): The exponent of the gas amount.
+    def _execute(self, query: str, params=()) -> QueryResult:
+        """
+        Executes a query with the given parameters, ensuring thread safety.
 
-    Raises:
-        ValueError: If the gas amount exceeds the maximum limit.
-    """
-    if mantissa < 0 or mantissa > MAX_MANTISSA:
-        raise ValueError(f"Mantissa {mantissa} is out of acceptable range (0 to {MAX_MANTISSA})")
-    if exponent < 0 or exponent > MAX_EXPONENT:
-        raise ValueError(f"Exponent {exponent} is out of acceptable range (0 to {MAX_EXPONENT})")
+        Read-only statements run concurrently on the engine read pool, any other statement
+        is serialized on the write connection and committed.
 
+        Args:
+            query (str): The SQL query to execute.
+            params (tuple): The parameters to bind to the query.
 
-def _split_gas(gas: int) -> Tuple[int, int]:
-    """
-    Splits a gas amount into mantissa and exponent.
+        Returns:
+            QueryResult: The materialized result of the executed query.
+        """
+        return self._engine.execute(query, params)
 
-    Args:
-        gas (int): The gas amount.
+    def _executemany(self, query: str, seq_of_params) -> int:
+        """
+        Executes a write statement for every parameter set in a single transaction.
 
-    Returns:
-        Tuple[int, int]: The mantissa and exponent.
-    """
-    exponent = 0
-    while gas >= MAX_MANTISSA and exponent < MAX_EXPONENT:
-        gas //= 10
-        exponent += 1
+        Args:
+            query (str): The SQL statement to execute.
+            seq_of_params (Iterable): The parameter sets to bind to the statement.
 
-    # Ensure the mantissa is within range
-    if gas > MAX_MANTISSA:
-        raise ValueError(f"Splitted mantissa {gas} is out of acceptable range (0 to {MAX_MANTISSA})")
+        Returns:
+            int: The total number of modified rows.
+        """
+        return self._engine.executemany(query, seq_of_params)
 
-    return gas, exponent
+    def transaction(self):
+        """
+        Opens a unit of work, usage: `with sc.transaction(): ...`
 
+        Every query issued by the current thread inside the block runs on the write connection under
+        BEGIN IMMEDIATE, and is committed once when the block exits (or rolled back if it raises).
+        Nested units of work join the outermost one.
+        """
+        return self._engine.transaction()
 
-class SQLConnection(metaclass=Singleton):
-    _connection = None
-    _lock = Lock()
+    def _cached(self, key: Tuple[str, str], load: Callable):
+        """
+        Returns the cached value of the key, loading it with `load` on miss.
+        Inside a unit of work the database is read directly, since its changes are not committed yet.
+        """
+        if self._engine.in_transaction():
+            return load()
+        return self._cache.get_or_load(key, load)
 
-    def __init__(self):
-        """Initializes the SQLConnection, ensuring storage directory and establishing a database connection."""
-        if not os.path.exists(STORAGE):
-            os.makedirs(STORAGE)
-        if SQLConnection._connection is None:
-            SQLConnection._connection = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
-            SQLConnection._connection.row_factory = sqlite3.Row
+    def _invalidate(self, *ids: str):
+        """
+        Drops the cached lookups of the ids. Inside a unit of work they are dropped when it ends,
+        so a concurrent reader can not cache the values previous to the commit.
+        """
+        keys = [(kind, id) for id in ids for kind in ("kind", "father", "instance", "token")]
+        self._engine.after_transaction(lambda: self._cache.invalidate(*keys))
 
-    def _execute(self, query: str, params=()) -> sqlite3.Cursor:
+    def get_id_kind(self, id: str) -> Optional[str]:
         """
-        Executes a query with the given parameters, ensuring thread safety.
+        Resolves what an id refers to with a single lookup.
 
         Args:
-            query (str): The SQL query to execute.
-            params (tuple): The parameters to bind to the query.
+            id (str): A client id, a container id or an external service token.
 
         Returns:
-            sqlite3.Cursor: The cursor for the executed query.
+            Optional[str]: 'client', 'internal' or 'external', or None if the id is unknown.
         """
-        with SQLConnection._lock:
-            try:
-                # Create a new cursor for each execution
-                cursor = SQLConnection._connection.cursor()
-                cursor.execute(query, params)
-                SQLConnection._connection.commit()
-                return cursor
-            except sqlite3.Error as e:
-                SQLConnection._connection.rollback()
-                raise e
+        def load() -> Optional[str]:
+            row = self._execute('''
+                SELECT 'client' FROM clients WHERE id = :id
+                UNION ALL SELECT 'internal' FROM internal_services WHERE id = :id
+                UNION ALL SELECT 'external' FROM external_services WHERE token = :id
+                LIMIT 1
+            ''', {'id': id}).fetchone()
+            return row[0] if row else None
+
+        return self._cached(("kind", id), load)
 
     # Client Methods
 
@@ -134,13 +160,12 @@ class SQLConnection(metaclass=Singleton):
             gas (int): The gas amount.
             last_usage (Optional[float]): The last usage time.
         """
-        gas_mantissa, gas_exponent = _split_gas(gas)
-        _validate_gas(gas_mantissa, gas_exponent)
         self._execute('''
-            INSERT INTO clients (id, gas_mantissa, gas_exponent, last_usage)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(id) DO UPDATE SET gas_mantissa=excluded.gas_mantissa, gas_exponent=excluded.gas_exponent, last_usage=excluded.last_usage
-        ''', (client_id, gas_mantissa, gas_exponent, last_usage))
+            INSERT INTO clients (id, gas, last_usage)
+            VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET gas=excluded.gas, last_usage=excluded.last_usage
+        ''', (client_id, str(gas), last_usage))
+        self._invalidate(client_id)
 
     def get_clients(self) -> List[dict]:
         """
@@ -150,24 +175,14 @@ class SQLConnection(metaclass=Singleton):
             List[dict]: A list of dictionaries containing client details.
         """
         try:
-            result = self._execute("SELECT id, gas_mantissa, gas_exponent, last_usage FROM clients")
-            clients = [{'id': row[0], 'gas_mantissa': row[1], 'gas_exponent': row[2], 'last_usage': row[3]} for row in result.fetchall()]
+            result = self._execute("SELECT id, gas, last_usage FROM clients")
+            clients = [{'id': row[0], 'gas': int(row[1]), 'last_usage': row[2]} for row in result.fetchall()]
             logger.LOGGER(f'Found clients: {clients}')
             return clients
         except sqlite3.Error as e:
             logger.LOGGER(f'Error fetching clients: {e}')
             return []
 
-    def get_clients_id(self) -> List[str]:
-        """
-        Fetches all client IDs from the database.
-
-        Returns:
-            List[str]: A list of client IDs.
-        """
-        result = self._execute('SELECT id FROM clients')
-        return [row['id'] for row in result.fetchall()]
-
     def client_exists(self, client_id: str) -> bool:
         """
         Checks if a client exists in the database.
@@ -178,12 +193,7 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             bool: True if the client exists, False otherwise.
         """
-        result = self._execute('''
-            SELECT COUNT(*)
-            FROM clients
-            WHERE id = ?
-        ''', (client_id,))
-        return result.fetchone()[0] > 0
+        return self.get_id_kind(client_id) == "client"
 
     def get_dev_clients(self) -> List[str]:
         """
@@ -206,14 +216,14 @@ class SQLConnection(metaclass=Singleton):
             Tuple[int, float, str]: The gas amount, last usage time and gas in scientific notation.
         """
         result = self._execute('''
-            SELECT gas_mantissa, gas_exponent, last_usage FROM clients WHERE id = ?
+            SELECT gas, last_usage FROM clients WHERE id = ?
         ''', (client_id,))
         row = result.fetchone()
         if row:
             return (
-                _combine_gas(mantissa=row['gas_mantissa'], exponent=row['gas_exponent']),
+                int(row['gas']),
                 row['last_usage'],
-                f"{row['gas_mantissa']}e{row['gas_exponent']}"
+                to_scientific_notation(row['gas'])
             )
                 
         log.LOGGER(f'Client not found: {client_id}')
@@ -224,58 +234,72 @@ class SQLConnection(metaclass=Singleton):
         self._execute('''
             DELETE FROM clients WHERE id = ?
         ''', (client_id,))
+        self._invalidate(client_id)
 
     def add_gas(self, client_id: str, gas: int = 0):
         """
-        Adds gas to a client's balance.
+        Adds gas to a client's balance with a single statement.
 
         Args:
             client_id (str): The ID of the client.
             gas (int): The amount of gas to add.
         """
-        _gas, _last_usage, _ = self.get_client_gas(client_id)
-        total_gas = _gas + gas
-        new_mantissa, new_exponent = _split_gas(total_gas)
-        _validate_gas(new_mantissa, new_exponent)
-        if _last_usage and total_gas >= CLIENT_MIN_GAS_AMOUNT_TO_RESET_EXPIRATION_TIME:
-            _last_usage = None
-        self.__update_client(client_id, new_mantissa, new_exponent, _last_usage)
+        self._execute('''
+            UPDATE clients SET
+                gas = gas_add(gas, :gas),
+                last_usage = CASE
+                    WHEN last_usage AND gas_cmp(gas_add(gas, :gas), :reset_amount) >= 0 THEN NULL
+                    ELSE last_usage
+                END
+            WHERE id = :id
+        ''', {'gas': str(gas), 'reset_amount': str(CLIENT_MIN_GAS_AMOUNT_TO_RESET_EXPIRATION_TIME), 'id': client_id})
 
-    def reduce_gas(self, client_id: str, gas: int):
+    def reduce_gas(self, client_id: str, gas: int, allow_debt: bool = bool(ALLOW_GAS_DEBT)) -> bool:
         """
-        Reduces gas from a client's balance.
+        Reduces gas from a client's balance with a single conditional statement.
 
         Args:
             client_id (str): The ID of the client.
             gas (int): The amount of gas to reduce.
+            allow_debt (bool): Whether the balance is allowed to go below zero.
+
+        Returns:
+            bool: True if the gas was reduced, False if the client does not exist or has not enough gas.
         """
-        _gas, _last_usage, _ = self.get_client_gas(client_id)
-        total_gas = _gas - gas
-        new_mantissa, new_exponent = _split_gas(total_gas)
-        _validate_gas(new_mantissa, new_exponent)
-        if total_gas == 0 and _last_usage is None:
-            _last_usage = time.time()
-        self.__update_client(client_id, new_mantissa, new_exponent, _last_usage)
+        result = self._execute('''
+            UPDATE clients SET
+                gas = gas_sub(gas, :gas),
+                last_usage = CASE
+                    WHEN last_usage IS NULL AND gas_cmp(gas_sub(gas, :gas), '0') = 0 THEN :now
+                    ELSE last_usage
+                END
+            WHERE id = :id AND (:allow_debt OR gas_cmp(gas, :gas) >= 0)
+        ''', {'gas': str(gas), 'now': time.time(), 'id': client_id, 'allow_debt': allow_debt})
+        return result.rowcount > 0
 
-    def client_expired(self, client_id: str) -> bool:
+    def delete_expired_clients(self, now: Optional[float] = None) -> List[str]:
         """
-        Checks if a client has expired.
+        Deletes every expired client with a single statement, resolved on the last_usage index.
+        A client is expired when it has been without enough gas for CLIENT_EXPIRATION_TIME seconds.
 
         Args:
-            client_id (str): The ID of the client.
+            now (Optional[float]): The reference time, the current time by default.
 
         Returns:
-            bool: True if the client has expired, False otherwise.
+            List[str]: The ids of the deleted clients.
         """
-        _gas, _last_usage, _ = self.get_client_gas(client_id)
-        return _last_usage is not None and ((time.time() - _last_usage) >= CLIENT_EXPIRATION_TIME)
-
-    def __update_client(self, client_id: str, mantissa: int, exponent: int, last_usage: float):
-        """Updates the gas and last usage time for a client."""
-        _validate_gas(mantissa, exponent)
-        self._execute('''
-            UPDATE clients SET gas_mantissa = ?, gas_exponent = ?, last_usage = ? WHERE id = ?
-        ''', (mantissa, exponent, last_usage, client_id))
+        result = self._execute('''
+            DELETE FROM clients
+            WHERE last_usage <= :expired_before AND gas_cmp(gas, :reset_amount) < 0
+            RETURNING id
+        ''', {
+            'expired_before': (now if now is not None else time.time()) - CLIENT_EXPIRATION_TIME,
+            'reset_amount': str(CLIENT_MIN_GAS_AMOUNT_TO_RESET_EXPIRATION_TIME)
+        })
+        client_ids = [row['id'] for row in result.fetchall()]
+        if client_ids:
+            self._invalidate(*client_ids)
+        return client_ids
 
     def get_gas_amount_by_client_id(self, id: str) -> int:
         """
@@ -288,11 +312,11 @@ class SQLConnection(metaclass=Singleton):
             int: The gas amount.
         """
         result = self._execute('''
-            SELECT gas_mantissa, gas_exponent FROM clients WHERE id = ?
+            SELECT gas FROM clients WHERE id = ?
         ''', (id,))
         row = result.fetchone()
         if row:
-            return row['gas_mantissa'] * (10 ** row['gas_exponent'])
+            return int(row['gas'])
         raise Exception(f'Gas amount not found for ID: {id}')
 
     # Internal Service Methods
@@ -308,29 +332,44 @@ class SQLConnection(metaclass=Singleton):
             gas (int): The gas amount.
             serialized_instance (str): Serialized celaut instance
         """
-        gas_mantissa, gas_exponent = _split_gas(gas)
-        _validate_gas(gas_mantissa, gas_exponent)
         self._execute('''
-            INSERT INTO internal_services (id, ip, father_id, gas_mantissa, gas_exponent, mem_limit, serialized_instance)
+            INSERT INTO internal_services (id, ip, father_id, gas, mem_limit, serialized_instance, gas_settled_at)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (container_id, container_ip, father_id, gas_mantissa, gas_exponent, 0, serialized_instance))
+        ''', (container_id, container_ip, father_id, str(gas), 0, serialized_instance, time.time()))
+        self._invalidate(container_id)
         log.LOGGER(f'Saved service {container_id} as dependency of {father_id}')
 
-    def update_sys_req(self, id: str, mem_limit: Optional[int]) -> bool:
+    def update_sys_req(self, id: str, mem_limit: Optional[int], cpu_period: Optional[int] = None,
+                       cpu_quota: Optional[int] = None, blkio_weight: Optional[int] = None,
+                       min_mem_limit: Optional[int] = None, max_mem_limit: Optional[int] = None) -> bool:
         """
-        Updates system requirements for an internal service.
+        Updates system requirements for an internal service. The requirements given as None are kept.
 
         Args:
             id (str): The id of the internal service.
             mem_limit (Optional[int]): The new memory limit.
+            cpu_period (Optional[int]): The new CFS period, in microseconds.
+            cpu_quota (Optional[int]): The new CFS quota, in microseconds per period.
+            blkio_weight (Optional[int]): The new block I/O weight.
+            min_mem_limit (Optional[int]): The lowest memory limit the autoscaler can set.
+            max_mem_limit (Optional[int]): The highest memory limit the autoscaler can set.
 
         Returns:
             bool: True if update was successful, False otherwise.
         """
         try:
             self._execute('''
-                UPDATE internal_services SET mem_limit = ? WHERE id = ?
-            ''', (mem_limit, id))
+                UPDATE internal_services SET
+                    mem_limit = COALESCE(:mem_limit, mem_limit),
+                    cpu_period = COALESCE(:cpu_period, cpu_period),
+                    cpu_quota = COALESCE(:cpu_quota, cpu_quota),
+                    blkio_weight = COALESCE(:blkio_weight, blkio_weight),
+                    min_mem_limit = COALESCE(:min_mem_limit, min_mem_limit),
+                    max_mem_limit = COALESCE(:max_mem_limit, max_mem_limit)
+                WHERE id = :id
+            ''', {'mem_limit': mem_limit, 'cpu_period': cpu_period, 'cpu_quota': cpu_quota,
+                  'blkio_weight': blkio_weight, 'min_mem_limit': min_mem_limit, 'max_mem_limit': max_mem_limit,
+                  'id': id})
             return True
         except:
             return False
@@ -346,16 +385,33 @@ class SQLConnection(metaclass=Singleton):
             dict: A dictionary containing the system requirements.
         """
         result = self._execute('''
-            SELECT mem_limit FROM internal_services WHERE id = ?
+            SELECT mem_limit, cpu_period, cpu_quota, blkio_weight FROM internal_services WHERE id = ?
         ''', (id,))
         row = result.fetchone()
         if row:
             return row
         raise Exception(f'Internal service {id}')
 
+    def get_all_internal_service_sys_reqs(self) -> Dict[str, Dict[str, int]]:
+        """
+        Fetches the system requirements of every internal service.
+
+        Returns:
+            Dict[str, Dict[str, int]]: The mem_limit, cpu_period, cpu_quota and blkio_weight by id (0 if not set).
+        """
+        result = self._execute('''
+            SELECT id, mem_limit, cpu_period, cpu_quota, blkio_weight FROM internal_services
+        ''')
+        return {
+            row['id']: {
+                key: row[key] or 0 for key in ('mem_limit', 'cpu_period', 'cpu_quota', 'blkio_weight')
+            }
+            for row in result.fetchall()
+        }
+
     def get_internal_service_gas(self, id: str) -> int:
         """
-        Retrieves the gas amount for an internal service.
+        Retrieves the gas amount for an internal service, with the maintenance accrued until now discounted.
 
         Args:
             id (str): The id of the internal service.
@@ -363,25 +419,138 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             int: The gas amount.
         """
-        result = self._execute('''
-            SELECT gas_mantissa, gas_exponent FROM internal_services WHERE id = ?
-        ''', (id,))
+        result = self._execute(f'''
+            SELECT {GAS_BALANCE} AS gas FROM internal_services WHERE id = :id
+        ''', {'id': id, 'now': time.time(), 'period': MANAGER_ITERATION_TIME})
         row = result.fetchone()
         if row:
-            return row['gas_mantissa'] * (10 ** row['gas_exponent'])
+            return int(row['gas'])
         raise Exception(f'Internal service {id}')
 
-    def get_all_internal_service_ids(self) -> List[str]:
+    def get_memory_ranges(self) -> Dict[str, Tuple[int, int, int]]:
         """
-        Fetches all ids of internal services.
+        Fetches the memory range of the internal services whose limit can be scaled (its maximum is above its minimum).
 
         Returns:
-            List[str]: A list of ids.
+            Dict[str, Tuple[int, int, int]]: The current, minimum and maximum memory limit by id.
         """
         result = self._execute('''
-            SELECT father_id, ip, id FROM internal_services
+            SELECT id, mem_limit, min_mem_limit, max_mem_limit FROM internal_services
+            WHERE max_mem_limit > min_mem_limit
         ''')
-        return [row['id'] for row in result.fetchall()]
+        return {
+            row['id']: (row['mem_limit'] or 0, row['min_mem_limit'], row['max_mem_limit'])
+            for row in result.fetchall()
+        }
+
+    def get_all_internal_service_mem_limits(self) -> Dict[str, int]:
+        """
+        Fetches the memory limit of every internal service.
+
+        Returns:
+            Dict[str, int]: The memory limit by id.
+        """
+        result = self._execute('''
+            SELECT id, mem_limit FROM internal_services
+        ''')
+        return {row['id']: row['mem_limit'] or 0 for row in result.fetchall()}
+
+    def set_gas_rates(self, rates: Dict[str, int], tolerance: float = GAS_RATE_TOLERANCE) -> int:
+        """
+        Sets the maintenance rate of the internal services, settling the balance accrued with the previous rate.
+        Only the rates that differ by more than `tolerance` (relative) from the stored one are written,
+        so the write volume follows the rate changes instead of the manager ticks.
+
+        Args:
+            rates (Dict[str, int]): The gas charged each MANAGER_ITERATION_TIME seconds by container id.
+            tolerance (float): The relative variation under which a rate is not updated.
+
+        Returns:
+            int: The number of updated rates.
+        """
+        current = {
+            row['id']: int(row['gas_rate'])
+            for row in self._execute('SELECT id, gas_rate FROM internal_services').fetchall()
+        }
+        changed = {
+            id: rate for id, rate in rates.items()
+            if id in current and rate != current[id] and abs(rate - current[id]) > tolerance * current[id]
+        }
+        if not changed:
+            return 0
+
+        now = time.time()
+        self._executemany(f'''
+            UPDATE internal_services SET gas = {GAS_BALANCE}, gas_settled_at = :now, gas_rate = :rate
+            WHERE id = :id
+        ''', (
+            {'id': id, 'rate': str(rate), 'now': now, 'period': MANAGER_ITERATION_TIME}
+            for id, rate in changed.items()
+        ))
+        self._project_exhaustion(*changed)
+        return len(changed)
+
+    def settle_containers(self, ids: List[str]) -> Dict[str, int]:
+        """
+        Charges the maintenance accrued by several internal services in one unit of work.
+
+        Args:
+            ids (List[str]): The ids of the internal services.
+
+        Returns:
+            Dict[str, int]: The settled balance by id, the services that do not exist are left out.
+        """
+        if not ids:
+            return {}
+        now = time.time()
+        balances = {}
+        with self.transaction():
+            for id in ids:
+                row = self._execute(f'''
+                    UPDATE internal_services SET gas = {GAS_BALANCE}, gas_settled_at = :now
+                    WHERE id = :id RETURNING gas
+                ''', {'id': id, 'now': now, 'period': MANAGER_ITERATION_TIME}).fetchone()
+                if row:
+                    balances[id] = int(row['gas'])
+            self._project_exhaustion(*balances)
+        return balances
+
+    def pop_exhausted_containers(self, until: float) -> List[str]:
+        """
+        Returns the internal services projected to run out of gas by `until` (epoch seconds), earliest first.
+        They are not tracked again until their balance or rate changes, settle_containers() does it.
+        """
+        if not self._exhaustion_loaded:
+            self.__schedule_exhaustion()
+            self._exhaustion_loaded = True
+        return self._exhaustion.pop_due(until)
+
+    def _project_exhaustion(self, *ids: str):
+        """Updates the projected exhaustion time of the ids once the current unit of work ends."""
+        self._engine.after_transaction(lambda: self.__schedule_exhaustion(ids))
+
+    def __schedule_exhaustion(self, ids: Optional[Tuple[str, ...]] = None):
+        # Without ids every internal service is scheduled. The services with gas debt allowed are not tracked
+        # once their balance is exhausted, they are not pruned for it.
+        with self._exhaustion_lock:
+            if ids is not None and not ids:
+                return
+            query = 'SELECT id, gas, gas_rate, gas_settled_at FROM internal_services'
+            params = ()
+            if ids is not None and len(ids) <= 500:
+                query += f" WHERE id IN ({','.join('?' * len(ids))})"
+                params = tuple(ids)
+            rows = {row['id']: row for row in self._execute(query, params).fetchall()}
+
+            for id in (ids if ids is not None else rows):
+                row = rows.get(id)
+                rate = int(row['gas_rate']) if row else 0
+                gas = int(row['gas']) if row else 0
+                if rate <= 0 or (gas <= 0 and ALLOW_GAS_DEBT) or gas // rate >= MAX_EXHAUSTION_PERIODS:
+                    self._exhaustion.discard(id)
+                    continue
+                settled_at = row['gas_settled_at'] or time.time()
+                self._exhaustion.schedule(id, settled_at + max(gas, 0) * MANAGER_ITERATION_TIME / rate)
 
     def update_gas_to_container(self, id: str, gas: int):
         """
@@ -391,11 +560,45 @@ class SQLConnection(metaclass=Singleton):
             id (str): The id of the container.
             gas (int): The new gas amount.
         """
-        gas_mantissa, gas_exponent = _split_gas(gas)
-        _validate_gas(gas_mantissa, gas_exponent)
         self._execute('''
-            UPDATE internal_services SET gas_mantissa = ?, gas_exponent = ? WHERE id = ?
-        ''', (gas_mantissa, gas_exponent, id))
+            UPDATE internal_services SET gas = ?, gas_settled_at = ? WHERE id = ?
+        ''', (str(gas), time.time(), id))
+        self._project_exhaustion(id)
+
+    def add_gas_to_container(self, id: str, gas: int):
+        """
+        Adds gas to the balance of a container with a single statement, settling its accrued maintenance.
+
+        Args:
+            id (str): The id of the container.
+            gas (int): The amount of gas to add.
+        """
+        self._execute(f'''
+            UPDATE internal_services SET gas = gas_add({GAS_BALANCE}, :gas), gas_settled_at = :now
+            WHERE id = :id
+        ''', {'gas': str(gas), 'id': id, 'now': time.time(), 'period': MANAGER_ITERATION_TIME})
+        self._project_exhaustion(id)
+
+    def reduce_gas_to_container(self, id: str, gas: int, allow_debt: bool = bool(ALLOW_GAS_DEBT)) -> bool:
+        """
+        Reduces gas from the balance of a container with a single conditional statement,
+        settling its accrued maintenance.
+
+        Args:
+            id (str): The id of the container.
+            gas (int): The amount of gas to reduce.
+            allow_debt (bool): Whether the balance is allowed to go below zero.
+
+        Returns:
+            bool: True if the gas was reduced, False if the container does not exist or has not enough gas.
+        """
+        result = self._execute(f'''
+            UPDATE internal_services SET gas = gas_sub({GAS_BALANCE}, :gas), gas_settled_at = :now
+            WHERE id = :id AND (:allow_debt OR gas_cmp({GAS_BALANCE}, :gas) >= 0)
+        ''', {'gas': str(gas), 'id': id, 'allow_debt': allow_debt, 'now': time.time(), 'period': MANAGER_ITERATION_TIME})
+        if result.rowcount > 0:
+            self._project_exhaustion(id)
+        return result.rowcount > 0
 
     def container_exists(self, id: str) -> bool:
         """
@@ -407,12 +610,7 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             bool: True if the container exists, False otherwise.
         """
-        result = self._execute('''
-            SELECT COUNT(*)
-            FROM internal_services
-            WHERE id = ?
-        ''', (id,))
-        return result.fetchone()[0] > 0
+        return self.get_id_kind(id) == "internal"
 
     def purge_internal(self, id: str):
         """
@@ -425,6 +623,8 @@ class SQLConnection(metaclass=Singleton):
         self._execute('''
             DELETE FROM internal_services WHERE id = ?
         ''', (id,))
+        self._invalidate(id)
+        self._engine.after_transaction(lambda: self._exhaustion.discard(id))
 
     def get_internal_father_id(self, id: str) -> str:
         """
@@ -436,13 +636,16 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             str: The father_id of the internal service, or an empty string if not found.
         """
-        cursor = self._execute('''
-            SELECT father_id
-            FROM internal_services
-            WHERE id = ?
-        ''', (id,))
-        result = cursor.fetchone()
-        return result[0] if result else ""
+        def load() -> str:
+            cursor = self._execute('''
+                SELECT father_id
+                FROM internal_services
+                WHERE id = ?
+            ''', (id,))
+            result = cursor.fetchone()
+            return result[0] if result else ""
+
+        return self._cached(("father", id), load)
 
     def get_internal_instance(self, id: str) -> Optional[str]:
         """
@@ -454,13 +657,16 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             str: The serialized_instance of the internal service, or None if not found.
         """
-        cursor = self._execute('''
-            SELECT serialized_instance
-            FROM internal_services
-            WHERE id = ?
-        ''', (id,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+        def load() -> Optional[str]:
+            cursor = self._execute('''
+                SELECT serialized_instance
+                FROM internal_services
+                WHERE id = ?
+            ''', (id,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+        return self._cached(("instance", id), load)
 
     def get_internal_ip(self, id: str) -> Optional[str]:
         """
@@ -482,40 +688,23 @@ class SQLConnection(metaclass=Singleton):
 
     # Peer Methods
 
-    def update_reputation_peer(self, peer_id: str, amount: int) -> bool:
+    def apply_reputation_deltas(self, deltas: Dict[str, Tuple[int, int]]) -> int:
         """
-        Updates the reputation of a peer by increasing the reputation score and index.
+        Applies accumulated reputation changes to several peers in one transaction.
 
         Args:
-            peer_id (str): The ID of the peer whose reputation is to be updated.
-            amount (int): The amount to add to the reputation score.
+            deltas (Dict[str, Tuple[int, int]]): For each peer id, the amount to add to the reputation score
+                and the number of updates it stands for, which is added to the reputation index.
 
         Returns:
-            bool: True if the update was successful, False otherwise.
+            int: The number of peers updated. Ids without a peer row are ignored.
         """
-        try:
-            # Fetch current reputation score and index
-            result = self._execute('SELECT reputation_score, reputation_index FROM peer WHERE id = ?', (peer_id,))
-            row = result.fetchone()
-
-            if row:
-                current_score = row['reputation_score'] or 0  # Handle potential NULL values
-                current_index = row['reputation_index'] or 0
-
-                # Update the reputation score and index
-                new_score = current_score + amount
-                new_index = current_index + 1
-
-                self._execute('''
-                    UPDATE peer SET reputation_score = ?, reputation_index = ? WHERE id = ?
-                ''', (new_score, new_index, peer_id))
-
-                return True
-            else:
-                raise Exception(f'Peer not found: {peer_id}')
-        except Exception as e:
-            logger.LOGGER(f'Error updating reputation for peer {peer_id}: {e}')
-            return False
+        return self._executemany('''
+            UPDATE peer
+            SET reputation_score = COALESCE(reputation_score, 0) + ?,
+                reputation_index = COALESCE(reputation_index, 0) + ?
+            WHERE id = ?
+        ''', ((score, count, peer_id) for peer_id, (score, count) in deltas.items()))
 
     def get_reputation(self, peer_id: str) -> Optional[float]:
         """
@@ -561,113 +750,66 @@ class SQLConnection(metaclass=Singleton):
         """
 
         try:
-            # Fetch all peers' data along with slots, URIs, and contracts in one query
-            result = self._execute('''
-                SELECT
-                    p.id,
-                    p.reputation_proof_id,
-                    p.reputation_score,
-                    p.reputation_index,
-                    p.last_index_on_ledger,
-                    p.protocol_stack,
-                    s.internal_port,
-                    u.ip,
-                    u.port
-                FROM peer p
-                -- Joining slot table to get information about ports
-                LEFT JOIN slot s ON s.peer_id = p.id
-                -- Joining uri table to get IP and port details for each slot
-                LEFT JOIN uri u ON u.slot_id = s.id
-            ''')
-
-            rows = result.fetchall()
-
-            if not rows and not force_submit:
+            peers = self._execute('SELECT COUNT(*) AS peers, SUM(reputation_score) AS total_amount FROM peer').fetchone()
+            if not peers['peers'] and not force_submit:
                 return True
 
-            # Fetch the total sum of all reputation amounts from the table
-            total_amount_result = self._execute('SELECT SUM(reputation_score) AS total_amount FROM peer')
-            total_amount_row = total_amount_result.fetchone()
-            total_amount = total_amount_row['total_amount'] or 0
-
-            # Dictionary to store instance data (for peers with multiple slots or contracts)
-            peers_dict = {}
-            for row in rows:
-                peer_id = row['id']
-                if peer_id not in peers_dict:
-                    # Initialize the instance for this peer
-                    instance = celaut_pb2.Instance()
-
-                    # Set protocol stack if available
-                    if row['protocol_stack']:
-                        instance.api.protocol_stack.ParseFromString(row['protocol_stack'])
-
-                    # Store in the dict
-                    peers_dict[peer_id] = {
-                        'instance': instance,
-                        'reputation_proof_id': row['reputation_proof_id'],
-                        'reputation_score': row['reputation_score'] or 0,
-                        'reputation_index': row['reputation_index'] or 0,
-                        'last_index_on_ledger': row['last_index_on_ledger'] or 0
-                    }
-
-                # Add slots and URIs to the instance
-                if row['internal_port']:
-                    slot = peers_dict[peer_id]['instance'].uri_slot.add()
-                    slot.internal_port = row['internal_port']
-                    if row['ip'] and row['port']:
-                        uri = slot.uri.add()
-                        uri.ip = row['ip']
-                        uri.port = row['port']
-
-            # List to hold data for peers that need to be submitted to the ledger
             needs_submit = force_submit
-
-            if peers_dict:  # If peers are found
-                logger.LOGGER(f'Peers found in the database: {peers_dict.keys()}')
-                to_submit = []
-                token_amount = TOTAL_REPUTATION_TOKEN_AMOUNT -1  # Subtract 1 to account for the node instance
-
-                for peer_id, data in peers_dict.items():
-                    reputation_proof_id = data['reputation_proof_id']
-                    reputation_score = data['reputation_score']
-                    reputation_index = data['reputation_index']
-                    last_index_on_ledger = data['last_index_on_ledger']
-
-                    if reputation_proof_id:
-                        # Convert instance to JSON string
-                        instance_json = MessageToJson(data['instance'])
-
-                        # Calculate the percentage of the total reputation token amount
-                        if reputation_index - last_index_on_ledger >= env_manager.get_env("LEDGER_REPUTATION_SUBMISSION_THRESHOLD"):
-                            logger.LOGGER(f'Peer {peer_id} with proof {reputation_proof_id} meets the submission threshold.')
-                            needs_submit = True
-                            percentage_amount = (reputation_score / total_amount) * token_amount if total_amount else 0
-                            to_submit.append((reputation_proof_id, percentage_amount, instance_json))
-
-                        # Proof percentage doesn't need to be changed itself, but needs to be updated if others do.
-                        elif last_index_on_ledger > 0:
-                            logger.LOGGER(f'Peer {peer_id} with proof {reputation_proof_id} does not meet the submission threshold, but is included in the proof.')
-                            percentage_amount = (reputation_score / total_amount) * token_amount if total_amount else 0
-                            to_submit.append((reputation_proof_id, percentage_amount, instance_json))
-
+            if peers['peers']:
+                # Threshold eligibility and percentages are computed by the database, only the proofs
+                # to be submitted are returned.
+                rows = self._execute('''
+                    SELECT
+                        id,
+                        reputation_proof_id,
+                        COALESCE(reputation_index, 0) AS reputation_index,
+                        COALESCE(reputation_index, 0) - COALESCE(last_index_on_ledger, 0) >= :threshold
+                            AS meets_threshold,
+                        CASE WHEN :total_amount THEN
+                            CAST(COALESCE(reputation_score, 0) AS REAL) / :total_amount * :token_amount
+                        ELSE 0 END AS percentage_amount,
+                        instance_json
+                    FROM peer
+                    WHERE reputation_proof_id IS NOT NULL AND reputation_proof_id != ''
+                        AND (
+                            COALESCE(reputation_index, 0) - COALESCE(last_index_on_ledger, 0) >= :threshold
+                            -- Proof percentage doesn't need to be changed itself, but needs to be updated if others do.
+                            OR COALESCE(last_index_on_ledger, 0) > 0
+                        )
+                ''', {
+                    'threshold': env_manager.get_env("LEDGER_REPUTATION_SUBMISSION_THRESHOLD"),
+                    'total_amount': peers['total_amount'] or 0,
+                    'token_amount': TOTAL_REPUTATION_TOKEN_AMOUNT - 1  # Subtract 1 to account for the node instance
+                }).fetchall()
+
+                eligible = sum(1 for row in rows if row['meets_threshold'])
+                needs_submit = needs_submit or eligible > 0
+                logger.LOGGER(f'{peers["peers"]} peers found in the database, {eligible} meet the submission '
+                              f'threshold and {len(rows) - eligible} are included in the proof.')
+
+                instances = self.__peer_instances_json(
+                    peer_ids=[row['id'] for row in rows if row['instance_json'] is None]
+                )
+                to_submit = [
+                    (row['reputation_proof_id'], row['percentage_amount'],
+                     row['instance_json'] if row['instance_json'] is not None else instances[row['id']])
+                    for row in rows
+                ]
                 to_submit.append((None, 1, None))  # This will be treated as a pointer to itself, used to include the node instance in the proof
 
             else:  # If no peers are found, submit the total amount of reputation tokens, but only if force_submit is True
                 logger.LOGGER('No peers found in the database.')
+                rows = []
                 to_submit = [(None, TOTAL_REPUTATION_TOKEN_AMOUNT, None)]
 
-
             # Attempt to submit the data to the ledger
             if needs_submit and to_submit:
                 success = submit(to_submit)
                 if success:
                     logger.LOGGER('Reputation proofs submitted successfully.')
                     # Update the last index on ledger for all submitted peers
-                    for peer_id, data in peers_dict.items():
-                        reputation_proof_id = data['reputation_proof_id']
-                        if reputation_proof_id and any(reputation_proof_id == _e[0] for _e in to_submit):
-                            self._execute('UPDATE peer SET last_index_on_ledger = ? WHERE id = ?', (data['reputation_index'], peer_id))
+                    self._executemany('UPDATE peer SET last_index_on_ledger = ? WHERE id = ?',
+                                      ((row['reputation_index'], row['id']) for row in rows))
                     return True
                 else:
                     logger.LOGGER('Failed to submit to ledger for some or all peers.')
@@ -679,6 +821,46 @@ class SQLConnection(metaclass=Singleton):
             logger.LOGGER(f'Error submitting to ledger: {e}')
             return False
 
+    def __peer_instances_json(self, peer_ids: List[str]) -> Dict[str, str]:
+        """
+        Builds the instance JSON of the given peers from their protocol stack, slots and URIs,
+        and caches it on the peer table. The cache is reset by the database triggers when any of them changes.
+
+        Args:
+            peer_ids (List[str]): The IDs of the peers without a cached instance.
+
+        Returns:
+            Dict[str, str]: The instance JSON of each peer.
+        """
+        instances: Dict[str, celaut_pb2.Instance] = {}
+        with self.transaction():
+            for peer_id in peer_ids:
+                instance = celaut_pb2.Instance()
+                row = self._execute('SELECT protocol_stack FROM peer WHERE id = ?', (peer_id,)).fetchone()
+                if row and row['protocol_stack']:
+                    instance.api.protocol_stack.ParseFromString(row['protocol_stack'])
+
+                slots: Dict[int, celaut_pb2.Instance.Uri_Slot] = {}
+                for row in self._execute('''
+                    SELECT s.id, s.internal_port, u.ip, u.port
+                    FROM slot s
+                    LEFT JOIN uri u ON u.slot_id = s.id
+                    WHERE s.peer_id = ?
+                ''', (peer_id,)):
+                    if not row['internal_port']:
+                        continue
+                    if row['id'] not in slots:
+                        slots[row['id']] = instance.uri_slot.add(internal_port=row['internal_port'])
+                    if row['ip'] and row['port']:
+                        slots[row['id']].uri.add(ip=row['ip'], port=row['port'])
+
+                instances[peer_id] = instance
+
+            instances_json = {peer_id: MessageToJson(instance) for peer_id, instance in instances.items()}
+            self._executemany('UPDATE peer SET instance_json = ? WHERE id = ?',
+                              ((instance_json, peer_id) for peer_id, instance_json in instances_json.items()))
+        return instances_json
+
     def update_double_attempt_retry_time_on_ledger(self, ledger: str):
         """
         Updates the double_spending_retry_time field in the ledger table
@@ -735,15 +917,13 @@ class SQLConnection(metaclass=Singleton):
             List[dict]: A list of dictionaries containing peer details.
         """
         result = self._execute('''
-            SELECT id, token, client_id, gas_mantissa, gas_exponent FROM peer
+            SELECT id, token, client_id, gas FROM peer
         ''')
 
         peers = []
         for row in result.fetchall():
             peer = dict(row)
-            gas_mantissa = peer.pop('gas_mantissa')
-            gas_exponent = peer.pop('gas_exponent')
-            peer['gas'] = _combine_gas(gas_mantissa, gas_exponent)
+            peer['gas'] = int(peer['gas'])
             peers.append(peer)
 
         return peers
@@ -766,8 +946,10 @@ class SQLConnection(metaclass=Singleton):
             if row:
                 # Convert the row to a dictionary
                 peer_info = dict(row)
-                # Combine gas values into a single 'gas' key
-                peer_info['gas'] = _combine_gas(peer_info.pop('gas_mantissa'), peer_info.pop('gas_exponent'))
+                # Drop the legacy gas columns that upgraded databases still have.
+                peer_info.pop('gas_mantissa', None)
+                peer_info.pop('gas_exponent', None)
+                peer_info['gas'] = int(peer_info['gas'])
                 return peer_info
             else:
                 return {}  # Return empty dict if peer not found
@@ -802,31 +984,15 @@ class SQLConnection(metaclass=Singleton):
         - bool: True if the operation was successful, False otherwise.
         """
         try:
-            # Retrieve the current gas values from the database.
-            result = self._execute('SELECT gas_mantissa, gas_exponent FROM peer WHERE id = ?', (peer_id,))
-            row = result.fetchone()
-
-            if row:
-                # Combine mantissa and exponent to get the current gas amount.
-                current_gas = _combine_gas(row['gas_mantissa'], row['gas_exponent'])
-
-                # Add the specified gas to the current amount.
-                total_gas = current_gas + gas
-
-                # Split the new total gas into mantissa and exponent.
-                new_mantissa, new_exponent = _split_gas(total_gas)
-
-                # Validate the new mantissa and exponent values.
-                _validate_gas(new_mantissa, new_exponent)
-
-                # Get the current timestamp for gas_last_update.
-                current_time = datetime.datetime.now().isoformat()
+            # Get the current timestamp for gas_last_update.
+            current_time = datetime.datetime.now().isoformat()
 
-                # Update the peer's gas values and gas_last_update in the database.
-                self._execute('''
-                    UPDATE peer SET gas_mantissa = ?, gas_exponent = ?, gas_last_update = ? WHERE id = ?
-                ''', (new_mantissa, new_exponent, current_time, peer_id))
+            # Add the specified gas to the peer's gas and update gas_last_update in the database.
+            result = self._execute('''
+                UPDATE peer SET gas = gas_add(gas, ?), gas_last_update = ? WHERE id = ?
+            ''', (str(gas), current_time, peer_id))
 
+            if result.rowcount > 0:
                 return True
             else:
                 raise Exception(f'Peer not found: {peer_id}')
@@ -846,25 +1012,39 @@ class SQLConnection(metaclass=Singleton):
         - bool: True if the operation was successful, False otherwise.
         """
         try:
-            # Split the provided gas value into mantissa and exponent.
-            new_mantissa, new_exponent = _split_gas(gas)
-
-            # Validate the new gas values.
-            _validate_gas(new_mantissa, new_exponent)
-
             # Get the current timestamp for gas_last_update.
             current_time = datetime.datetime.now().isoformat()
 
             # Update the peer's gas and gas_last_update directly in the database.
             self._execute('''
-                UPDATE peer SET gas_mantissa = ?, gas_exponent = ?, gas_last_update = ? WHERE id = ?
-            ''', (new_mantissa, new_exponent, current_time, peer_id))
+                UPDATE peer SET gas = ?, gas_last_update = ? WHERE id = ?
+            ''', (str(gas), current_time, peer_id))
 
             return True
         except Exception as e:
             logger.LOGGER(f'Error refreshing gas for peer {peer_id}: {e}')
             return False
 
+    def refresh_gas_for_peers(self, gas: Dict[str, int]) -> bool:
+        """
+        Sets the gas value of several peers in a single transaction.
+
+        Parameters:
+        - gas (Dict[str, int]): The new gas amount by peer id.
+
+        Returns:
+        - bool: True if the operation was successful, False otherwise.
+        """
+        try:
+            current_time = datetime.datetime.now().isoformat()
+            self._executemany('''
+                UPDATE peer SET gas = ?, gas_last_update = ? WHERE id = ?
+            ''', ((str(amount), current_time, peer_id) for peer_id, amount in gas.items()))
+            return True
+        except Exception as e:
+            logger.LOGGER(f'Error refreshing gas for {len(gas)} peers: {e}')
+            return False
+
     def add_peer(self, peer_id: str, protocol_stack: bytes) -> bool:
         """
         Adds a peer to the database.
@@ -880,8 +1060,8 @@ class SQLConnection(metaclass=Singleton):
         if not self.peer_exists(peer_id=peer_id):
             try:
                 self._execute('''
-                    INSERT INTO peer (id,, protocol_stack, client_id, gas_mantissa, gas_exponent)
-                    VALUES (?, ?, '', 0, 0)  -- Initialize with empty client_id and 0 gas
+                    INSERT INTO peer (id, protocol_stack, client_id, gas)
+                    VALUES (?, ?, '', '0')  -- Initialize with empty client_id and 0 gas
                 ''', (peer_id, protocol_stack))
                 logger.LOGGER(f'Peer {peer_id} added without client_id')
                 return True
@@ -902,13 +1082,14 @@ class SQLConnection(metaclass=Singleton):
         """
         internal_port: int = slot.internal_port
         transport_protocol: bytes = bytes("tcp", "utf-8")
-        cursor = self._execute("INSERT INTO slot (internal_port, transport_protocol, peer_id) VALUES (?, ?, ?)",
-                            (internal_port, transport_protocol, peer_id))
-        slot_id = cursor.lastrowid
-        if slot_id:
-            slot_id = str(slot_id)
-            for uri in slot.uri:
-                self.add_uri(uri, slot_id=slot_id)
+        with self.transaction():
+            cursor = self._execute("INSERT INTO slot (internal_port, transport_protocol, peer_id) VALUES (?, ?, ?)",
+                                (internal_port, transport_protocol, peer_id))
+            slot_id = cursor.lastrowid
+            if slot_id:
+                slot_id = str(slot_id)
+                for uri in slot.uri:
+                    self.add_uri(uri, slot_id=slot_id)
 
     def add_contract(self, contract: celaut_pb2.ContractLedger, peer_id: str = "LOCAL"):
         """
@@ -925,14 +1106,15 @@ class SQLConnection(metaclass=Singleton):
         contract_hash: str = sha3_256(contract_content).hexdigest()
         contract_hash_type: str = SHA3_256_ID.hex()
 
-        self._execute("INSERT OR IGNORE INTO contract (hash, hash_type, contract) VALUES (?,?,?)",
-                    (contract_hash, contract_hash_type, contract_content))
+        with self.transaction():
+            self._execute("INSERT OR IGNORE INTO contract (hash, hash_type, contract) VALUES (?,?,?)",
+                        (contract_hash, contract_hash_type, contract_content))
 
-        self._execute("INSERT OR IGNORE INTO ledger (id) VALUES (?)",
-                    (ledger,))
+            self._execute("INSERT OR IGNORE INTO ledger (id) VALUES (?)",
+                        (ledger,))
 
-        self._execute("INSERT OR IGNORE INTO contract_instance (address, ledger_id, contract_hash, peer_id) "
-                    "VALUES (?,?,?,?)", (address, ledger, contract_hash, peer_id))
+            self._execute("INSERT OR IGNORE INTO contract_instance (address, ledger_id, contract_hash, peer_id) "
+                        "VALUES (?,?,?,?)", (address, ledger, contract_hash, peer_id))
 
     def add_reputation_proof(self, contract_ledger: celaut_pb2.ContractLedger, peer_id: str) -> bool:
         """
@@ -1079,13 +1261,16 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             str: The father_id of the external service, or an empty string if not found.
         """
-        cursor = self._execute('''
-            SELECT client_id
-            FROM external_services
-            WHERE token = ?
-        ''', (token,))
-        result = cursor.fetchone()
-        return result[0] if result else ""
+        def load() -> str:
+            cursor = self._execute('''
+                SELECT client_id
+                FROM external_services
+                WHERE token = ?
+            ''', (token,))
+            result = cursor.fetchone()
+            return result[0] if result else ""
+
+        return self._cached(("father", token), load)
 
     def get_external_instance(self, token: str) -> Optional[str]:
         """
@@ -1097,13 +1282,16 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             str: The serialized_service of the external service, or None if not found.
         """
-        cursor = self._execute('''
-            SELECT serialized_service
-            FROM external_services
-            WHERE token = ?
-        ''', (token,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+        def load() -> Optional[str]:
+            cursor = self._execute('''
+                SELECT serialized_instance
+                FROM external_services
+                WHERE token = ?
+            ''', (token,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+        return self._cached(("instance", token), load)
 
     def peer_has_client(self, peer_id: str) -> bool:
         """
@@ -1193,6 +1381,7 @@ class SQLConnection(metaclass=Singleton):
             INSERT INTO external_services (token, token_hash, peer_id, client_id, serialized_instance)
             VALUES (?, ?, ?, ?, ?)
         ''', (external_token, encrypted_external_token, peer_id, client_id, serialized_instance))
+        self._invalidate(external_token, encrypted_external_token)
 
     def get_token_by_hashed_token(self, hashed_token: str) -> Optional[str]:
         """
@@ -1204,7 +1393,7 @@ class SQLConnection(metaclass=Singleton):
         Returns:
             Optional[str]: The token if it exists, or None if not found.
         """
-        try:
+        def load() -> Optional[str]:
             result = self._execute('''
                 SELECT token FROM external_services WHERE token_hash = ?
             ''', (hashed_token,))
@@ -1212,6 +1401,9 @@ class SQLConnection(metaclass=Singleton):
             if row:
                 return row['token']
             return None
+
+        try:
+            return self._cached(("token", hashed_token), load)
         except sqlite3.Error as e:
             logger.LOGGER(f'Failed to retrieve token for hashed external service token {hashed_token}: {e}')
             return None
@@ -1259,14 +1451,11 @@ class SQLConnection(metaclass=Singleton):
         self._execute('''
             DELETE FROM external_services WHERE token = ?
         ''', (his_token,))
+        self._invalidate(his_token, hashed_token)
 
         try:
             refund = from_gas_amount(next(bee.client_grpc(
-                method=gateway_pb2_grpc.GatewayStub(
-                    grpc.insecure_channel(
-                        next(generate_uris_by_peer_id(peer_id=peer_id))
-                    )
-                ).StopService,
+                method=peer_stub(peer_id=peer_id).StopService,
                 input=gateway_pb2.TokenMessage(
                     token=hashed_token
                 ),
@@ -1516,25 +1705,114 @@ class SQLConnection(metaclass=Singleton):
             DELETE FROM deposit_tokens WHERE id = ?
         ''', (token_id,))
 
+    # Energy consumption
+
+    def insert_energy_records(self, records: List[Tuple[float, float, float, float, float]]):
+        """
+        Stores a batch of energy samples in one transaction, adding each of them to its
+        1-minute and 1-hour rollup buckets.
+
+        Args:
+            records (List[Tuple[float, float, float, float, float]]): Samples as (timestamp, cpu_percent,
+                memory_usage, power_consumption, cost), the timestamp in seconds since the epoch.
+        """
+        with self.transaction():
+            self._executemany('''
+                INSERT INTO energy_consumption (timestamp, cpu_percent, memory_usage, power_consumption, cost)
+                VALUES (?, ?, ?, ?, ?)
+            ''', records)
+            self._executemany('''
+                INSERT INTO energy_consumption_rollup
+                    (resolution, bucket, samples, cpu_percent, memory_usage, power_consumption,
+                     max_power_consumption, cost)
+                VALUES (:resolution, CAST(:timestamp AS INTEGER) / :resolution * :resolution, 1,
+                        :cpu_percent, :memory_usage, :power_consumption, :power_consumption, :cost)
+                ON CONFLICT (resolution, bucket) DO UPDATE SET
+                    samples = samples + 1,
+                    cpu_percent = cpu_percent + excluded.cpu_percent,
+                    memory_usage = memory_usage + excluded.memory_usage,
+                    power_consumption = power_consumption + excluded.power_consumption,
+                    max_power_consumption = MAX(max_power_consumption, excluded.max_power_consumption),
+                    cost = cost + excluded.cost
+            ''', (
+                {'resolution': resolution, 'timestamp': timestamp, 'cpu_percent': cpu_percent,
+                 'memory_usage': memory_usage, 'power_consumption': power_consumption, 'cost': cost}
+                for timestamp, cpu_percent, memory_usage, power_consumption, cost in records
+                for resolution in ENERGY_ROLLUP_RESOLUTIONS
+            ))
+
     def insert_energy_record(self, cpu_percent: float, memory_usage: float,
                            power_consumption: float, cost: float):
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO energy_consumption
-            (timestamp, cpu_percent, memory_usage, power_consumption, cost)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (datetime.now(), cpu_percent, memory_usage, power_consumption, cost))
-        self.conn.commit()
+        self.insert_energy_records([(time.time(), cpu_percent, memory_usage, power_consumption, cost)])
 
     def get_latest_energy_records(self, limit: int = 100) -> Generator[Dict, None, None]:
-        cursor = self.conn.cursor()
-        cursor.execute('''
+        result = self._execute('''
             SELECT * FROM energy_consumption
             ORDER BY timestamp DESC LIMIT ?
         ''', (limit,))
-        columns = [description[0] for description in cursor.description]
-        for row in cursor.fetchall():
-            yield dict(zip(columns, row))
+        for row in result:
+            yield dict(row)
+
+    def get_energy_aggregate(self, window: float) -> Optional[Dict]:
+        """
+        Aggregates the energy samples of the last `window` seconds, from the finest series
+        whose retention covers the window.
+
+        Args:
+            window (float): The time window in seconds.
+
+        Returns:
+            Optional[Dict]: The number of samples, the average cpu_percent, memory_usage, power_consumption
+                and cost (per hour), and the max_power_consumption. None if there are no samples.
+        """
+        since = time.time() - window
+        if window <= ENERGY_RAW_RETENTION:
+            result = self._execute('''
+                SELECT
+                    COUNT(*) AS samples,
+                    AVG(cpu_percent) AS cpu_percent,
+                    AVG(memory_usage) AS memory_usage,
+                    AVG(power_consumption) AS power_consumption,
+                    MAX(power_consumption) AS max_power_consumption,
+                    AVG(cost) AS cost
+                FROM energy_consumption
+                WHERE timestamp >= ?
+            ''', (since,))
+        else:
+            resolution = ENERGY_ROLLUP_RESOLUTIONS[0] if window <= ENERGY_MINUTE_RETENTION \
+                else ENERGY_ROLLUP_RESOLUTIONS[1]
+            result = self._execute('''
+                SELECT
+                    SUM(samples) AS samples,
+                    SUM(cpu_percent) / SUM(samples) AS cpu_percent,
+                    SUM(memory_usage) / SUM(samples) AS memory_usage,
+                    SUM(power_consumption) / SUM(samples) AS power_consumption,
+                    MAX(max_power_consumption) AS max_power_consumption,
+                    SUM(cost) / SUM(samples) AS cost
+                FROM energy_consumption_rollup
+                WHERE resolution = ? AND bucket >= ?
+            ''', (resolution, since - resolution))  # Includes the bucket in progress at the start of the window.
+
+        row = result.fetchone()
+        return dict(row) if row and row['samples'] else None
+
+    def prune_energy_records(self) -> int:
+        """
+        Applies the retention policy of the energy series, the raw samples are kept ENERGY_RAW_RETENTION seconds,
+        the 1-minute rollups ENERGY_MINUTE_RETENTION and the 1-hour rollups ENERGY_HOUR_RETENTION.
+
+        Returns:
+            int: The number of deleted rows.
+        """
+        now = time.time()
+        with self.transaction():
+            deleted = self._execute('DELETE FROM energy_consumption WHERE timestamp < ?',
+                                    (now - ENERGY_RAW_RETENTION,)).rowcount
+            for resolution, retention in zip(ENERGY_ROLLUP_RESOLUTIONS,
+                                             (ENERGY_MINUTE_RETENTION, ENERGY_HOUR_RETENTION)):
+                deleted += self._execute('DELETE FROM energy_consumption_rollup WHERE resolution = ? AND bucket < ?',
+                                         (resolution, now - retention)).rowcount
+        return deleted
 
 def is_peer_available(peer_id: str, min_slots_open: int = 1) -> bool:
     # Slot concept here refers to the number of urls. Slot should be renamed on all the code because is incorrectly used.
@@ -1550,7 +1828,6 @@ def is_peer_available(peer_id: str, min_slots_open: int = 1) -> bool:
     """
     SQLConnection().peer_exists(peer_id=peer_id)
     try:
-        return any(list(generate_uris_by_peer_id(peer_id))) if min_slots_open == 1 else \
-            len(list(generate_uris_by_peer_id(peer_id))) >= min_slots_open
+        return len(PeerHealth().reachable_uris(peer_id=peer_id)) >= min_slots_open
     except Exception:
         return False
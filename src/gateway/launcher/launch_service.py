@@ -1,7 +1,7 @@
 from typing import Optional
 
 from protos import celaut_pb2 as celaut, gateway_pb2
-from src.balancers.service_balancer.service_balancer import service_balancer
+from src.balancers.service_balancer.service_balancer import invalidate_cost_quote, service_balancer
 from src.gateway.launcher.delegate_execution.delegate_execution import delegate_execution
 from src.gateway.launcher.local_execution.local_execution import local_execution
 from src.manager.manager import spend_gas
@@ -98,6 +98,8 @@ def launch_service(
 
             except Exception as e:
                log.LOGGER(f"Exception launching service on peer {peer}: {str(e)}")
+               if peer != 'local':
+                   invalidate_cost_quote(peer_id=peer, metadata=metadata, config=config)
                continue
 
         _err_msg = f"Can't launch this service {service_id}"
@@ -137,7 +137,9 @@ def local_execution(
             initial_gas_amount=initial_gas_amount,
             serialized_instance=instance.SerializeToString(),
             system_requirements_range=gateway_pb2.ModifyServiceSystemResourcesInput(
-                min_sysreq=initial_system_resources, max_sysreq=initial_system_resources)  # TODO ??
-            ),
+                min_sysreq=initial_system_resources,
+                max_sysreq=resources.max_sysreq if resources.HasField('max_sysreq') else initial_system_resources
+            )
+        ),
         instance=instance
     )
@@ -0,0 +1,89 @@
+from threading import Lock
+from time import monotonic
+from typing import Dict
+
+from protos import celaut_pb2 as celaut
+from src.database.sql_connection import SQLConnection
+from src.manager.manager import resize_container_memory
+from src.manager.memory_accountant import MemoryAccountant
+from src.utils import logger as log
+from src.utils.cost_functions.general_cost_functions import compute_maintenance_cost
+from src.utils.env import EnvManager
+from src.utils.singleton import Singleton
+
+env_manager = EnvManager()
+
+AUTOSCALER_GROW_USAGE = env_manager.get_env("AUTOSCALER_GROW_USAGE")
+AUTOSCALER_SHRINK_USAGE = env_manager.get_env("AUTOSCALER_SHRINK_USAGE")
+AUTOSCALER_TARGET_USAGE = env_manager.get_env("AUTOSCALER_TARGET_USAGE")
+AUTOSCALER_GROW_FACTOR = env_manager.get_env("AUTOSCALER_GROW_FACTOR")
+AUTOSCALER_PRESSURE = env_manager.get_env("AUTOSCALER_PRESSURE")
+AUTOSCALER_IDLE_TICKS = int(env_manager.get_env("AUTOSCALER_IDLE_TICKS"))
+AUTOSCALER_COOLDOWN = env_manager.get_env("AUTOSCALER_COOLDOWN")
+
+sc = SQLConnection()
+
+
+class MemoryAutoscaler(metaclass=Singleton):
+    """
+    Scales the memory limit of the services between their min_sysreq and max_sysreq.
+
+    A container grows when its usage goes over AUTOSCALER_GROW_USAGE of its limit or it stalls waiting for memory
+    (cgroup PSI over AUTOSCALER_PRESSURE %), and shrinks once it stays under AUTOSCALER_SHRINK_USAGE for
+    AUTOSCALER_IDLE_TICKS ticks. Both resize to leave the usage at AUTOSCALER_TARGET_USAGE, between the two
+    thresholds, and a container is not resized again for AUTOSCALER_COOLDOWN seconds, so it does not thrash.
+    The maintenance rate of the container is re-priced on every change.
+    """
+
+    def __init__(self):
+        self.idle_ticks: Dict[str, int] = {}
+        self.last_change: Dict[str, float] = {}
+        self.lock = Lock()
+
+    def tick(self):
+        with self.lock:
+            ranges = sc.get_memory_ranges()
+            for id in list(self.idle_ticks):
+                if id not in ranges:
+                    self.idle_ticks.pop(id, None)
+                    self.last_change.pop(id, None)
+
+            for id, (limit, min_mem_limit, max_mem_limit) in ranges.items():
+                memory = MemoryAccountant().container(id)
+                if not memory or not memory.measured or not limit:
+                    continue
+                if monotonic() - self.last_change.get(id, -AUTOSCALER_COOLDOWN) < AUTOSCALER_COOLDOWN:
+                    continue
+
+                usage = memory.current / limit
+                target = int(memory.current / AUTOSCALER_TARGET_USAGE)
+                if usage >= AUTOSCALER_GROW_USAGE or memory.pressure >= AUTOSCALER_PRESSURE:
+                    self.idle_ticks[id] = 0
+                    mem_limit = min(max_mem_limit, max(target, int(limit * AUTOSCALER_GROW_FACTOR)))
+                elif usage <= AUTOSCALER_SHRINK_USAGE:
+                    self.idle_ticks[id] = self.idle_ticks.get(id, 0) + 1
+                    if self.idle_ticks[id] < AUTOSCALER_IDLE_TICKS:
+                        continue
+                    mem_limit = max(min_mem_limit, target)
+                else:
+                    self.idle_ticks[id] = 0
+                    continue
+
+                if mem_limit != limit:
+                    self.__resize(id=id, mem_limit=mem_limit, previous=limit)
+
+    def __resize(self, id: str, mem_limit: int, previous: int):
+        if not resize_container_memory(id=id, mem_limit=mem_limit):
+            log.LOGGER(f"Autoscaler could not resize {id} from {previous} to {mem_limit} bytes.")
+            return
+        log.LOGGER(f"Autoscaler resized {id} from {previous} to {mem_limit} bytes.")
+        self.idle_ticks[id] = 0
+        self.last_change[id] = monotonic()
+
+        sys_req = sc.get_sys_req(id=id)
+        sc.set_gas_rates(
+            rates={id: compute_maintenance_cost(system_resources=celaut.Sysresources(
+                **{key: sys_req[key] or 0 for key in ('mem_limit', 'cpu_period', 'cpu_quota', 'blkio_weight')}
+            ))},
+            tolerance=0
+        )
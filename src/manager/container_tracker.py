@@ -0,0 +1,69 @@
+from threading import Lock, Thread
+from time import sleep
+from typing import Callable, Dict, Optional
+
+from src.utils import logger as log
+from src.utils.env import DOCKER_CLIENT, EnvManager
+from src.utils.singleton import Singleton
+
+env_manager = EnvManager()
+
+GENERAL_WAIT_TIME = env_manager.get_env("GENERAL_WAIT_TIME")
+
+# Container events that mean the container is not running anymore.
+EXIT_EVENTS = ["die", "oom", "destroy"]
+
+# States of a listed container that will not run again.
+EXITED_STATES = ("exited", "dead")
+
+
+class ContainerTracker(metaclass=Singleton):
+    """
+    Tracks the state of the service containers.
+
+    A background thread follows the Docker events stream and calls `on_exit` as soon as a container dies,
+    runs out of memory or is destroyed, instead of waiting for the next maintenance tick to notice it.
+    The maintenance tick gets the state of every container with a single list call (states()).
+    """
+
+    def __init__(self):
+        self.on_exit: Optional[Callable[[str], None]] = None
+        self.thread: Optional[Thread] = None
+        self.lock = Lock()
+
+    def start(self, on_exit: Callable[[str], None]):
+        with self.lock:
+            self.on_exit = on_exit
+            if not self.thread:
+                self.thread = Thread(target=self._follow_events, daemon=True)
+                self.thread.start()
+
+    def _follow_events(self):
+        while True:
+            try:
+                for event in DOCKER_CLIENT().events(
+                        decode=True,
+                        filters={"type": "container", "event": EXIT_EVENTS}
+                ):
+                    container_id = event.get("id") or event.get("Actor", {}).get("ID")
+                    if container_id:
+                        log.LOGGER(f"Container {container_id} event: {event.get('Action', event.get('status'))}")
+                        try:
+                            self.on_exit(container_id)
+                        except Exception as e:
+                            log.LOGGER(f"Error handling the exit of container {container_id}: {e}")
+            except Exception as e:
+                log.LOGGER(f"Docker events stream interrupted: {e}")
+            # The maintenance tick covers the exits missed while the stream is reconnected.
+            sleep(GENERAL_WAIT_TIME)
+
+    @staticmethod
+    def states() -> Dict[str, str]:
+        """
+        Returns the state of every container (running, exited, created ...) by id, with one Docker API call.
+        Sparse listing avoids the inspect request per container.
+        """
+        return {
+            container.id: container.attrs.get("State", "")
+            for container in DOCKER_CLIENT().containers.list(all=True, sparse=True)
+        }
@@ -0,0 +1,109 @@
+from threading import Lock, Thread
+from time import sleep
+from typing import Optional, Set
+
+from src.utils import logger as log
+from src.utils.env import DOCKER_CLIENT, EnvManager
+from src.utils.singleton import Singleton
+
+env_manager = EnvManager()
+
+GENERAL_WAIT_TIME = env_manager.get_env("GENERAL_WAIT_TIME")
+
+# Events that change the tagged images or the running containers.
+IMAGE_EVENTS = ["pull", "tag", "untag", "delete", "import", "load"]
+CONTAINER_EVENTS = ["start", "die", "destroy", "pause", "unpause"]
+
+
+class DockerInventory(metaclass=Singleton):
+    """
+    Local images and running containers, for the cost estimates.
+
+    Each list is loaded from Docker once and kept until an event changes it, so the estimates served to
+    the peers do not call the Docker API. While the events stream is not followed (not started yet,
+    or reconnecting) nothing is cached and every query lists again.
+    """
+
+    def __init__(self):
+        self.built: Set[str] = set()  # Service hashes with an image.
+        self.running: Set[str] = set()  # Running container ids.
+        self.images_stale = True
+        self.containers_stale = True
+        self.following = False
+        self.thread: Optional[Thread] = None
+        self.lock = Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = Thread(target=self._follow_events, daemon=True)
+        self.thread.start()
+
+    def _follow_events(self):
+        while True:
+            try:
+                events = DOCKER_CLIENT().events(
+                    decode=True,
+                    filters={"type": ["image", "container"], "event": IMAGE_EVENTS + CONTAINER_EVENTS}
+                )
+                # Subscribed before the lists are loaded again, so no change falls in between.
+                with self.lock:
+                    self.following = True
+                    self.images_stale = self.containers_stale = True
+                for event in events:
+                    with self.lock:
+                        if event.get("Type") == "image":
+                            self.images_stale = True
+                        else:
+                            self.containers_stale = True
+            except Exception as e:
+                log.LOGGER(f"Docker inventory events stream interrupted: {e}")
+            with self.lock:
+                self.following = False
+            sleep(GENERAL_WAIT_TIME)
+
+    def __load_images(self):
+        built = set()
+        for image in DOCKER_CLIENT().images.list():
+            for tag in image.tags or []:
+                # The tag of a service image starts with its hash.
+                built.add(tag.split('.')[0])
+        return built
+
+    def __load_containers(self):
+        return {container.id for container in DOCKER_CLIENT().containers.list(sparse=True)}
+
+    def is_built(self, service_hash: str) -> bool:
+        with self.lock:
+            stale = self.images_stale or not self.following
+            if stale:
+                self.images_stale = False
+        if stale:
+            try:
+                built = self.__load_images()
+            except Exception:
+                with self.lock:
+                    self.images_stale = True
+                raise
+            with self.lock:
+                self.built = built
+        with self.lock:
+            return service_hash in self.built
+
+    def running_containers(self) -> int:
+        with self.lock:
+            stale = self.containers_stale or not self.following
+            if stale:
+                self.containers_stale = False
+        if stale:
+            try:
+                running = self.__load_containers()
+            except Exception:
+                with self.lock:
+                    self.containers_stale = True
+                raise
+            with self.lock:
+                self.running = running
+        with self.lock:
+            return len(self.running)
@@ -1,24 +1,27 @@
-from time import sleep
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Lock
+from time import monotonic, time
+from typing import Any, Callable, Dict, Iterable, Set
 from uuid import uuid4
-import os
 
-import grpc
 from bee_rpc import client as peerpc
 
-import docker as docker_lib
-
-from protos import celaut_pb2 as celaut, gateway_pb2_grpc, gateway_pb2
-from protos.gateway_pb2_bee import StartService_input_indices, StartService_input_message_mode
+from protos import celaut_pb2 as celaut, gateway_pb2
+from src.manager.autoscaler import MemoryAutoscaler
+from src.manager.container_tracker import ContainerTracker, EXITED_STATES
 from src.manager.ergo import check_ergo_node_availability
-from src.manager.manager import prune_container, spend_gas, update_peer_instance
+from src.manager.manager import prune_container, update_peer_instance
 from src.manager.metrics import gas_amount_on_other_peer
+from src.manager.scheduler import JobScheduler
+from src.manager.wanted_services import WantedServices
 from src.database.sql_connection import SQLConnection, is_peer_available
 from src.payment_system.payment_process import increase_deposit_on_peer, init_interfaces
 from src.reputation_system.interface import update_reputation, submit_reputation
 from src.utils import logger as log
-from src.utils.utils import generate_uris_by_peer_id, peers_id_iterator
+from src.utils.peer_channels import peer_stub
 from src.utils.cost_functions.general_cost_functions import compute_maintenance_cost
-from src.utils.env import DOCKER_CLIENT, SHA3_256_ID, EnvManager
+from src.utils.env import EnvManager
+from src.utils.tools.circuit_breaker import CircuitBreaker
 from src.utils.tools.duplicate_grabber import DuplicateGrabber
 from src.utils.env import EnvManager
 
@@ -31,159 +34,196 @@ MIN_DEPOSIT_PEER = env_manager.get_env("MIN_DEPOSIT_PEER")
 DEV_CLIENT_GAS_AMOUNT = env_manager.get_env("DEV_CLIENT_GAS_AMOUNT")
 TOTAL_REFILLED_DEPOSIT = env_manager.get_env("TOTAL_REFILLED_DEPOSIT")
 MANAGER_ITERATION_TIME = env_manager.get_env("MANAGER_ITERATION_TIME")
-REGISTRY = env_manager.get_env("REGISTRY")
-METADATA_REGISTRY = env_manager.get_env("METADATA_REGISTRY")
+MANAGER_JOB_JITTER = env_manager.get_env("MANAGER_JOB_JITTER")
+ALLOW_GAS_DEBT = env_manager.get_env("ALLOW_GAS_DEBT")
+AUTOSCALER_INTERVAL = env_manager.get_env("AUTOSCALER_INTERVAL")
+PEER_DEPOSITS_CONCURRENCY = int(env_manager.get_env("PEER_DEPOSITS_CONCURRENCY"))
+PEER_DEPOSITS_TIMEOUT = env_manager.get_env("PEER_DEPOSITS_TIMEOUT")
+PEER_BREAKER_FAILURES = env_manager.get_env("PEER_BREAKER_FAILURES")
+PEER_BREAKER_COOLDOWN = env_manager.get_env("PEER_BREAKER_COOLDOWN")
+PEER_BREAKER_MAX_COOLDOWN = env_manager.get_env("PEER_BREAKER_MAX_COOLDOWN")
 
 sc = SQLConnection()
 
-"""
-It doesn't make sense to store this on disk (DB), as each of the elements in the list (str, bool)
-requires a search in the pairs to obtain a complete service.
-Therefore, the bottleneck is in the number of operations rather than the cost of the object in memory.
-Thus, what would make sense, as a control against attacks, is a maximum number of elements in the list,
-so that if it 'fills up,' no more elements can enter, and they are not searched until requested again
-at some other time when there is space.
-"""
-wanted_services = {}  # str: bool
-
-
-def check_wanted_services():
-    for wanted in wanted_services.keys():  # TODO async
-        if not wanted_services[wanted]:
-            wanted_services[wanted] = True
-            log.LOGGER(f"Taking the service {wanted}")
-            _hash = gateway_pb2.celaut__pb2.Metadata.HashTag.Hash(
-                    type=SHA3_256_ID,
-                    value=bytes.fromhex(wanted)
-                )
-            for peer in peers_id_iterator():
-                """  TODO if get_service cost amount > 0
-
-                if gas_amount_on_other_peer(
-                        peer_id=peer,
-                ) <= cost and not increase_deposit_on_peer(
-                    peer_id=peer,
-                    amount=cost
-                ):
-                    raise Exception(
-                        'Get service error increasing deposit on ' + peer + 'when it didn\'t have enough '
-                                                                               'gas.')
-                """
-                log.LOGGER(f"Using peer {peer}")
-                try:
-                    for b in peerpc.client_grpc(
-                            method=gateway_pb2_grpc.GatewayStub(
-                                grpc.insecure_channel(
-                                    next(generate_uris_by_peer_id(peer))
-                                )
-                            ).GetService,  # TODO An timeout should be implemented when requesting a service.
-                            indices_serializer=StartService_input_indices,
-                            indices_parser=StartService_input_indices,
-                            partitions_message_mode_parser=StartService_input_message_mode,
-                            input=_hash
-                    ):
-                        log.LOGGER(f"type of chunk -> {type(b)}")
-                        if  type(b) == peerpc.Dir:
-                            log.LOGGER(f"    type of dir {b.type}")
-                        if type(b) == gateway_pb2.celaut__pb2.Metadata:
-                            log.LOGGER("Store the metadata.")
-                            with open(f"{METADATA_REGISTRY}{wanted}", "wb") as f:
-                                f.write(b.SerializeToString())
-                        elif type(b) == peerpc.Dir and b.type == gateway_pb2.celaut__pb2.Service:
-                            log.LOGGER(f"Store the service {b.dir}")
-                            os.system(f"mv {b.dir} {REGISTRY}{wanted}")
-                    del wanted_services[wanted]
-                    log.LOGGER(f"Wanted service {wanted} stored successfully.")
-                except Exception as e:
-                    log.LOGGER(f"Exception on peer {peer} getting a service. {str(e)}. Continue")
-                    wanted_services[wanted] = False
+def remove_and_penalize_container(id: str):
+    update_reputation(token=id, amount=-100)
+    log.LOGGER(f"Prunning container {id} from the registry because the docker container does not exist.")
+    try:
+        prune_container(token=id)
+    except Exception as e:
+        log.LOGGER(f"Error prunning container {id}: {e}")
+
+
+def on_container_exit(id: str):
+    # Called by the container tracker on the Docker exit events, only the registered services are pruned.
+    if sc.container_exists(id=id):
+        log.LOGGER(f"Container {id} has exited. Removing and penalizing.")
+        remove_and_penalize_container(id=id)
 
 
 def maintain_containers(debug_mode: bool=False):
-    def remove_and_penalize_container(id):
-        update_reputation(token=id, amount=-100)
-        log.LOGGER(f"Prunning container {id} from the registry because the docker container does not exist.")
-        try:
-            prune_container(token=id)
-        except Exception as e:
-            log.LOGGER(f"Error prunning container {id}: {e}")
-    
-    for id in sc.get_all_internal_service_ids():
-        if debug_mode: log.LOGGER(f"Checking container: {id}")
-        try:
-            container = DOCKER_CLIENT().containers.get(id)   # TODO refactor with manager.__get_container_by_id()
-            if debug_mode: log.LOGGER(f"Container {id} status: {container.status}")
-            if container.status == 'exited':
-                log.LOGGER(f"Container {id} has exited. Removing and penalizing.")
-                remove_and_penalize_container(id=id)
-        except (docker_lib.errors.NotFound, docker_lib.errors.APIError) as e:
-            log.LOGGER(f"Error fetching container {id}: {str(e)}. Assuming it does not exist.")
+    # The registry is read before listing the containers, so a service registered meanwhile is not taken as removed.
+    sys_reqs = sc.get_all_internal_service_sys_reqs()
+    if not sys_reqs:
+        return
+
+    # Exits are handled as they happen by the container tracker, this covers the ones it could miss.
+    states = ContainerTracker.states()
+    for id in list(sys_reqs):
+        state = states.get(id)
+        if debug_mode: log.LOGGER(f"Container {id} status: {state}")
+        if state is None or state in EXITED_STATES:
+            log.LOGGER(f"Container {id} is {state or 'missing'}. Removing and penalizing.")
             remove_and_penalize_container(id=id)
-            
-        gas_cost = compute_maintenance_cost(
-            system_resources=celaut.Sysresources(
-                mem_limit=sc.get_sys_req(id=id)['mem_limit']
-            )
-        )
-        if debug_mode: log.LOGGER(f"Computed gas cost for {id}: {gas_cost}")
-        
-        if not spend_gas(id=id, gas_to_spend=gas_cost):
+            del sys_reqs[id]
+
+    # The maintenance is accrued lazily from each container rate, only the rate changes are written.
+    keys = {id: tuple(sorted(sys_req.items())) for id, sys_req in sys_reqs.items()}
+    cost_by_sys_req = {
+        key: compute_maintenance_cost(system_resources=celaut.Sysresources(**dict(key)))
+        for key in set(keys.values())
+    }
+    rates = {id: cost_by_sys_req[key] for id, key in keys.items()}
+    if debug_mode: log.LOGGER(f"Computed gas rates: {rates}")
+    sc.set_gas_rates(rates=rates)
+
+    # Only the containers projected to run out of gas before the next tick are settled.
+    balances = sc.settle_containers(ids=sc.pop_exhausted_containers(until=time() + MANAGER_ITERATION_TIME))
+    insufficient = set() if ALLOW_GAS_DEBT else {
+        id for id, balance in balances.items() if id in rates and balance < rates[id]
+    }
+
+    for id in rates:
+        if id in insufficient:
             try:
                 update_reputation(token=id, amount=-10)  # TODO Needs to update the reputation of the service, not the instance. 
                 log.LOGGER(f"Pruning container {id} due to insufficient gas.")
                 prune_container(token=id)
             except Exception as e:
                 log.LOGGER(f'Error purging {id}: {str(e)}')
-                raise Exception(f'Error purging {id}: {str(e)}')
         else:
             update_reputation(token=id, amount=10)
             if debug_mode: log.LOGGER(f"Updated reputation for {id} due to successful maintenance.")
 
 
-def maintain_clients():
-    for client_id in SQLConnection().get_clients_id():
-        if SQLConnection().client_expired(client_id=client_id):
-            log.LOGGER('Delete client ' + client_id)
-            SQLConnection().delete_client(client_id)
+def maintain_clients() -> int:
+    """Deletes the expired clients in one statement and returns how many were reaped."""
+    reaped = len(SQLConnection().delete_expired_clients())
+    if reaped:
+        log.LOGGER(f'Deleted {reaped} expired clients')
+    return reaped
 
 
-def peer_deposits():
-    for peer_id in SQLConnection().get_peers_id(): # TODO async
-        if not is_peer_available(peer_id=peer_id, min_slots_open=MIN_SLOTS_OPEN_PER_PEER):
-            try:
-                peer = next(peerpc(
-                    method=gateway_pb2_grpc.GatewayStub(
-                        grpc.insecure_channel(
-                            next(generate_uris_by_peer_id(peer_id=peer_id), "")
-                        )
-                    ).GetPeerInfo,
-                    indices_parser=gateway_pb2.Peer,
-                    partitions_message_mode_parser=True
-                ), None)
-            except:
-                continue
-            if not peer:
+peer_breaker = CircuitBreaker(
+    failures=PEER_BREAKER_FAILURES,
+    cooldown=PEER_BREAKER_COOLDOWN,
+    max_cooldown=PEER_BREAKER_MAX_COOLDOWN
+)
+peers_executor = ThreadPoolExecutor(max_workers=PEER_DEPOSITS_CONCURRENCY, thread_name_prefix="peer-deposits")
+peers_in_flight: Set[str] = set()  # Peers with a task still running, maybe from a previous tick that timed out.
+peers_in_flight_lock = Lock()
+
+
+def run_on_peers(peer_ids: Iterable[str], function: Callable[[str, float], Any], timeout: float) -> Dict[str, Any]:
+    """
+    Runs function(peer_id, deadline) for every peer on the bounded peers executor.
+
+    All the peers share a deadline `timeout` seconds from now, that the function passes on to its calls.
+    The tasks still queued when it passes are cancelled, and the peers that fail or time out are recorded
+    on the circuit breaker and left out of the results. The peers whose circuit is open, or whose task from a
+    previous call is still running, are skipped.
+
+    Returns:
+        Dict[str, Any]: The result of every peer that finished on time.
+    """
+    deadline = monotonic() + timeout
+
+    def task(peer_id: str):
+        try:
+            return function(peer_id, deadline)
+        finally:
+            with peers_in_flight_lock:
+                peers_in_flight.discard(peer_id)
+
+    tasks: Dict[Future, str] = {}
+    for peer_id in peer_ids:
+        with peers_in_flight_lock:
+            if peer_id in peers_in_flight or not peer_breaker.allow(peer_id):
                 continue
+            peers_in_flight.add(peer_id)
+        tasks[peers_executor.submit(task, peer_id)] = peer_id
+
+    results: Dict[str, Any] = {}
+    pending = set(tasks)
+    while pending and monotonic() < deadline:
+        done, pending = wait(pending, timeout=deadline - monotonic(), return_when=FIRST_COMPLETED)
+        for future in done:
+            peer_id = tasks[future]
             try:
-                update_peer_instance(
-                    peer=peer,
-                    peer_id=peer_id
-                )
+                results[peer_id] = future.result()
+                peer_breaker.record_success(peer_id)
             except Exception as e:
-                log.LOGGER(f"Exception updating peer {peer_id}: {str(e)}")
-                continue
+                log.LOGGER(f"Exception on peer {peer_id}: {str(e)}")
+                peer_breaker.record_failure(peer_id)
+
+    for future in pending:
+        peer_id = tasks[future]
+        if future.cancel():
+            # Never started, its task will not leave the in flight set.
+            with peers_in_flight_lock:
+                peers_in_flight.discard(peer_id)
+        log.LOGGER(f"Peer {peer_id} timed out after {timeout} seconds.")
+        peer_breaker.record_failure(peer_id)
+
+    return results
+
+
+def peer_deposits():
+    refreshed_gas: Dict[str, int] = {}
+
+    def check_peer(peer_id: str, deadline: float) -> int:
+        if not is_peer_available(peer_id=peer_id, min_slots_open=MIN_SLOTS_OPEN_PER_PEER):
+            peer = next(peerpc.client_grpc(
+                method=peer_stub(peer_id=peer_id).GetPeerInfo,
+                indices_parser=gateway_pb2.Peer,
+                timeout=max(0, deadline - monotonic()),
+                partitions_message_mode_parser=True
+            ), None)
+            if not peer:
+                raise Exception(f"Peer {peer_id} is not available.")
+            update_peer_instance(
+                peer=peer,
+                peer_id=peer_id
+            )
+
+        # A deposit that can not be read counts as a failure on the breaker, and the peer is left out of
+        # the refills until it is read again, instead of paying into a peer taken as empty.
+        return gas_amount_on_other_peer(
+            peer_id=peer_id,
+            refresh=lambda peer_id, gas: refreshed_gas.__setitem__(peer_id, gas),
+            timeout=max(0, deadline - monotonic()),
+            raise_errors=True
+        )
 
-        peer_gas = gas_amount_on_other_peer(
-                    peer_id=peer_id
-                )
-        if peer_gas < MIN_DEPOSIT_PEER:
-            log.LOGGER(f'\n\n The peer {peer_id} has not enough deposit.   ')
-            # f'\n   estimated gas deposit -> {peer["gas"]]} '
-            # f'\n   min deposit per peer -> {MIN_DEPOSIT_PEER}'
-            # f'\n   actual gas deposit -> {gas_amount_on_other_peer(peer_id=peer_id)}'
-            # f'\n\n')
-            if not increase_deposit_on_peer(peer_id=peer_id, amount=TOTAL_REFILLED_DEPOSIT-peer_gas):
-                log.LOGGER(f'Manager error: the peer {peer_id} could not be increased.')
+    # Probe the peers and fetch their deposits concurrently, then store the fetched amounts in one batch.
+    peers_gas = run_on_peers(SQLConnection().get_peers_id(), check_peer, timeout=PEER_DEPOSITS_TIMEOUT)
+    if refreshed_gas:
+        SQLConnection().refresh_gas_for_peers(gas=refreshed_gas)
+
+    def refill_deposit(peer_id: str, deadline: float) -> bool:
+        log.LOGGER(f'\n\n The peer {peer_id} has not enough deposit.   ')
+        if not increase_deposit_on_peer(peer_id=peer_id, amount=TOTAL_REFILLED_DEPOSIT-peers_gas[peer_id],
+                                        deadline=deadline):
+            log.LOGGER(f'Manager error: the peer {peer_id} could not be increased.')
+            return False
+        return True
+
+    # A refill still running when it times out stays in flight, so it is not paid twice on the next tick.
+    run_on_peers(
+        [peer_id for peer_id, peer_gas in peers_gas.items() if peer_gas < MIN_DEPOSIT_PEER],
+        refill_deposit,
+        timeout=PEER_DEPOSITS_TIMEOUT
+    )
 
 
 def check_dev_clients():
@@ -199,30 +239,44 @@ def check_dev_clients():
             sc.add_gas(client_id=clients[0], gas=gas_to_add)
 
 
+def log_job_metrics():
+    for name, metrics in scheduler.metrics().items():
+        log.LOGGER(
+            f"Job {name}: {metrics['runs']} runs, {metrics['overruns']} overruns, {metrics['errors']} errors, "
+            f"mean {metrics['mean_duration']:.2f}s, max {metrics['max_duration']:.2f}s (period {metrics['period']}s)"
+        )
+
+
+scheduler = JobScheduler()
+
+
 def manager_thread():
     
     # Functions to be executed at the beginning
     init_interfaces()
+    ContainerTracker().start(on_exit=on_container_exit)
+    WantedServices().start()
     check_dev_clients()
     check_ergo_node_availability()
     if SUBMIT_REPUTATION_AT_INIT: submit_reputation(force_submit=True)
-    
-    short_interval_count = 0
-    while True:
-        if short_interval_count == int(SHORT_INTERVAL_COUNT):
-            short_interval_count = 0
-            
-            # Functions to be executed every long interval
-            check_ergo_node_availability()
-            submit_reputation()
-            check_dev_clients()
-        
-        # Functions to be executed every short interval
-        check_wanted_services()
-        maintain_containers(debug_mode=False)
-        maintain_clients()
-        peer_deposits()
-        DuplicateGrabber().manager()
-        
-        sleep(MANAGER_ITERATION_TIME)
-        short_interval_count += 1
+
+    long_interval = MANAGER_ITERATION_TIME * int(SHORT_INTERVAL_COUNT)
+
+    # Functions to be executed every short interval, each one on its own thread.
+    # The maintenance cost is computed per MANAGER_ITERATION_TIME, so the billing runs without jitter.
+    scheduler.add("maintain_containers", lambda: maintain_containers(debug_mode=False), period=MANAGER_ITERATION_TIME)
+    scheduler.add("maintain_clients", maintain_clients, period=MANAGER_ITERATION_TIME, jitter=MANAGER_JOB_JITTER)
+    scheduler.add("peer_deposits", peer_deposits, period=MANAGER_ITERATION_TIME, jitter=MANAGER_JOB_JITTER)
+    scheduler.add("duplicate_grabber", DuplicateGrabber().manager, period=MANAGER_ITERATION_TIME, jitter=MANAGER_JOB_JITTER)
+    scheduler.add("autoscale_memory", MemoryAutoscaler().tick, period=AUTOSCALER_INTERVAL, jitter=MANAGER_JOB_JITTER)
+
+    # Functions to be executed every long interval, they already ran at the beginning.
+    for name, function in (
+        ("check_ergo_node_availability", check_ergo_node_availability),
+        ("submit_reputation", submit_reputation),
+        ("check_dev_clients", check_dev_clients),
+        ("log_job_metrics", log_job_metrics),
+    ):
+        scheduler.add(name, function, period=long_interval, jitter=MANAGER_JOB_JITTER, run_at_start=False)
+
+    scheduler.start()
@@ -3,22 +3,23 @@ import uuid
 from typing import Optional, Generator, Protocol, Tuple
 
 import docker as docker_lib
-import grpc
 from bee_rpc import client as bee
 from google.protobuf.json_format import MessageToJson
 
-from src.manager.resources_manager import IOBigData
-from protos import celaut_pb2, gateway_pb2, gateway_pb2_grpc
+from src.manager.memory_accountant import MemoryAccountant
+from src.manager.resources_manager import DEFAULT_CPU_PERIOD, IOBigData, cpu_cores
+from protos import celaut_pb2, gateway_pb2
 from src.reputation_system.contracts.ergo.proof_validation import validate_contract_ledger
 
-from src.database.sql_connection import SQLConnection, _split_gas, is_peer_available
+from src.database.sql_connection import SQLConnection, is_peer_available
+from src.database.gas_functions import to_scientific_notation
 
 from src.utils import logger as log
 from src.utils import utils
 from src.utils.env import DOCKER_CLIENT, EnvManager
+from src.utils.peer_channels import peer_stub
 from src.utils.utils import (
-    to_gas_amount,
-    generate_uris_by_peer_id
+    to_gas_amount
 )
 from src.utils.env import EnvManager
 from src.virtualizers.docker.firewall import remove_rule
@@ -104,17 +105,47 @@ def __modify_sysreq(id: str, sys_req: celaut_pb2.Sysresources) -> bool:
     if not sc.container_exists(id=id):
         log.LOGGER(f'Manager error: container {id} does not exists.')
         return False
-    if sys_req.HasField('mem_limit'):
-        variation = sc.get_sys_req(id=id)['mem_limit'] - sys_req.mem_limit
-        if variation < 0:
-            IOBigData().lock_ram(ram_amount=abs(variation))
-        elif variation > 0:
-            IOBigData().unlock_ram(ram_amount=variation)
-        if variation != 0:
-            sc.update_sys_req(id=id, mem_limit=sys_req.mem_limit)
+    current = sc.get_sys_req(id=id)
+    variation = (current['mem_limit'] or 0) - sys_req.mem_limit if sys_req.HasField('mem_limit') else 0
+    # The memory of the containers is accounted from their cgroups, an increase is only checked against
+    # the real headroom of the node.
+    if variation < 0 and not could_ve_this_sysreq(celaut_pb2.Sysresources(mem_limit=abs(variation))):
+        log.LOGGER(f'Manager error: not enough memory to increase {id} by {abs(variation)} bytes.')
+        return False
+
+    cpu_period = sys_req.cpu_period if sys_req.HasField('cpu_period') else current['cpu_period'] or 0
+    cpu_quota = sys_req.cpu_quota if sys_req.HasField('cpu_quota') else current['cpu_quota'] or 0
+    blkio_weight = sys_req.blkio_weight if sys_req.HasField('blkio_weight') else current['blkio_weight'] or 0
+    # The CPU and block I/O are reserved for the life of the container, and released when it is pruned.
+    if not IOBigData().reserve_resources(id=id, cpu=cpu_cores(cpu_quota=cpu_quota, cpu_period=cpu_period),
+                                         blkio=blkio_weight):
+        log.LOGGER(f'Manager error: not enough CPU or block I/O for {id}: '
+                   f'cpu quota {cpu_quota}/{cpu_period}, blkio weight {blkio_weight}.')
+        return False
+
+    sc.update_sys_req(
+        id=id,
+        mem_limit=sys_req.mem_limit if variation != 0 else None,
+        cpu_period=cpu_period,
+        cpu_quota=cpu_quota,
+        blkio_weight=blkio_weight
+    )
+    if variation != 0:
+        MemoryAccountant().reserve(id=id, mem_limit=sys_req.mem_limit)
     return True
 
 
+def reserve_registered_resources():
+    """Reserves the CPU and block I/O of the containers already registered, when the node starts."""
+    for id, sys_req in sc.get_all_internal_service_sys_reqs().items():
+        if not IOBigData().reserve_resources(
+                id=id,
+                cpu=cpu_cores(cpu_quota=sys_req['cpu_quota'], cpu_period=sys_req['cpu_period']),
+                blkio=sys_req['blkio_weight']
+        ):
+            log.LOGGER(f'The CPU and block I/O of {id} exceed the pools.')
+
+
 def __get_container_by_id(id: str) -> docker_lib.models.containers.Container:
     return docker_lib.from_env().containers.get(
         container_id=id
@@ -167,49 +198,44 @@ def spend_gas(
 ) -> bool:
     gas_to_spend = int(gas_to_spend)
     try:
-        # En caso de que sea un peer, el token es el client id.
-        if sc.client_exists(client_id=id):
-            actual_gas = sc.get_client_gas(client_id=id)
-            
-            if not actual_gas: return False
-            actual_gas, last_usage, sci_not = actual_gas
-            
-            if actual_gas < gas_to_spend and not bool(ALLOW_GAS_DEBT):
-                gas_to_send_mant, gas_to_send_exp = _split_gas(gas_to_spend)
-                
-                log.LOGGER(f"Insufficient amount of gas {sci_not} from {gas_to_send_mant}e{gas_to_send_exp}")
-                return False
-            
-            sc.reduce_gas(client_id=id, gas=gas_to_spend)
-            
-            __refund_gas_function_factory(
-                gas=gas_to_spend,
-                token=id,
-                add_function=lambda gas: sc.add_gas(client_id=id, gas=gas),
-                container=refund_gas_function_container
-            )
-            return True
-
-        # En caso de que token_or_container_ip sea el token del contenedor.
-        else:
-            # id could be the container id or container ip. So check first if it's an id. If not, check if it's an ip.
-            is_id = sc.container_exists(id=id)
-            if not is_id:
-                id = sc.get_internal_service_id_by_uri(uri=id)  #  TODO don't should check this at this point.
-                is_id = sc.container_exists(id=id) if id else False
-
-            if is_id:
-                current_gas = sc.get_internal_service_gas(id=id)
-                if current_gas >= gas_to_spend or ALLOW_GAS_DEBT:
-                    sc.update_gas_to_container(id=id, gas=current_gas - gas_to_spend)
-                
-                    __refund_gas_function_factory(
-                        gas=current_gas,
-                        add_function=lambda gas: sc.update_gas_to_container(id=id, gas=gas),  # TODO control race conditions.
-                        token=id,
-                        container=refund_gas_function_container
-                    )
-                    return True
+        # The balance check and the discount are done by a single conditional statement (that applies
+        # the ALLOW_GAS_DEBT policy), so a concurrent spend can not be lost between a read and a write.
+        with sc.transaction():
+            # En caso de que sea un peer, el token es el client id.
+            if sc.client_exists(client_id=id):
+                if not sc.reduce_gas(client_id=id, gas=gas_to_spend):
+                    actual_gas = sc.get_client_gas(client_id=id)
+                    if actual_gas:
+                        log.LOGGER(f"Insufficient amount of gas {actual_gas[2]} from {to_scientific_notation(gas_to_spend)}")
+                    return False
+
+                __refund_gas_function_factory(
+                    gas=gas_to_spend,
+                    token=id,
+                    add_function=lambda gas: sc.add_gas(client_id=id, gas=gas),
+                    container=refund_gas_function_container
+                )
+                return True
+
+            # En caso de que token_or_container_ip sea el token del contenedor.
+            else:
+                # id could be the container id or container ip. So check first if it's an id. If not, check if it's an ip.
+                is_id = sc.container_exists(id=id)
+                if not is_id:
+                    id = sc.get_internal_service_id_by_uri(uri=id)  #  TODO don't should check this at this point.
+                    is_id = sc.container_exists(id=id) if id else False
+
+                if is_id:
+                    if sc.reduce_gas_to_container(id=id, gas=gas_to_spend):
+                        # The refund adds the spent amount back atomically, instead of restoring the
+                        # previous balance, so it does not overwrite other movements done meanwhile.
+                        __refund_gas_function_factory(
+                            gas=gas_to_spend,
+                            add_function=lambda gas: sc.add_gas_to_container(id=id, gas=gas),
+                            token=id,
+                            container=refund_gas_function_container
+                        )
+                        return True
 
     except Exception as e:
         log.LOGGER('Manager error spending gas: ' + str(e))
@@ -226,7 +252,7 @@ def generate_client() -> gateway_pb2.Client:
     )
 
 
-def get_client_id_on_other_peer(peer_id: str) -> Optional[str]:
+def get_client_id_on_other_peer(peer_id: str, timeout: Optional[float] = None) -> Optional[str]:
     """
     Retrieves or generates a client ID for a given peer. If the peer already has an associated client ID for our client,
     it returns that ID. If not, it checks if the peer is available. If the peer is available, it generates a new client ID,
@@ -234,6 +260,7 @@ def get_client_id_on_other_peer(peer_id: str) -> Optional[str]:
 
     Args:
         peer_id (str): The ID of the peer for which to retrieve or generate a client ID for our client.
+        timeout (Optional[float]): Seconds to wait for the peer to generate the client, without limit if None.
 
     Returns:
         Optional[str]: The client ID associated with the peer for our client. Returns None if client ID generation or association fails.
@@ -259,13 +286,10 @@ def get_client_id_on_other_peer(peer_id: str) -> Optional[str]:
 
     log.LOGGER('Generate new client for peer ' + peer_id)
     client_msg = next(bee.client_grpc(
-        method=gateway_pb2_grpc.GatewayStub(
-            grpc.insecure_channel(
-                next(generate_uris_by_peer_id(peer_id=peer_id), "")
-            )
-        ).GenerateClient,
+        method=peer_stub(peer_id=peer_id).GenerateClient,
         indices_parser=gateway_pb2.Client,
-        partitions_message_mode_parser=True
+        partitions_message_mode_parser=True,
+        timeout=timeout
     ), "")
     if not client_msg:
         raise Exception("No client msg returned.")
@@ -316,6 +340,14 @@ def add_container(
     return id
 
 
+def __memory_update(mem_limit: int) -> dict:
+    # Memory limit should be smaller than already set memoryswap limit, update the memoryswap at the same time
+    return dict(
+        mem_limit=mem_limit if MEMSWAP_FACTOR == 0 else mem_limit - MEMSWAP_FACTOR * mem_limit,
+        memswap_limit=mem_limit if MEMSWAP_FACTOR > 0 else -1
+    )
+
+
 def container_modify_system_params(
         id: str,
         system_requeriments_range: gateway_pb2.ModifyServiceSystemResourcesInput = None
@@ -325,8 +357,16 @@ def container_modify_system_params(
     # https://docker-py.readthedocs.io/en/stable/containers.html#docker.models.containers.Container.update
     # Set system requeriments parameters.
 
-    system_requeriments = system_requeriments_range.max_sysreq  # TODO implement the use of min_sysreq.
-    if not system_requeriments: return False
+    # The container starts with the memory of min_sysreq, the autoscaler grows it up to max_sysreq under
+    # memory pressure. The CPU and block I/O are not scaled, they are taken from max_sysreq.
+    has_min = system_requeriments_range.HasField('min_sysreq')
+    has_max = system_requeriments_range.HasField('max_sysreq')
+    if not has_min and not has_max: return False
+    system_requeriments = celaut_pb2.Sysresources()
+    system_requeriments.CopyFrom(system_requeriments_range.max_sysreq if has_max else system_requeriments_range.min_sysreq)
+    if has_min and system_requeriments_range.min_sysreq.HasField('mem_limit'):
+        system_requeriments.mem_limit = system_requeriments_range.min_sysreq.mem_limit
+    max_mem_limit = max(system_requeriments.mem_limit, system_requeriments_range.max_sysreq.mem_limit)
 
     # TODO Docker has a minimum of 6Mb of mem limit. It should be parametrize on .env and controlled here.
     if __modify_sysreq(
@@ -334,26 +374,52 @@ def container_modify_system_params(
             sys_req=system_requeriments
     ):
         try:
-            # Memory limit should be smaller than already set memoryswap limit, update the memoryswap at the same time
+            # CPU quota and block I/O weight, only when the service sets them.
+            cpu_and_io = {}
+            if system_requeriments.HasField('cpu_quota'):
+                cpu_and_io['cpu_quota'] = system_requeriments.cpu_quota
+                cpu_and_io['cpu_period'] = system_requeriments.cpu_period or DEFAULT_CPU_PERIOD
+            if system_requeriments.HasField('blkio_weight'):
+                cpu_and_io['blkio_weight'] = system_requeriments.blkio_weight
+
             __get_container_by_id(
                 id=id
             ).update(
-                mem_limit=system_requeriments.mem_limit if MEMSWAP_FACTOR == 0 \
-                    else system_requeriments.mem_limit - MEMSWAP_FACTOR * system_requeriments.mem_limit,
-                memswap_limit=system_requeriments.mem_limit if MEMSWAP_FACTOR > 0 else -1
+                **__memory_update(mem_limit=system_requeriments.mem_limit),
+                **cpu_and_io
             )
         except Exception as e:
             log.LOGGER(f"Docker container for {id} fail with e: {str(e)}")
             # TODO reset modified system req.  Maybe the __get_container_by_id should be inside of __modify_sysreq.
             return False
+        sc.update_sys_req(id=id, mem_limit=None,
+                          min_mem_limit=system_requeriments.mem_limit, max_mem_limit=max_mem_limit)
         return True
 
     log.LOGGER(f"System req could not be modified for {id}: mem limit {system_requeriments.mem_limit}")
     return False
 
 
+def resize_container_memory(id: str, mem_limit: int) -> bool:
+    """Changes the memory limit of a running container, used by the autoscaler inside the range of the service."""
+    previous_mem_limit = sc.get_sys_req(id=id)['mem_limit'] or 0
+    if not __modify_sysreq(id=id, sys_req=celaut_pb2.Sysresources(mem_limit=mem_limit)):
+        return False
+    try:
+        __get_container_by_id(id=id).update(**__memory_update(mem_limit=mem_limit))
+    except Exception as e:
+        log.LOGGER(f"Docker container for {id} fail resizing its memory to {mem_limit}: {str(e)}")
+        __modify_sysreq(id=id, sys_req=celaut_pb2.Sysresources(mem_limit=previous_mem_limit))
+        return False
+    return True
+
+
 def could_ve_this_sysreq(sysreq: celaut_pb2.Sysresources) -> bool:
-    return IOBigData().prevent_kill(len=sysreq.mem_limit)  # Prevent kill dice de lo que dispone actualmente libre.
+    return IOBigData().prevent_kill(len=sysreq.mem_limit) and \
+        IOBigData().could_reserve(  # Prevent kill dice de lo que dispone actualmente libre.
+            cpu=cpu_cores(cpu_quota=sysreq.cpu_quota, cpu_period=sysreq.cpu_period),
+            blkio=sysreq.blkio_weight
+        )
     # It's not possible local, but other pair can, returns True.
 
 
@@ -362,6 +428,9 @@ def get_sysresources(id: str) -> gateway_pb2.ModifyServiceSystemResourcesOutput:
     return gateway_pb2.ModifyServiceSystemResourcesOutput(
         sysreq=celaut_pb2.Sysresources(
             mem_limit=sys_req["mem_limit"],
+            cpu_period=sys_req["cpu_period"],
+            cpu_quota=sys_req["cpu_quota"],
+            blkio_weight=sys_req["blkio_weight"],
         ),
         gas=to_gas_amount(
             gas_amount=sc.get_internal_service_gas(id=id)
@@ -375,31 +444,30 @@ def prune_container(token: str) -> Optional[int]:  # TODO Should be divided into
     
     if sc.container_exists(id=token):  # Is internal
         try:
-            DOCKER_CLIENT().containers.get(token).remove(force=True)
-        except (docker_lib.errors.NotFound, docker_lib.errors.APIError):
-            pass  # Maybe was killed
-        
-        father_id = sc.get_internal_father_id(id=token)
-        serialized_instance = sc.get_internal_instance(id=token)
-        
-        try:
-            refund = sc.get_internal_service_gas(id=token)
-            sc.purge_internal(id=token)
+            # Read the refund and purge on the same unit of work, so no gas is spent in between.
+            with sc.transaction():
+                father_id = sc.get_internal_father_id(id=token)
+                serialized_instance = sc.get_internal_instance(id=token)
+                refund = sc.get_internal_service_gas(id=token)
+                sc.purge_internal(id=token)
+            IOBigData().release_resources(id=token)
         except Exception as e:
             log.LOGGER('Error purging ' + token + ' ' + str(e))
             return None
 
+        # Removed once it is no longer registered, so its exit events are not taken as an unexpected exit.
+        try:
+            DOCKER_CLIENT().containers.get(token).remove(force=True)
+        except (docker_lib.errors.NotFound, docker_lib.errors.APIError):
+            pass  # Maybe was killed
+
     else:  # It's external
         try:
             external_token = sc.get_token_by_hashed_token(hashed_token=token)
             peer_id = sc.get_peer_id_by_external_service(token=external_token)
             refund = utils.from_gas_amount(
                 next(bee.client_grpc(
-                    method=gateway_pb2_grpc.GatewayStub(
-                        grpc.insecure_channel(
-                            next(utils.generate_uris_by_peer_id(peer_id))
-                        )
-                    ).ModifyGasDeposit,  # TODO Verify: Should use StopService instead ??
+                    method=peer_stub(peer_id=peer_id).ModifyGasDeposit,  # TODO Verify: Should use StopService instead ??
                         partitions_message_mode_parser=True,
                         indices_parser=gateway_pb2.ModifyGasDepositOutput,
                         input=gateway_pb2.TokenMessage(
@@ -449,54 +517,48 @@ def modify_gas_deposit(gas_amount: int, service_token: str) -> Tuple[bool, str]:
     # if gas_amount > father_amount: 
     #   return False, "The father does not have enough gas."    
     #   #  If it cannot, it will throw an exception later.
-    
-    if gas_amount > 0:
-        log.LOGGER(f"Spend gas from father {father_id}")
-        if not spend_gas(
-                id=father_id,
-                gas_to_spend=gas_amount,
-                refund_gas_function_container=[]
-        ):
-            return False, 'Error spending gas'
-    
-    elif gas_amount < 0:
-        # This should be a increase_gas() function, reverse to spend_gas()
-        log.LOGGER(f"Add gas to father {father_id}")
-        
-        if sc.container_exists(id=father_id):
-            _gas = sc.get_internal_service_gas(id=father_id)
-            _gas += abs(gas_amount)
-            sc.update_gas_to_container(id=service_token, gas=_gas)
-            
-        elif sc.client_exists(client_id=father_id):
-            sc.add_gas(client_id=father_id, gas=gas_amount)
-        
-        else:
-            return False, f'ERROR: The father ID {father_id} is neither a client nor an internal service.'
-            
-        pass
-    
-    else:
+
+    if gas_amount == 0:
         return True, '0 gas have no sense'
-    
-    if is_internal:
-        current_gas = sc.get_internal_service_gas(id=service_token)
-        desired_amount = current_gas+gas_amount
-        
-        if desired_amount < 0:
-            return False, "Negative amount have no sense"
-        sc.update_gas_to_container(id=service_token, gas=desired_amount)
-    
-    else:
+
+    # The father and the internal service balances are modified on the same unit of work, with a single commit.
+    with sc.transaction():
+        if is_internal:
+            desired_amount = sc.get_internal_service_gas(id=service_token) + gas_amount
+            if desired_amount < 0:
+                return False, "Negative amount have no sense"
+
+        if gas_amount > 0:
+            log.LOGGER(f"Spend gas from father {father_id}")
+            if not spend_gas(
+                    id=father_id,
+                    gas_to_spend=gas_amount,
+                    refund_gas_function_container=[]
+            ):
+                return False, 'Error spending gas'
+
+        else:
+            # This should be a increase_gas() function, reverse to spend_gas()
+            log.LOGGER(f"Add gas to father {father_id}")
+
+            if sc.container_exists(id=father_id):
+                sc.add_gas_to_container(id=father_id, gas=abs(gas_amount))
+
+            elif sc.client_exists(client_id=father_id):
+                sc.add_gas(client_id=father_id, gas=abs(gas_amount))
+
+            else:
+                return False, f'ERROR: The father ID {father_id} is neither a client nor an internal service.'
+
+        if is_internal:
+            sc.update_gas_to_container(id=service_token, gas=desired_amount)
+
+    if not is_internal:
         try:
             external_token = sc.get_token_by_hashed_token(hashed_token=service_token)
             peer_id = sc.get_peer_id_by_external_service(token=external_token)
             _output = next(bee.client_grpc(
-                method=gateway_pb2_grpc.GatewayStub(
-                    grpc.insecure_channel(
-                        next(utils.generate_uris_by_peer_id(peer_id))
-                    )
-                ).ModifyGasDeposit,
+                method=peer_stub(peer_id=peer_id).ModifyGasDeposit,
                 partitions_message_mode_parser=True,
                 indices_parser=gateway_pb2.ModifyGasDepositOutput,
                 input=gateway_pb2.ModifyGasDepositInput(
@@ -0,0 +1,146 @@
+import os
+from dataclasses import dataclass
+from threading import Lock, Thread
+from time import sleep
+from typing import Dict, Optional
+
+import psutil
+
+from src.database.sql_connection import SQLConnection
+from src.utils import logger as log
+from src.utils.env import EnvManager
+from src.utils.singleton import Singleton
+
+env_manager = EnvManager()
+
+CGROUP_ROOT = env_manager.get_env("CGROUP_ROOT")
+MEMORY_ACCOUNTING_INTERVAL = env_manager.get_env("MEMORY_ACCOUNTING_INTERVAL")
+
+# Cgroup v2 directory of a container, with the systemd and the cgroupfs Docker drivers.
+CONTAINER_CGROUPS = ("system.slice/docker-{id}.scope", "docker/{id}")
+
+
+def _read_memory_file(path: str) -> Optional[int]:
+    """Reads a cgroup v2 memory file, None if it does not exist or has no limit ('max')."""
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def _read_memory_pressure(path: str) -> float:
+    """Percentage of the last 10 seconds some task of the cgroup was stalled waiting for memory (PSI)."""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith("some"):
+                    return float(dict(field.split("=") for field in line.split()[1:])["avg10"])
+    except (OSError, KeyError, ValueError):
+        pass
+    return 0.0
+
+
+@dataclass
+class ContainerMemory:
+    current: int  # Bytes in use.
+    limit: int  # Bytes it can grow to.
+    pressure: float = 0.0  # Memory stall percentage (PSI some avg10).
+    measured: bool = True  # Read from its cgroup, not estimated from its registered limit.
+
+
+class MemoryAccountant(metaclass=Singleton):
+    """
+    Memory actually used on the node, read from the cgroups every MEMORY_ACCOUNTING_INTERVAL seconds.
+
+    The node memory comes from the cgroup v2 root (memory.current and memory.max) when it is limited,
+    and from the kernel otherwise. Each service container is read from its own cgroup, so the headroom
+    also keeps apart what the containers can still grow to up to their memory.max, not only what they use now.
+
+    start() is called once at startup, before the RAM admission uses it, so headroom() and capacity() only
+    read the last refresh and never reach the database.
+    """
+
+    def __init__(self):
+        self.node_limit = 0
+        self.node_used = 0
+        self.containers: Dict[str, ContainerMemory] = {}
+        self.cgroup_paths: Dict[str, str] = {}
+        self.lock = Lock()
+        self.thread: Optional[Thread] = None
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = Thread(target=self._loop, daemon=True)
+        self.refresh()
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            sleep(MEMORY_ACCOUNTING_INTERVAL)
+            try:
+                self.refresh()
+            except Exception as e:
+                log.LOGGER(f"Memory accounting error: {e}")
+
+    def __container_cgroup(self, id: str) -> Optional[str]:
+        path = self.cgroup_paths.get(id)
+        if path is None:
+            path = next((
+                os.path.join(CGROUP_ROOT, pattern.format(id=id)) for pattern in CONTAINER_CGROUPS
+                if os.path.isdir(os.path.join(CGROUP_ROOT, pattern.format(id=id)))
+            ), None)
+            if path:
+                self.cgroup_paths[id] = path
+        return path
+
+    def refresh(self):
+        memory = psutil.virtual_memory()
+        node_limit = min(memory.total, _read_memory_file(os.path.join(CGROUP_ROOT, "memory.max")) or memory.total)
+        node_used = _read_memory_file(os.path.join(CGROUP_ROOT, "memory.current"))
+        if node_used is None:
+            node_used = memory.total - memory.available
+
+        containers = {}
+        for id, mem_limit in SQLConnection().get_all_internal_service_mem_limits().items():
+            path = self.__container_cgroup(id)
+            current = _read_memory_file(os.path.join(path, "memory.current")) if path else None
+            limit = _read_memory_file(os.path.join(path, "memory.max")) if path else None
+            # Without its cgroup, the container is taken as using its whole registered limit.
+            containers[id] = ContainerMemory(
+                current=current if current is not None else mem_limit,
+                limit=limit if limit is not None else mem_limit,
+                pressure=_read_memory_pressure(os.path.join(path, "memory.pressure")) if path else 0.0,
+                measured=current is not None
+            )
+
+        with self.lock:
+            self.node_limit, self.node_used = node_limit, node_used
+            self.containers = containers
+            self.cgroup_paths = {id: path for id, path in self.cgroup_paths.items() if id in containers}
+
+    def reserve(self, id: str, mem_limit: int):
+        """Takes a new limit of a container into account before the next refresh."""
+        with self.lock:
+            container = self.containers.get(id)
+            if container:
+                container.limit = mem_limit
+            else:
+                self.containers[id] = ContainerMemory(current=0, limit=mem_limit)
+
+    def container(self, id: str) -> Optional[ContainerMemory]:
+        with self.lock:
+            return self.containers.get(id)
+
+    def headroom(self) -> int:
+        """Bytes that can be given without exceeding the node memory, once every container reaches its limit."""
+        with self.lock:
+            growth = sum(max(0, c.limit - c.current) for c in self.containers.values())
+            return max(0, self.node_limit - self.node_used - growth)
+
+    def capacity(self) -> int:
+        with self.lock:
+            return self.node_limit
@@ -1,16 +1,16 @@
-import grpc
 from bee_rpc import client as bee
 
 import datetime
+from typing import Callable, Optional
 
-from protos import gateway_pb2, gateway_pb2_grpc
+from protos import gateway_pb2
 
 from src.manager.manager import get_client_id_on_other_peer
 from src.database.sql_connection import SQLConnection, is_peer_available
 
 from src.utils.env import DOCKER_NETWORK
-from src.utils.utils import from_gas_amount, get_network_name, to_gas_amount, \
-    generate_uris_by_peer_id
+from src.utils.peer_channels import peer_stub
+from src.utils.utils import from_gas_amount, get_network_name, to_gas_amount
 from src.utils.logger import LOGGER as log
 from src.utils.env import EnvManager
 
@@ -55,7 +55,7 @@ def __get_metrics_internal(id: str) -> gateway_pb2.Metrics:
     )
 
 
-def __get_metrics_external(peer_id: str, token: str) -> gateway_pb2.Metrics:
+def __get_metrics_external(peer_id: str, token: str, timeout: Optional[float] = None) -> gateway_pb2.Metrics:
     """
     Retrieve external metrics using gRPC communication.
 
@@ -65,24 +65,28 @@ def __get_metrics_external(peer_id: str, token: str) -> gateway_pb2.Metrics:
     :type peer_id: str
     :param token: The token used to authenticate the request and retrieve the metrics.
     :type token: str
+    :param timeout: Seconds to wait for the peer, without limit if None.
+    :type timeout: Optional[float]
     :return: A protobuf object containing the external metrics retrieved.
     :rtype: gateway_pb2.Metrics
     """
     return next(bee.client_grpc(
-        method=gateway_pb2_grpc.GatewayStub(
-            grpc.insecure_channel(
-                next(generate_uris_by_peer_id(peer_id=peer_id))
-            )
-        ).GetMetrics,
+        method=peer_stub(peer_id=peer_id).GetMetrics,
         input=gateway_pb2.TokenMessage(
             token=token
         ),
         indices_parser=gateway_pb2.Metrics,
-        partitions_message_mode_parser=True
+        partitions_message_mode_parser=True,
+        timeout=timeout
     ))
 
 
-def gas_amount_on_other_peer(peer_id: str) -> int:
+def gas_amount_on_other_peer(
+        peer_id: str,
+        refresh: Callable[[str, int], bool] = sc.refresh_gas_for_peer,
+        timeout: Optional[float] = None,
+        raise_errors: bool = False
+) -> int:
     """
     Retrieve the gas amount from another peer.
 
@@ -90,9 +94,15 @@ def gas_amount_on_other_peer(peer_id: str) -> int:
 
     :param peer_id: The identifier of the peer from which to retrieve the gas amount.
     :type peer_id: str
-    :return: The gas amount retrieved from the peer. If an error occurs, returns 0.
+    :param refresh: Stores the fetched gas amount of the peer, by default on the database.
+    :type refresh: Callable[[str, int], bool]
+    :param timeout: Seconds to wait for each call to the peer, without limit if None.
+    :type timeout: Optional[float]
+    :param raise_errors: Raise the error of the metrics call instead of returning 0.
+    :type raise_errors: bool
+    :return: The gas amount retrieved from the peer. If an error occurs, returns 0 unless raise_errors is set.
     :rtype: int
-    :raises Exception: If an error occurs while fetching the gas amount.
+    :raises Exception: If no client could be obtained on the peer, or the metrics call fails with raise_errors.
     """
 
     peer = sc.get_peer_by_id(peer_id=peer_id)
@@ -101,21 +111,24 @@ def gas_amount_on_other_peer(peer_id: str) -> int:
         if (datetime.datetime.now() - last_update_time).total_seconds() <= min(10, MANAGER_ITERATION_TIME):
             return peer['gas']
 
-    client_id = get_client_id_on_other_peer(peer_id=peer_id)
+    client_id = get_client_id_on_other_peer(peer_id=peer_id, timeout=timeout)
     try:
         gas = from_gas_amount(
             __get_metrics_external(
                 peer_id=peer_id,
-                token=client_id
+                token=client_id,
+                timeout=timeout
             ).gas_amount
         )
-        sc.refresh_gas_for_peer(peer_id=peer_id, gas=gas)
+        refresh(peer_id, gas)
         return gas
-    except:
+    except Exception:
         log('Error getting gas amount from ' + peer_id + '.')
         if is_peer_available(peer_id=peer_id):
             log('It is assumed that the client was invalid on peer ' + peer_id)
             sc.delete_external_client(peer_id=peer_id)
+        if raise_errors:
+            raise
         return 0
 
 
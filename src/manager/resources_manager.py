@@ -1,7 +1,8 @@
 # I/O Big Data utils.
 import gc
-from time import sleep
-from threading import Lock
+from collections import deque
+from threading import Condition
+from typing import Deque, Dict, Optional, Tuple
 
 import threading
 
@@ -23,8 +24,41 @@ class Singleton(type):
 
 mem_manager = lambda len: IOBigData().lock(len=len)
 
+# Docker CFS period (microseconds) when the service does not set one.
+DEFAULT_CPU_PERIOD = 100_000
+
+
+def cpu_cores(cpu_quota: int, cpu_period: int = 0) -> float:
+    """CPU cores given by a CFS quota, 0 if it has no quota."""
+    return cpu_quota / (cpu_period or DEFAULT_CPU_PERIOD) if cpu_quota else 0.0
+
+
+class RamAdmissionError(Exception):
+    """The RAM requested could not be locked."""
+
+
+class RamRequestTooLarge(RamAdmissionError):
+    """The request is bigger than the whole RAM pool, it would wait forever."""
+
+
+class RamRequest(object):
+    """A RAM lock waiting for admission."""
+
+    def __init__(self, amount: int):
+        self.amount = amount
+        self.done = False  # Admitted or given up, it is skipped when it reaches the head of the queue.
+
 
 class IOBigData(metaclass=Singleton):
+    """
+    RAM admission control of the operations that load big buffers in memory (packers, builds, registry reads).
+
+    The requests are admitted in arrival order (FIFO): a request only takes the RAM when it is at the head
+    of the queue, so a big request is not starved by the smaller ones that arrive after it. The waiters sleep on a condition, notified as soon as some RAM
+    is unlocked or the head of the queue changes. The pool also changes with the memory used by the rest
+    of the system, so they check it again every `poll_interval` seconds.
+    """
+
     class RamLocker(object):
         def __init__(self, len, iobd):
             self.len = len
@@ -40,28 +74,48 @@ class IOBigData(metaclass=Singleton):
 
         def __exit__(self, type, value, traceback):
             self.iobd.unlock_ram(ram_amount=self.len)
-            gc.collect()
+            # Only worth collecting the released buffers when someone is waiting for the RAM.
+            if self.iobd.waiting_amount:
+                gc.collect()
 
     def __init__(self,
                  log=lambda message: print(message),
-                 ram_pool_method=None
+                 ram_pool_method=None,
+                 ram_capacity_method=None,
+                 poll_interval: float = 1
                  ) -> None:
 
         self.ram_pool = ram_pool_method
+        # Upper bound of the pool, a request bigger than it is rejected instead of waiting forever.
+        self.ram_capacity = ram_capacity_method or ram_pool_method
+        self.poll_interval = poll_interval
 
         self.log = log
         self.ram_locked = 0
         self.get_ram_avaliable = lambda: self.ram_pool() - self.ram_locked
-        self.amount_lock = Lock()
+        self.condition = Condition()
+
+        self.queue: Deque[RamRequest] = deque()
+        self.waiting_amount = 0
 
-        self.wait = []
-        self.wait_lock = Lock()
+        # CPU cores and block I/O weight reserved by each service container, None pools are not limited.
+        self.cpu_pool: Optional[float] = None
+        self.blkio_pool: Optional[int] = None
+        self.reservations: Dict[str, Tuple[float, int]] = {}  # ID : (CPU CORES, BLKIO WEIGHT)
+        self.cpu_reserved = 0.0
+        self.blkio_reserved = 0
 
     # General methods.
 
     def set_log(self, log=lambda message: print(message)) -> None:
         self.log = log
 
+    def set_ram_pool(self, ram_pool_method, ram_capacity_method=None) -> None:
+        with self.condition:
+            self.ram_pool = ram_pool_method
+            self.ram_capacity = ram_capacity_method or ram_pool_method
+            self.condition.notify_all()
+
     @staticmethod
     def convert_size(size_bytes):
         import math
@@ -78,22 +132,28 @@ class IOBigData(metaclass=Singleton):
 
     def __stats(self, message: str, comments: bool = False):
         if comments:
-            with self.amount_lock:
+            with self.condition:
                 self.log('\n--------- ' + message + ' -------------')
                 self.log('RAM POOL       -> ' + IOBigData.convert_size(self.ram_pool()))
                 self.log('RAM LOCKED     -> ' + IOBigData.convert_size(self.ram_locked))
                 self.log('RAM AVAILABLE  -> ' + IOBigData.convert_size(self.get_ram_avaliable()))
-                self.log('RAM WAITING    -> ' + IOBigData.convert_size(sum(self.wait)))
+                self.log('RAM WAITING    -> ' + IOBigData.convert_size(self.waiting_amount))
                 self.log('-----------------------------------------\n')
 
-    # Gas manager methods.
-    def __push_wait_list(self, l: int):
-        with self.wait_lock:
-            self.wait.append(l)
+    # Wait queue methods, called with the condition held.
+
+    def __head(self) -> Optional[RamRequest]:
+        while self.queue and self.queue[0].done:
+            self.queue.popleft()
+        return self.queue[0] if self.queue else None
 
-    def __pop_wait_list(self, l: int):
-        with self.wait_lock:
-            self.wait.remove(l)
+    def __leave(self, request: RamRequest):
+        if not request.done:
+            request.done = True
+            self.waiting_amount -= request.amount
+            self.__head()
+            # The next request may be admitted now.
+            self.condition.notify_all()
 
     # Manage resources methods.
 
@@ -101,43 +161,83 @@ class IOBigData(metaclass=Singleton):
         return self.RamLocker(len=len, iobd=self)
 
     def lock_ram(self, ram_amount: int, wait: bool = True):
+        """
+        Locks ram_amount bytes of the pool, waiting for its turn and for the RAM to be available.
+
+        Raises:
+            RamRequestTooLarge: If ram_amount is bigger than the pool capacity.
+            RamAdmissionError: If wait is False and it could not be admitted right away.
+        """
         self.__stats('want lock ' + IOBigData.convert_size(ram_amount))
-        self.__push_wait_list(l=ram_amount)
-        while True:
-            self.__stats('go to lock ' + IOBigData.convert_size(ram_amount))
-            if wait:
-                self.wait_to_prevent_kill(len=ram_amount)
-
-            elif not self.prevent_kill(len=ram_amount):
-                self.__pop_wait_list(l=ram_amount)
-                raise Exception
-
-            with self.amount_lock:
-                if self.get_ram_avaliable() > ram_amount:
-                    self.ram_locked += ram_amount
-                else:
-                    continue
-            self.__pop_wait_list(l=ram_amount)
-            break
+        if ram_amount >= self.ram_capacity():
+            raise RamRequestTooLarge(
+                f"{IOBigData.convert_size(ram_amount)} requested from a pool of "
+                f"{IOBigData.convert_size(self.ram_capacity())}."
+            )
+
+        request = RamRequest(amount=ram_amount)
+        with self.condition:
+            self.queue.append(request)
+            self.waiting_amount += ram_amount
+            try:
+                while True:
+                    if self.__head() is request and self.get_ram_avaliable() > ram_amount:
+                        self.ram_locked += ram_amount
+                        break
+
+                    if not wait:
+                        raise RamAdmissionError(f"{IOBigData.convert_size(ram_amount)} not available.")
+                    self.condition.wait(timeout=self.poll_interval)
+            finally:
+                self.__leave(request)
         self.__stats('locked ' + IOBigData.convert_size(ram_amount))
 
     def unlock_ram(self, ram_amount: int):
-        with self.amount_lock:
+        with self.condition:
             if ram_amount < self.ram_locked:
                 self.ram_locked -= ram_amount
             else:
                 self.ram_locked = 0
+            self.condition.notify_all()
 
         self.__stats('unlocked ' + IOBigData.convert_size(ram_amount))
 
+    # CPU and block I/O pools, reserved by a service container for all its life (not waited for).
+
+    def set_resource_pools(self, cpu_pool: Optional[float], blkio_pool: Optional[int]) -> None:
+        with self.condition:
+            self.cpu_pool = cpu_pool
+            self.blkio_pool = blkio_pool
+
+    def __fits(self, cpu: float, blkio: int, id: Optional[str]) -> bool:
+        previous_cpu, previous_blkio = self.reservations.get(id, (0.0, 0))
+        return (self.cpu_pool is None or self.cpu_reserved - previous_cpu + cpu <= self.cpu_pool) and \
+            (self.blkio_pool is None or self.blkio_reserved - previous_blkio + blkio <= self.blkio_pool)
+
+    def could_reserve(self, cpu: float = 0.0, blkio: int = 0, id: Optional[str] = None) -> bool:
+        """If the CPU cores and block I/O weight are free, besides what the container id has already reserved."""
+        with self.condition:
+            return self.__fits(cpu=cpu, blkio=blkio, id=id)
+
+    def reserve_resources(self, id: str, cpu: float = 0.0, blkio: int = 0) -> bool:
+        """Replaces the reservation of the container, False (and nothing changes) if it does not fit."""
+        with self.condition:
+            if not self.__fits(cpu=cpu, blkio=blkio, id=id):
+                return False
+            previous_cpu, previous_blkio = self.reservations.get(id, (0.0, 0))
+            self.cpu_reserved += cpu - previous_cpu
+            self.blkio_reserved += blkio - previous_blkio
+            self.reservations[id] = (cpu, blkio)
+        self.__stats(f'reserved {cpu} cores and {blkio} blkio weight for {id}')
+        return True
+
+    def release_resources(self, id: str) -> None:
+        with self.condition:
+            cpu, blkio = self.reservations.pop(id, (0.0, 0))
+            self.cpu_reserved -= cpu
+            self.blkio_reserved -= blkio
+
     def prevent_kill(self, len: int) -> bool:
-        with self.amount_lock:
+        with self.condition:
             b = self.get_ram_avaliable() > len
         return b
-
-    def wait_to_prevent_kill(self, len: int) -> None:
-        while True:
-            if not self.prevent_kill(len=len):
-                sleep(1)
-            else:
-                return
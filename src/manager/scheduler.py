@@ -0,0 +1,108 @@
+import random
+from dataclasses import dataclass, field
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+
+from src.utils import logger as log
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    errors: int = 0
+    overruns: int = 0
+    last_duration: float = 0.0
+    max_duration: float = 0.0
+    total_duration: float = 0.0
+    last_error: Optional[str] = None
+
+    @property
+    def mean_duration(self) -> float:
+        return self.total_duration / self.runs if self.runs else 0.0
+
+
+@dataclass
+class Job:
+    name: str
+    function: Callable[[], None]
+    period: float  # Seconds between two consecutive starts.
+    jitter: float = 0.0  # Fraction of the period a start can be randomly delayed.
+    run_at_start: bool = True
+    stats: JobStats = field(default_factory=JobStats)
+
+
+class JobScheduler:
+    """
+    Runs each manager job on its own thread with its own period, so a slow job (network, downloads)
+    does not delay the others.
+
+    Jobs are scheduled at a fixed rate: every start is planned one period after the previous planned start,
+    and the jitter only shifts a start without moving the following ones, so the average cadence is
+    exactly the period. A job never overlaps with itself; when a run takes longer than its period
+    it is counted as an overrun and the next run starts right after it, skipping the missed ones.
+    """
+
+    def __init__(self):
+        self.jobs: List[Job] = []
+        self.lock = Lock()
+        self.stop_event = Event()
+
+    def add(self, name: str, function: Callable[[], None], period: float,
+            jitter: float = 0.0, run_at_start: bool = True):
+        self.jobs.append(Job(name=name, function=function, period=period, jitter=jitter, run_at_start=run_at_start))
+
+    def start(self):
+        for job in self.jobs:
+            Thread(target=self._run_job, args=(job,), name=f"job-{job.name}", daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run_job(self, job: Job):
+        next_start = monotonic() + (0 if job.run_at_start else job.period)
+        while not self.stop_event.wait(
+                max(0.0, next_start + random.uniform(0, job.jitter * job.period) - monotonic())
+        ):
+            start = monotonic()
+            error = None
+            try:
+                job.function()
+            except Exception as e:
+                error = str(e)
+                log.LOGGER(f"Job {job.name} failed: {e}")
+            duration = monotonic() - start
+
+            next_start += job.period
+            overrun = monotonic() > next_start
+            if overrun:
+                log.LOGGER(f"Job {job.name} overrun: took {duration:.2f}s with a period of {job.period}s.")
+                next_start = monotonic()
+
+            with self.lock:
+                stats = job.stats
+                stats.runs += 1
+                stats.errors += error is not None
+                stats.overruns += overrun
+                stats.last_duration = duration
+                stats.max_duration = max(stats.max_duration, duration)
+                stats.total_duration += duration
+                if error is not None:
+                    stats.last_error = error
+
+    def metrics(self) -> Dict[str, dict]:
+        """Timing metrics of every job."""
+        with self.lock:
+            return {
+                job.name: {
+                    "period": job.period,
+                    "runs": job.stats.runs,
+                    "errors": job.stats.errors,
+                    "overruns": job.stats.overruns,
+                    "last_duration": job.stats.last_duration,
+                    "mean_duration": job.stats.mean_duration,
+                    "max_duration": job.stats.max_duration,
+                    "last_error": job.stats.last_error,
+                }
+                for job in self.jobs
+            }
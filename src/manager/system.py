@@ -1,7 +1,7 @@
 import requests
 import psutil
 import time
-from typing import Dict, Generator
+from typing import Dict, Generator, List, Tuple
 
 from src.database.sql_connection import SQLConnection
 from src.utils.env import EnvManager
@@ -25,19 +25,25 @@ DEFAULT_POWER_RATE = float(env_manager.get_env("DEFAULT_POWER_RATE"))
 MAX_POWER_CONSUMPTION = float(env_manager.get_env("MAX_POWER_CONSUMPTION"))
 MIN_MEMORY_LIMIT = int(env_manager.get_env("MIN_MEMORY_LIMIT"))
 
+# Samples written to the database in each batch.
+ENERGY_BATCH_SIZE = int(env_manager.get_env("ENERGY_BATCH_SIZE"))
+
 
 class EnergyCostMonitor:
     def __init__(self):
         """Initialize the energy and cost monitor"""
-        self.setup_logging()
         self.db = sc
+        self.pending: List[Tuple[float, float, float, float, float]] = []
 
     def get_current_energy_price(self) -> float:
         """Get current energy price from API"""
+        if not ENERGY_API_URL:
+            return DEFAULT_POWER_RATE
+
         headers = {'Authorization': f'Bearer {ENERGY_API_KEY}'} if ENERGY_API_KEY else {}
         
         try:
-            response = requests.get(ENERGY_API_URL, headers=headers)
+            response = requests.get(ENERGY_API_URL, headers=headers, timeout=10)
             response.raise_for_status()
             return response.json()['price_per_kwh']
         except requests.RequestException as e:
@@ -63,18 +69,21 @@ class EnergyCostMonitor:
         return (power_consumption / 1000) * price_per_kwh
 
     def record_metrics(self):
-        """Record current metrics to database"""
+        """Record current metrics, they are written to the database in batches of ENERGY_BATCH_SIZE samples"""
         try:
             metrics = self.get_system_metrics()
             current_price = self.get_current_energy_price()
             cost = self.calculate_cost(metrics['power_consumption'], current_price)
             
-            self.db.insert_energy_record(
-                cpu_percent=metrics['cpu_percent'],
-                memory_usage=metrics['memory_usage'],
-                power_consumption=metrics['power_consumption'],
-                cost=cost
-            )
+            self.pending.append((
+                time.time(),
+                metrics['cpu_percent'],
+                metrics['memory_usage'],
+                metrics['power_consumption'],
+                cost
+            ))
+            if len(self.pending) >= ENERGY_BATCH_SIZE:
+                self.flush()
             
             log(
                 f"Metrics recorded: CPU: {metrics['cpu_percent']}%, "
@@ -86,6 +95,13 @@ class EnergyCostMonitor:
         except Exception as e:
             log(f"Error recording metrics: {e}")
 
+    def flush(self):
+        """Write the pending samples to database and apply the retention policy"""
+        if self.pending:
+            self.db.insert_energy_records(self.pending)
+            self.pending = []
+        self.db.prune_energy_records()
+
     def monitor(self, interval: int = None):
         """Start continuous monitoring"""
         if interval is None:
@@ -98,6 +114,8 @@ class EnergyCostMonitor:
                 time.sleep(interval)
         except KeyboardInterrupt:
             log("Monitoring stopped by user")
+        finally:
+            self.flush()
             
 
     def get_historical_data(self, limit: int = 100) -> Generator[Dict, None, None]:
@@ -0,0 +1,230 @@
+import errno
+import heapq
+import itertools
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Condition, Event, Lock, Thread
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from bee_rpc import client as peerpc
+
+from protos import gateway_pb2
+from protos.gateway_pb2_bee import StartService_input_indices, StartService_input_message_mode
+from src.utils import logger as log
+from src.utils.env import SHA3_256_ID, EnvManager
+from src.utils.peer_channels import peer_stub
+from src.utils.singleton import Singleton
+from src.utils.utils import peers_id_iterator
+
+env_manager = EnvManager()
+
+REGISTRY = env_manager.get_env("REGISTRY")
+METADATA_REGISTRY = env_manager.get_env("METADATA_REGISTRY")
+WANTED_SERVICES_MAX = int(env_manager.get_env("WANTED_SERVICES_MAX"))
+WANTED_SERVICES_CONCURRENCY = int(env_manager.get_env("WANTED_SERVICES_CONCURRENCY"))
+WANTED_SERVICES_RACING_PEERS = int(env_manager.get_env("WANTED_SERVICES_RACING_PEERS"))
+WANTED_SERVICES_TIMEOUT = env_manager.get_env("WANTED_SERVICES_TIMEOUT")
+
+
+def _move(source: str, destination: str):
+    """Atomic rename, copying first when the source is on another file system."""
+    try:
+        os.replace(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        staging = f"{destination}.{os.getpid()}.tmp"
+        try:
+            shutil.move(source, staging)
+            os.replace(staging, destination)
+        finally:
+            if os.path.isdir(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+            elif os.path.exists(staging):
+                os.remove(staging)
+
+
+class _Race:
+    """Download of one service raced between several peers, the first complete download wins."""
+
+    def __init__(self, service_hash: str):
+        self.service_hash = service_hash
+        self.won = Event()
+        self.lock = Lock()
+
+    def download(self, peer_id: str) -> bool:
+        log.LOGGER(f"Using peer {peer_id} to get the service {self.service_hash}")
+        deadline = monotonic() + WANTED_SERVICES_TIMEOUT
+        metadata: Optional[bytes] = None
+        service_dir: Optional[str] = None
+        chunks = peerpc.client_grpc(
+            method=peer_stub(peer_id=peer_id).GetService,
+            indices_serializer=StartService_input_indices,
+            indices_parser=StartService_input_indices,
+            partitions_message_mode_parser=StartService_input_message_mode,
+            timeout=max(0, deadline - monotonic()),
+            input=gateway_pb2.celaut__pb2.Metadata.HashTag.Hash(
+                type=SHA3_256_ID,
+                value=bytes.fromhex(self.service_hash)
+            )
+        )
+        try:
+            for b in chunks:
+                if self.won.is_set() or monotonic() > deadline:
+                    break  # Closing the generator cancels the stream.
+                if type(b) == gateway_pb2.celaut__pb2.Metadata:
+                    metadata = b.SerializeToString()
+                elif type(b) == peerpc.Dir and b.type == gateway_pb2.celaut__pb2.Service:
+                    service_dir = b.dir
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+        try:
+            with self.lock:
+                if service_dir and not self.won.is_set():
+                    if self.__store(service_dir=service_dir, metadata=metadata):
+                        log.LOGGER(f"Wanted service {self.service_hash} stored successfully from peer {peer_id}.")
+                    else:
+                        log.LOGGER(f"Wanted service {self.service_hash} was stored meanwhile, peer {peer_id} not needed.")
+                    self.won.set()
+                    return True
+        finally:
+            # Left there if it was not moved to the registry.
+            if service_dir and os.path.exists(service_dir):
+                shutil.rmtree(service_dir, ignore_errors=True)
+
+        if not self.won.is_set():
+            log.LOGGER(f"Peer {peer_id} did not return the service {self.service_hash} on time.")
+        return False
+
+    def __store(self, service_dir: str, metadata: Optional[bytes]) -> bool:
+        """
+        Moves the download to the registry, False if the service was already there (stored by another path
+        while the race ran), in which case nothing is moved.
+        """
+        destination = f"{REGISTRY}{self.service_hash}"
+        if os.path.exists(destination):
+            return False
+
+        if metadata is not None:
+            staged = f"{METADATA_REGISTRY}{self.service_hash}.{os.getpid()}.tmp"
+            try:
+                with open(staged, "wb") as f:
+                    f.write(metadata)
+                _move(staged, f"{METADATA_REGISTRY}{self.service_hash}")
+            finally:
+                if os.path.exists(staged):
+                    os.remove(staged)
+
+        try:
+            _move(service_dir, destination)
+        except OSError:
+            # Not empty or existing, it was stored right before the move.
+            if not os.path.exists(destination):
+                raise
+            return False
+        return True
+
+
+class WantedServices(metaclass=Singleton):
+    """
+    Services requested to this node that are not on its registry, fetched from the peers on the background.
+
+    It doesn't make sense to store this on disk (DB), as each of the elements in the list
+    requires a search in the pairs to obtain a complete service.
+    Therefore, the bottleneck is in the number of operations rather than the cost of the object in memory.
+    Thus, what would make sense, as a control against attacks, is a maximum number of elements in the list,
+    so that if it 'fills up,' no more elements can enter, and they are not searched until requested again
+    at some other time when there is space.
+
+    The queue is bounded by WANTED_SERVICES_MAX and prioritized by the number of times each service was requested.
+    WANTED_SERVICES_CONCURRENCY services are fetched at the same time, each one raced between
+    WANTED_SERVICES_RACING_PEERS peers, so a slow peer does not delay the rest.
+    """
+
+    def __init__(self):
+        self.requests: Dict[str, int] = {}  # HASH : TIMES REQUESTED, for queued and in progress services.
+        self.in_progress: set = set()
+        self.heap: List[Tuple[int, int, str]] = []  # (-TIMES REQUESTED, ORDER, HASH), stale entries are skipped.
+        self.order = itertools.count()
+        self.condition = Condition()
+        self.executor = ThreadPoolExecutor(
+            max_workers=WANTED_SERVICES_CONCURRENCY * WANTED_SERVICES_RACING_PEERS,
+            thread_name_prefix="wanted-services"
+        )
+        self.thread: Optional[Thread] = None
+
+    def __contains__(self, service_hash: str) -> bool:
+        with self.condition:
+            return service_hash in self.requests
+
+    def keys(self) -> List[str]:
+        with self.condition:
+            return list(self.requests)
+
+    def add(self, service_hash: str) -> bool:
+        """Adds the service to the queue, or raises its priority if it is already there. False if it is full."""
+        with self.condition:
+            if service_hash not in self.requests and len(self.requests) >= WANTED_SERVICES_MAX:
+                return False
+            self.requests[service_hash] = self.requests.get(service_hash, 0) + 1
+            if service_hash not in self.in_progress:
+                heapq.heappush(self.heap, (-self.requests[service_hash], next(self.order), service_hash))
+                self.condition.notify()
+            return True
+
+    def start(self):
+        with self.condition:
+            if not self.thread:
+                self.thread = Thread(target=self._dispatch, daemon=True)
+                self.thread.start()
+
+    def _next(self) -> str:
+        # Must be called with the condition held.
+        while True:
+            while len(self.in_progress) >= WANTED_SERVICES_CONCURRENCY or not self.heap:
+                self.condition.wait()
+            priority, _, service_hash = heapq.heappop(self.heap)
+            if service_hash in self.requests and service_hash not in self.in_progress \
+                    and -priority == self.requests[service_hash]:
+                self.in_progress.add(service_hash)
+                return service_hash
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                service_hash = self._next()
+            Thread(target=self._fetch, args=(service_hash,), daemon=True).start()
+
+    def _fetch(self, service_hash: str):
+        log.LOGGER(f"Taking the service {service_hash}")
+        race = _Race(service_hash=service_hash)
+        try:
+            peers = peers_id_iterator()
+            racing = set()
+            while not race.won.is_set():
+                # Keep WANTED_SERVICES_RACING_PEERS downloads running until one of them completes.
+                for peer_id in itertools.islice(peers, WANTED_SERVICES_RACING_PEERS - len(racing)):
+                    racing.add(self.executor.submit(race.download, peer_id))
+                if not racing:
+                    log.LOGGER(f"No peer could provide the service {service_hash}.")
+                    break
+                done, racing = wait(racing, timeout=WANTED_SERVICES_TIMEOUT, return_when=FIRST_COMPLETED)
+                if not done:
+                    # Stalled streams, the next peers take their place. They still win if they finish first.
+                    log.LOGGER(f"Peers stalled getting the service {service_hash}, trying the next ones.")
+                    racing = set()
+                for future in done:
+                    if future.exception():
+                        log.LOGGER(f"Exception getting the service {service_hash}. {str(future.exception())}. Continue")
+        except Exception as e:
+            log.LOGGER(f"Exception getting the service {service_hash}: {e}")
+        finally:
+            with self.condition:
+                self.in_progress.discard(service_hash)
+                # Stored, or not found: it is searched again only when requested again.
+                del self.requests[service_hash]
+                self.condition.notify()
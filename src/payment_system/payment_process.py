@@ -1,16 +1,16 @@
 from hashlib import sha3_256
 from threading import Thread
-from time import sleep
+from time import monotonic, sleep
+from typing import Optional
 from datetime import datetime, timedelta
 from threading import Lock
-import grpc
 from bee_rpc import client as bee
 from src.payment_system.exceptions import DoubleSpendingAttempt
 from src.payment_system.ledger_balancer import ledger_balancer
 
 from src.payment_system.contracts.envs import AVAILABLE_PAYMENT_PROCESS, INIT_INTERFACES, MANAGE_INTERFACES, PAYMENT_PROCESS_VALIDATORS, DEMOS
 
-from protos import gateway_pb2_grpc, gateway_pb2
+from protos import gateway_pb2
 
 from src.reputation_system.interface import update_reputation
 
@@ -18,7 +18,8 @@ from src.manager.manager import get_client_id_on_other_peer, increase_local_gas_
 from src.database.sql_connection import SQLConnection
 
 from src.utils import logger as _l
-from src.utils.utils import to_gas_amount, generate_uris_by_peer_id
+from src.utils.peer_channels import PeerUnreachable, peer_stub
+from src.utils.utils import to_gas_amount
 from src.database.access_functions.ledgers import get_peer_contract_instances
 from src.utils.env import EnvManager
 
@@ -46,14 +47,18 @@ def generate_deposit_token(client_id: str) -> str:
 
 # Helper function to create the gRPC stub and get URIs
 def __get_grpc_stub(peer_id):
-    uri = next(generate_uris_by_peer_id(peer_id=peer_id), None)
-    if uri is None:
+    try:
+        return peer_stub(peer_id=peer_id)
+    except PeerUnreachable:
         return None
-    return gateway_pb2_grpc.GatewayStub(grpc.insecure_channel(uri))
 
 
-def __peer_payment_process(peer_id: str, amount: int) -> bool:
-    client_id: str = get_client_id_on_other_peer(peer_id=peer_id)
+def __remaining(deadline: Optional[float]) -> Optional[float]:
+    return max(0, deadline - monotonic()) if deadline is not None else None
+
+
+def __peer_payment_process(peer_id: str, amount: int, deadline: Optional[float] = None) -> bool:
+    client_id: str = get_client_id_on_other_peer(peer_id=peer_id, timeout=__remaining(deadline))
     if not client_id:
         _l.LOGGER("No client available.")
         return False
@@ -71,7 +76,8 @@ def __peer_payment_process(peer_id: str, amount: int) -> bool:
             method=grpc_stub.GenerateDepositToken,
             partitions_message_mode_parser=True,
             input=gateway_pb2.Client(client_id=client_id),
-            indices_parser=gateway_pb2.TokenMessage
+            indices_parser=gateway_pb2.TokenMessage,
+            timeout=__remaining(deadline)
         ), None).token
     except Exception as e:
         _l.LOGGER(f"Error generating deposit token: {str(e)}")
@@ -166,7 +172,9 @@ def __attempt_payment_communication(peer_id: str, amount: int, deposit_token: st
                     gas_amount=to_gas_amount(amount),
                     deposit_token=deposit_token,
                     contract_ledger=contract_ledger,
-                )
+                ),
+                # The payment is already on the ledger, each attempt is bounded but not cut by the caller deadline.
+                timeout=COMMUNICATION_ATTEMPTS_DELAY
             ), None)
 
             _l.LOGGER(f"Payment of {amount} to {peer_id} communicated successfully.")
@@ -182,12 +190,12 @@ def __attempt_payment_communication(peer_id: str, amount: int, deposit_token: st
     return False
 
 
-def increase_deposit_on_peer(peer_id: str, amount: int) -> bool:
+def increase_deposit_on_peer(peer_id: str, amount: int, deadline: Optional[float] = None) -> bool:
     if amount < MIN_DEPOSIT_PEER: amount = MIN_DEPOSIT_PEER
     
     _l.LOGGER('Increase deposit on peer ' + peer_id + ' by ' + str(amount))
     try:
-        if __peer_payment_process(peer_id=peer_id, amount=amount):
+        if __peer_payment_process(peer_id=peer_id, amount=amount, deadline=deadline):
             if sc.add_gas_to_peer(peer_id=peer_id, gas=amount):
                 return True
             else:
@@ -0,0 +1,72 @@
+import atexit
+from threading import Event, Lock, Thread
+from typing import Dict, List, Optional
+
+from src.database.sql_connection import SQLConnection
+from src.utils import logger as log
+from src.utils.env import EnvManager
+from src.utils.singleton import Singleton
+
+env_manager = EnvManager()
+
+REPUTATION_FLUSH_INTERVAL = env_manager.get_env("REPUTATION_FLUSH_INTERVAL")
+REPUTATION_FLUSH_THRESHOLD = env_manager.get_env("REPUTATION_FLUSH_THRESHOLD")
+
+sc = SQLConnection()
+
+
+class ReputationAccumulator(metaclass=Singleton):
+    """
+    Write-behind buffer for the peer reputation updates.
+
+    Reputation changes arrive on the hot paths (payments, maintenance ticks, communication failures),
+    so they are only added to an in-memory delta per peer. A background thread writes the pending deltas
+    to the database every REPUTATION_FLUSH_INTERVAL seconds, or as soon as REPUTATION_FLUSH_THRESHOLD
+    peers are pending, in a single executemany transaction. The remaining deltas are flushed at exit.
+    """
+
+    def __init__(self):
+        self.pending: Dict[str, List[int]] = {}  # PEER ID : [SCORE DELTA, UPDATES]
+        self.lock = Lock()
+        self.flush_lock = Lock()
+        self.wake_up = Event()
+        self.thread: Optional[Thread] = None
+        atexit.register(self.flush)
+
+    def add(self, peer_id: str, amount: int):
+        with self.lock:
+            delta = self.pending.setdefault(peer_id, [0, 0])
+            delta[0] += amount
+            delta[1] += 1
+            full = len(self.pending) >= REPUTATION_FLUSH_THRESHOLD
+            if not self.thread:
+                self.thread = Thread(target=self._flush_loop, daemon=True)
+                self.thread.start()
+        if full:
+            self.wake_up.set()
+
+    def flush(self) -> int:
+        """Writes the pending deltas to the database, returns the number of peers updated."""
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                deltas, self.pending = self.pending, {}
+
+            try:
+                return sc.apply_reputation_deltas(deltas=deltas)
+            except Exception as e:
+                # Keep the deltas, so they are written on the next flush.
+                log.LOGGER(f"Error flushing the reputation of {len(deltas)} peers: {e}")
+                with self.lock:
+                    for peer_id, (score, updates) in deltas.items():
+                        delta = self.pending.setdefault(peer_id, [0, 0])
+                        delta[0] += score
+                        delta[1] += updates
+                return 0
+
+    def _flush_loop(self):
+        while True:
+            self.wake_up.wait(timeout=REPUTATION_FLUSH_INTERVAL)
+            self.wake_up.clear()
+            self.flush()
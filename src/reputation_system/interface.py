@@ -1,17 +1,22 @@
-from typing import Optional
 from src.utils.env import EnvManager
 from src.database.sql_connection import SQLConnection
+from src.reputation_system.accumulator import ReputationAccumulator
 from src.utils.logger import LOGGER
 from src.reputation_system.contracts.ergo.transaction import submit_reputation_proof
 
 sc = SQLConnection()
 env_manager = EnvManager()
 
-def update_reputation(token: str, amount: int) -> Optional[str]:
+def update_reputation(token: str, amount: int) -> None:
+    """
+    Adds amount to the reputation of the peer behind the token.
+    The change is buffered and written on the next flush of the accumulator, so it can not report
+    whether the peer exists or the update succeeded, and nothing is returned.
+    """
     # Take the peer_id when the token it's external. Do nothing if it's an internal service.
     peer_id: str = token.split('##')[1] if "##" in token else token
-    if sc.peer_exists(peer_id=peer_id):
-        return sc.update_reputation_peer(peer_id, amount)
+    # Buffered, the ids that are not peers are discarded when the deltas are written.
+    ReputationAccumulator().add(peer_id, amount)
 
     # For services.
     # For clients.
@@ -22,11 +27,13 @@ def compute_reputation(peer_id) -> float:
     As an initial implementation, the node will only consider its own observations.
     Therefore, it will not take into account the reputation assigned by other peers for each of the pairs it interacts with.
     """
+    ReputationAccumulator().flush()
     _result: float = sc.get_reputation(peer_id)
     LOGGER(f"Computed reputation: {_result}")
     return _result
 
 def submit_reputation(force_submit: bool = False):
+    ReputationAccumulator().flush()
     sc.submit_to_ledger(
         submit=lambda objects: submit_reputation_proof(objects=objects),
         force_submit=force_submit
@@ -1,14 +1,24 @@
+import os
+import signal
+import sys
 import threading
 from concurrent import futures
 
 import grpc, json
 
 from protos import gateway_pb2, gateway_pb2_grpc
+from src.database.migrate import migrate
 from src.gateway.gateway import Gateway
 from src.tunneling_system.tunnels import TunnelSystem
-from src.manager.maintain_thread import manager_thread
+from src.manager.maintain_thread import manager_thread, scheduler
+from src.manager.manager import reserve_registered_resources
+from src.manager.docker_inventory import DockerInventory
+from src.manager.memory_accountant import MemoryAccountant
+from src.manager.resources_manager import IOBigData
+from src.manager.system import EnergyCostMonitor
 from src.utils import logger as log
 from src.utils.env import EnvManager
+from src.utils.peer_channels import SERVER_KEEPALIVE_OPTIONS
 
 env_manager = EnvManager()
 
@@ -24,17 +34,44 @@ COST_AVERAGE_VARIATION = env_manager.get_env("COST_AVERAGE_VARIATION")
 GAS_COST_FACTOR = env_manager.get_env("GAS_COST_FACTOR")
 MODIFY_SERVICE_SYSTEM_RESOURCES_COST = env_manager.get_env("MODIFY_SERVICE_SYSTEM_RESOURCES_COST")
 EXTERNAL_COST_TIMEOUT = env_manager.get_env("EXTERNAL_COST_TIMEOUT")
+CPU_OVERCOMMIT_FACTOR = env_manager.get_env("CPU_OVERCOMMIT_FACTOR")
+BLKIO_WEIGHT_POOL = env_manager.get_env("BLKIO_WEIGHT_POOL")
 
 def serve():
 
+    # Apply the pending schema migrations, the database is kept.
+    migrate()
+
+    # Admit the memory by what the node and the service containers actually use.
+    # The first refresh runs here, so the admission path only reads memory and never the database.
+    MemoryAccountant().start()
+    IOBigData().set_ram_pool(
+        ram_pool_method=MemoryAccountant().headroom,
+        ram_capacity_method=MemoryAccountant().capacity
+    )
+    IOBigData().set_resource_pools(
+        cpu_pool=(os.cpu_count() or 1) * CPU_OVERCOMMIT_FACTOR,
+        blkio_pool=BLKIO_WEIGHT_POOL
+    )
+    reserve_registered_resources()
+
+    # Keep the local images and containers of the cost estimates current from the Docker events.
+    DockerInventory().start()
+
     # Run manager.
     threading.Thread(
         target=manager_thread,
         daemon=True
     ).start()
 
+    # Run the energy consumption monitor.
+    threading.Thread(
+        target=EnergyCostMonitor().monitor,
+        daemon=True
+    ).start()
+
     # create a gRPC server
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=30))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=30), options=SERVER_KEEPALIVE_OPTIONS)
     gateway_pb2_grpc.add_GatewayServicer_to_server(
         Gateway(), server=server
     )
@@ -60,5 +97,12 @@ def serve():
     log.LOGGER('Starting gateway at port' + str(GATEWAY_PORT))
     log.LOGGER(f"Available tunnels: {json.dumps(TunnelSystem().get_gateway_urls(), indent=4)}")
 
+    # Exit through SystemExit on SIGTERM, so the atexit handlers (reputation flush) run.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     server.start()
-    server.wait_for_termination()
+    try:
+        server.wait_for_termination()
+    finally:
+        # No manager job starts after this, so the reputation flush at exit is not followed by more updates.
+        scheduler.stop()
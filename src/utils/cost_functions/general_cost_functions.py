@@ -1,36 +1,35 @@
+from typing import Optional
+
 from protos import celaut_pb2 as celaut, gateway_pb2
+from src.database.sql_connection import SQLConnection
+from src.manager.docker_inventory import DockerInventory
+from src.manager.resources_manager import cpu_cores
 from src.virtualizers.docker import build
 from src.virtualizers.docker.architecture import check_supported_architecture, UnsupportedArchitectureException
 from src.utils import logger as log
-from src.utils.env import DOCKER_CLIENT, EnvManager
+from src.utils.env import EnvManager
 from src.utils.verify import get_service_hex_main_hash
 
 env_manager = EnvManager()
 
 MEMORY_LIMIT_COST_FACTOR = env_manager.get_env("MEMORY_LIMIT_COST_FACTOR")
+CPU_CORE_COST_FACTOR = env_manager.get_env("CPU_CORE_COST_FACTOR")
+BLKIO_WEIGHT_COST_FACTOR = env_manager.get_env("BLKIO_WEIGHT_COST_FACTOR")
 COST_OF_BUILD = env_manager.get_env("COST_OF_BUILD")
 COMPUTE_POWER_RATE = env_manager.get_env("COMPUTE_POWER_RATE")
 EXECUTION_BENEFIT = env_manager.get_env("EXECUTION_BENEFIT")
 GAS_COST_FACTOR = env_manager.get_env("GAS_COST_FACTOR")
+ENERGY_COST_WINDOW = env_manager.get_env("ENERGY_COST_WINDOW")
+ENERGY_COST_GAS_FACTOR = env_manager.get_env("ENERGY_COST_GAS_FACTOR")
+
+sc = SQLConnection()
 
 
 def __is_service_built(service_hash: str) -> bool:
-    """Check if the service is built by comparing the service hash with existing Docker images."""
+    """Check if the service is built, from the images of the Docker inventory (no Docker API call while it is current)."""
     try:
-        # Get the list of images
-        images = DOCKER_CLIENT().images.list()
-        
-        # Check if images exist and process tags safely
-        for img in images:
-            try:
-                if img.tags and isinstance(img.tags[0], str):  # Validate tag structure
-                    # Extract the hash from the tag and check if it matches the service_hash
-                    if service_hash == img.tags[0].split('.')[0]:
-                        return True
-            except:
-                continue
-    except (IndexError, AttributeError) as e:
-        # Log the error, handle exceptions for missing attributes or invalid indexing
+        return DockerInventory().is_built(service_hash=service_hash)
+    except Exception as e:
         print(f"An error occurred while checking if service is built: {e}")
     return False
 
@@ -61,11 +60,22 @@ def __build_cost(metadata: celaut.Metadata) -> int:
     return COST_OF_BUILD  # Default to return base build cost
 
 
-def __execution_cost(metadata: celaut.Metadata) -> int:
+def __compute_power_cost() -> float:
+    """
+    Cost of the node load, from the average energy cost measured over the last ENERGY_COST_WINDOW seconds.
+    Falls back to COMPUTE_POWER_RATE per running container while there are no energy samples.
+    """
+    energy = sc.get_energy_aggregate(window=ENERGY_COST_WINDOW)
+    if energy:
+        return energy['cost'] * ENERGY_COST_GAS_FACTOR
+    return DockerInventory().running_containers() * COMPUTE_POWER_RATE
+
+
+def compute_execution_cost(metadata: celaut.Metadata) -> int:
     log.LOGGER('Get execution cost')
     try:
         return sum([
-            len(DOCKER_CLIENT().containers.list()) * COMPUTE_POWER_RATE,
+            __compute_power_cost(),
             __build_cost(metadata=metadata),
             EXECUTION_BENEFIT
         ])
@@ -79,19 +89,28 @@ def __execution_cost(metadata: celaut.Metadata) -> int:
 def compute_start_service_cost(
         metadata: celaut.Metadata,
         initial_gas_amount: int,
-        resource: gateway_pb2.CombinationResources.Clause
+        resource: gateway_pb2.CombinationResources.Clause,
+        execution_cost: Optional[int] = None
 ) -> int:
+    # The execution cost does not depend on the clause, it can be computed once for all of them.
     return int(sum([
-        __execution_cost(
+        (execution_cost if execution_cost is not None else compute_execution_cost(
             metadata=metadata
-        ) * GAS_COST_FACTOR,
+        )) * GAS_COST_FACTOR,
         initial_gas_amount,
         compute_maintenance_cost(system_resources=resource.min_sysreq)
     ]))
 
 
 def compute_maintenance_cost(system_resources: celaut.Sysresources) -> int:
-    return int(MEMORY_LIMIT_COST_FACTOR * system_resources.mem_limit)
+    # Memory limit, CPU cores of the CFS quota and block I/O weight. A service without CPU quota
+    # or I/O weight only pays for its memory.
+    return int(sum([
+        MEMORY_LIMIT_COST_FACTOR * system_resources.mem_limit,
+        CPU_CORE_COST_FACTOR * cpu_cores(cpu_quota=system_resources.cpu_quota,
+                                         cpu_period=system_resources.cpu_period),
+        BLKIO_WEIGHT_COST_FACTOR * system_resources.blkio_weight
+    ]))
 
 
 def normalized_maintain_cost(cost, timelapse) -> int:
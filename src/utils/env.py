@@ -175,10 +175,30 @@ env_manager.get_env("ERGO_DONATION_WALLET", "9gGZp7HRAFxgGWSwvS4hCbxM2RpkYr6pHvw
 env_manager.get_env("ERGO_DONATION_PERCENTAGE", "0.00")
 env_manager.get_env("SUBMIT_REPUTATION_AT_INIT", False)
 env_manager.get_env("SUBMIT_NETWORK_ADDRESS_TO_REPUTATION_PROOF", True)
+env_manager.get_env("REPUTATION_FLUSH_INTERVAL", 5)
+env_manager.get_env("REPUTATION_FLUSH_THRESHOLD", 256)
+
+# Energy Monitoring Settings
+env_manager.get_env("ENERGY_API_URL", "")
+env_manager.get_env("ENERGY_API_KEY", "")
+env_manager.get_env("MONITOR_INTERVAL", 60)
+env_manager.get_env("DEFAULT_POWER_RATE", 0.15)  # Price per kWh.
+env_manager.get_env("MAX_POWER_CONSUMPTION", 100)  # Watts at full CPU usage.
+env_manager.get_env("MIN_MEMORY_LIMIT", 0)
+env_manager.get_env("ENERGY_BATCH_SIZE", 10)
+env_manager.get_env("ENERGY_RAW_RETENTION", 6 * 3600)
+env_manager.get_env("ENERGY_MINUTE_RETENTION", 7 * 86_400)
+env_manager.get_env("ENERGY_HOUR_RETENTION", 365 * 86_400)
+env_manager.get_env("ENERGY_COST_WINDOW", 3600)
+env_manager.get_env("ENERGY_COST_GAS_FACTOR", 1000)  # Gas per unit of hourly energy cost.
 
 # Logging and Memory Settings
 env_manager.get_env("MEMORY_LOGS", False)
 env_manager.get_env("MEMORY_LIMIT_COST_FACTOR", 1 / pow(10, 6))
+env_manager.get_env("CPU_CORE_COST_FACTOR", 100)
+env_manager.get_env("BLKIO_WEIGHT_COST_FACTOR", 0.1)
+env_manager.get_env("MEMORY_ACCOUNTING_INTERVAL", 5)
+env_manager.get_env("CGROUP_ROOT", "/sys/fs/cgroup")
 
 # Cost and Deposit Settings
 env_manager.get_env("DEFAULT_INITIAL_GAS_AMOUNT_FACTOR", 1 / pow(10, 6))
@@ -194,6 +214,7 @@ env_manager.get_env("COST_OF_BUILD", 5)
 env_manager.get_env("EXECUTION_BENEFIT", 1)
 env_manager.get_env("MODIFY_SERVICE_SYSTEM_RESOURCES_COST", 1)
 env_manager.get_env("ALLOW_GAS_DEBT", False)
+env_manager.get_env("GAS_RATE_TOLERANCE", 0.05)
 env_manager.get_env("DEV_CLIENT_GAS_AMOUNT", pow(10, 256))
 
 # Timing and Delay Settings
@@ -201,14 +222,46 @@ env_manager.get_env("GENERAL_WAIT_TIME", 2)
 env_manager.get_env("GENERAL_ATTEMPTS", 10)
 env_manager.get_env("MANAGER_ITERATION_TIME", 10)
 env_manager.get_env("SHORT_INTERVAL_COUNT", 100)
+env_manager.get_env("MANAGER_JOB_JITTER", 0.1)
 env_manager.get_env("TIME_TO_PRUNE_ZERO_CLIENT", 540)
 env_manager.get_env("COMMUNICATION_ATTEMPTS", 1)
 env_manager.get_env("COMMUNICATION_ATTEMPTS_DELAY", 60)
 env_manager.get_env("CLIENT_EXPIRATION_TIME", 1200)
 env_manager.get_env("EXTERNAL_COST_TIMEOUT", 10)
+env_manager.get_env("COST_QUOTES_DEADLINE", 10)
+env_manager.get_env("COST_QUOTES_ENOUGH", 3)
+env_manager.get_env("COST_QUERY_CONCURRENCY", 16)
+env_manager.get_env("COST_QUOTE_TTL", 30)
+env_manager.get_env("COST_QUOTE_CACHE_SIZE", 1024)
 env_manager.get_env("START_SERVICE_ON_PEER_TIMEOUT", 120)
 
+# Autoscaler Settings
+env_manager.get_env("AUTOSCALER_INTERVAL", 15)
+env_manager.get_env("AUTOSCALER_GROW_USAGE", 0.9)
+env_manager.get_env("AUTOSCALER_SHRINK_USAGE", 0.5)
+env_manager.get_env("AUTOSCALER_TARGET_USAGE", 0.7)
+env_manager.get_env("AUTOSCALER_GROW_FACTOR", 1.5)
+env_manager.get_env("AUTOSCALER_PRESSURE", 10)
+env_manager.get_env("AUTOSCALER_IDLE_TICKS", 4)
+env_manager.get_env("AUTOSCALER_COOLDOWN", 60)
+
 # Communication Settings
+env_manager.get_env("WANTED_SERVICES_MAX", 100)
+env_manager.get_env("WANTED_SERVICES_CONCURRENCY", 2)
+env_manager.get_env("WANTED_SERVICES_RACING_PEERS", 3)
+env_manager.get_env("WANTED_SERVICES_TIMEOUT", 600)
+env_manager.get_env("PEER_CHANNEL_KEEPALIVE", 60)
+env_manager.get_env("PEER_CHANNEL_KEEPALIVE_TIMEOUT", 20)
+env_manager.get_env("PEER_CHANNEL_IDLE_TIMEOUT", 600)
+env_manager.get_env("PEER_HEALTH_INTERVAL", 30)
+env_manager.get_env("PEER_HEALTH_MAX_BACKOFF", 600)
+env_manager.get_env("PEER_HEALTH_PROBE_TIMEOUT", 1)
+env_manager.get_env("PEER_HEALTH_CONCURRENCY", 16)
+env_manager.get_env("PEER_DEPOSITS_CONCURRENCY", 8)
+env_manager.get_env("PEER_DEPOSITS_TIMEOUT", 60)
+env_manager.get_env("PEER_BREAKER_FAILURES", 3)
+env_manager.get_env("PEER_BREAKER_COOLDOWN", 60)
+env_manager.get_env("PEER_BREAKER_MAX_COOLDOWN", 3600)
 env_manager.get_env("SEND_ONLY_HASHES_ASKING_COST", True)
 env_manager.get_env("DENEGATE_COST_REQUEST_IF_DONT_VE_THE_HASH", False)
 
@@ -216,6 +269,13 @@ env_manager.get_env("DENEGATE_COST_REQUEST_IF_DONT_VE_THE_HASH", False)
 env_manager.get_env("MIN_SLOTS_OPEN_PER_PEER", 1)
 env_manager.get_env("CLIENT_MIN_GAS_AMOUNT_TO_RESET_EXPIRATION_TIME", pow(10, 3))
 
+# Database Settings
+env_manager.get_env("DATABASE_READ_POOL_SIZE", 8)
+env_manager.get_env("DATABASE_BUSY_TIMEOUT", 30)
+env_manager.get_env("DATABASE_STATEMENT_CACHE_SIZE", 256)
+env_manager.get_env("DATABASE_CACHE_SIZE", 10_000)
+env_manager.get_env("DATABASE_CACHE_TTL", 30)
+
 # Miscellaneous Settings
 env_manager.get_env("COMPUTE_POWER_RATE", 2)
 env_manager.get_env("MIN_BUFFER_BLOCK_SIZE", 10 ** 7)
@@ -224,6 +284,8 @@ env_manager.get_env("SOCIALIZATION_FACTOR", 2)
 env_manager.get_env("INIT_COST_CONFIGURATION_FACTOR", 1)
 env_manager.get_env("MAINTENANCE_COST_CONFIGURATION_FACTOR", pow(10, 6))
 env_manager.get_env("MEMSWAP_FACTOR", 0)
+env_manager.get_env("CPU_OVERCOMMIT_FACTOR", 1.0)
+env_manager.get_env("BLKIO_WEIGHT_POOL", 10000)
 env_manager.get_env("USE_PRINT", False)
 
 # Hashes
@@ -0,0 +1,131 @@
+from dataclasses import dataclass, field
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Tuple
+
+import grpc
+
+from protos import gateway_pb2_grpc
+from src.database.access_functions.peers import get_peer_directions
+from src.utils import logger as log
+from src.utils.env import EnvManager
+from src.utils.peer_health import PeerHealth
+from src.utils.singleton import Singleton
+from src.utils.utils import generate_uris_by_peer_id
+
+env_manager = EnvManager()
+
+PEER_CHANNEL_KEEPALIVE = env_manager.get_env("PEER_CHANNEL_KEEPALIVE")
+PEER_CHANNEL_KEEPALIVE_TIMEOUT = env_manager.get_env("PEER_CHANNEL_KEEPALIVE_TIMEOUT")
+PEER_CHANNEL_IDLE_TIMEOUT = env_manager.get_env("PEER_CHANNEL_IDLE_TIMEOUT")
+
+# Pings only while there are calls on the channel, the idle connections are dropped by gRPC itself.
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", int(PEER_CHANNEL_KEEPALIVE * 1000)),
+    ("grpc.keepalive_timeout_ms", int(PEER_CHANNEL_KEEPALIVE_TIMEOUT * 1000)),
+    ("grpc.keepalive_permit_without_calls", 0),
+    ("grpc.client_idle_timeout_ms", int(PEER_CHANNEL_IDLE_TIMEOUT * 1000)),
+]
+
+# Gateway server options that accept the keepalive pings of the peer channels.
+SERVER_KEEPALIVE_OPTIONS = [
+    ("grpc.http2.min_recv_ping_interval_without_data_ms", int(PEER_CHANNEL_KEEPALIVE * 1000)),
+    ("grpc.http2.max_ping_strikes", 0),
+]
+
+UNHEALTHY_STATES = (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN)
+
+
+class PeerUnreachable(Exception):
+    """None of the peer URIs is open."""
+
+
+@dataclass
+class _PeerChannel:
+    uri: str
+    channel: grpc.Channel
+    stub: gateway_pb2_grpc.GatewayStub
+    state: grpc.ChannelConnectivity = grpc.ChannelConnectivity.IDLE
+    last_used: float = field(default_factory=monotonic)
+
+
+class PeerChannels(metaclass=Singleton):
+    """
+    One gRPC channel by peer, shared by all the calls to it.
+
+    The channel is reused while its URI is still one of the peer's and it is not failing, otherwise a new one
+    is opened to the first URI that answers. Its connectivity is followed by a subscription, so checking it
+    does not touch the network. A channel not used for PEER_CHANNEL_IDLE_TIMEOUT seconds is removed, and the
+    replaced or removed ones are closed after the same time, so the calls still running on them can finish.
+    """
+
+    def __init__(self):
+        self.channels: Dict[str, _PeerChannel] = {}
+        self.retired: List[Tuple[float, grpc.Channel]] = []  # (RETIRED AT, CHANNEL)
+        self.last_sweep = monotonic()
+        self.lock = Lock()
+
+    def stub(self, peer_id: str) -> gateway_pb2_grpc.GatewayStub:
+        """Gateway stub over the channel of the peer, raises PeerUnreachable if it can not be reached."""
+        self.__sweep()
+        with self.lock:
+            entry = self.channels.get(peer_id)
+            if entry and entry.state not in UNHEALTHY_STATES:
+                entry.last_used = monotonic()
+                reused = entry
+            else:
+                reused = None
+
+        # Out of the lock, the uris are read from the database.
+        if reused and reused.uri in {f"{ip}:{port}" for ip, port in get_peer_directions(peer_id=peer_id)}:
+            return reused.stub
+
+        uri = next(generate_uris_by_peer_id(peer_id=peer_id), None)
+        if uri is None:
+            raise PeerUnreachable(f"No open uri for the peer {peer_id}")
+        return self.__connect(peer_id=peer_id, uri=uri).stub
+
+    def __connect(self, peer_id: str, uri: str) -> _PeerChannel:
+        with self.lock:
+            entry = self.channels.get(peer_id)
+            if entry and entry.uri == uri:
+                # The same uri is still the reachable one, gRPC reconnects it on its own.
+                entry.last_used = monotonic()
+                return entry
+
+            channel = grpc.insecure_channel(uri, options=CHANNEL_OPTIONS)
+            new_entry = _PeerChannel(uri=uri, channel=channel, stub=gateway_pb2_grpc.GatewayStub(channel))
+            self.channels[peer_id] = new_entry
+            if entry:
+                log.LOGGER(f"Peer {peer_id} channel moved from {entry.uri} to {uri}")
+                self.retired.append((monotonic(), entry.channel))
+
+        channel.subscribe(lambda state: self.__on_state(new_entry, state))
+        return new_entry
+
+    def __on_state(self, entry: _PeerChannel, state: grpc.ChannelConnectivity):
+        with self.lock:
+            entry.state = state
+        if state == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+            PeerHealth().report_failure(uri=entry.uri)
+
+    def __sweep(self):
+        now = monotonic()
+        with self.lock:
+            if now - self.last_sweep < PEER_CHANNEL_IDLE_TIMEOUT / 10:
+                return
+            self.last_sweep = now
+            for peer_id, entry in list(self.channels.items()):
+                if now - entry.last_used >= PEER_CHANNEL_IDLE_TIMEOUT:
+                    del self.channels[peer_id]
+                    self.retired.append((now, entry.channel))
+            expired = [channel for retired_at, channel in self.retired if now - retired_at >= PEER_CHANNEL_IDLE_TIMEOUT]
+            self.retired = [(retired_at, channel) for retired_at, channel in self.retired
+                            if now - retired_at < PEER_CHANNEL_IDLE_TIMEOUT]
+
+        for channel in expired:
+            channel.close()
+
+
+def peer_stub(peer_id: str) -> gateway_pb2_grpc.GatewayStub:
+    return PeerChannels().stub(peer_id=peer_id)
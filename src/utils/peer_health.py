@@ -0,0 +1,125 @@
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.database.access_functions.peers import get_all_peer_directions, get_peer_directions
+from src.utils import logger as log
+from src.utils.env import EnvManager
+from src.utils.singleton import Singleton
+from src.utils.tools.deadline_heap import DeadlineHeap
+
+env_manager = EnvManager()
+
+PEER_HEALTH_INTERVAL = env_manager.get_env("PEER_HEALTH_INTERVAL")
+PEER_HEALTH_MAX_BACKOFF = env_manager.get_env("PEER_HEALTH_MAX_BACKOFF")
+PEER_HEALTH_PROBE_TIMEOUT = env_manager.get_env("PEER_HEALTH_PROBE_TIMEOUT")
+PEER_HEALTH_CONCURRENCY = int(env_manager.get_env("PEER_HEALTH_CONCURRENCY"))
+
+Uri = Tuple[str, int]  # (IP, PORT)
+
+
+def _probe(uri: Uri) -> Optional[float]:
+    """Seconds a TCP connection to the uri took, None if it could not connect."""
+    start = monotonic()
+    try:
+        with socket.create_connection(uri, timeout=PEER_HEALTH_PROBE_TIMEOUT):
+            return monotonic() - start
+    except OSError:
+        return None
+
+
+@dataclass
+class UriHealth:
+    open: bool
+    rtt: Optional[float]  # Seconds of the last successful connect.
+    failures: int = 0  # Consecutive failed probes.
+    checked_at: float = field(default_factory=monotonic)
+
+
+class PeerHealth(metaclass=Singleton):
+    """
+    Reachability of the peer uris, probed on the background and answered from memory.
+
+    An open uri is probed again every PEER_HEALTH_INTERVAL seconds, and a closed one after a delay that doubles
+    with each failed probe, up to PEER_HEALTH_MAX_BACKOFF. Only a uri never seen before is probed on the caller
+    thread. The uris removed from the database are forgotten on the next sync, every PEER_HEALTH_INTERVAL.
+    """
+
+    def __init__(self):
+        self.uris: Dict[Uri, UriHealth] = {}
+        self.schedule = DeadlineHeap()
+        self.lock = Lock()
+        self.thread: Optional[Thread] = None
+        self.executor = ThreadPoolExecutor(max_workers=PEER_HEALTH_CONCURRENCY, thread_name_prefix="peer-health")
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        last_sync = 0.0
+        while True:
+            try:
+                if monotonic() - last_sync >= PEER_HEALTH_INTERVAL:
+                    last_sync = monotonic()
+                    self.__sync()
+                self.__probe(self.schedule.pop_due(until=monotonic()))
+            except Exception as e:
+                log.LOGGER(f"Peer health error: {e}")
+            sleep(1)
+
+    def __sync(self):
+        known = set(get_all_peer_directions())
+        with self.lock:
+            for uri in [uri for uri in self.uris if uri not in known]:
+                del self.uris[uri]
+                self.schedule.discard(uri)
+            new = [uri for uri in known if uri not in self.uris]
+        self.__probe(new)
+
+    def __probe(self, uris: Iterable[Uri]):
+        for uri, rtt in self.executor.map(lambda uri: (uri, _probe(uri)), uris):
+            self.__record(uri=uri, rtt=rtt)
+
+    def __record(self, uri: Uri, rtt: Optional[float]):
+        with self.lock:
+            health = self.uris.get(uri)
+            failures = 0 if rtt is not None else (health.failures if health else 0) + 1
+            self.uris[uri] = UriHealth(
+                open=rtt is not None,
+                rtt=rtt if rtt is not None else (health.rtt if health else None),
+                failures=failures
+            )
+        delay = PEER_HEALTH_INTERVAL if not failures else \
+            min(PEER_HEALTH_INTERVAL * 2 ** (failures - 1), PEER_HEALTH_MAX_BACKOFF)
+        self.schedule.schedule(uri, monotonic() + delay)
+
+    def reachable_uris(self, peer_id: str) -> List[str]:
+        """Open uris of the peer as 'ip:port', the fastest first."""
+        self.start()
+        directions = list(get_peer_directions(peer_id=peer_id))
+        with self.lock:
+            unknown = [uri for uri in directions if uri not in self.uris]
+        if unknown:
+            self.__probe(unknown)
+
+        with self.lock:
+            reachable = [(self.uris[uri].rtt, uri) for uri in directions if uri in self.uris and self.uris[uri].open]
+        return [f"{ip}:{port}" for _, (ip, port) in sorted(reachable)]
+
+    def report_failure(self, uri: str):
+        """A call could not reach the uri ('ip:port'), it is taken as closed and probed again right away."""
+        ip, port = uri.rsplit(":", 1)
+        key = (ip, int(port))
+        with self.lock:
+            health = self.uris.get(key)
+            if not health or not health.open:
+                return
+            health.open = False
+        self.schedule.schedule(key, monotonic())
@@ -3,7 +3,8 @@ import threading
 
 class Singleton(type):
   _instances = {}
-  _lock = threading.Lock()
+  # Reentrant, so a singleton can build another singleton from its __init__.
+  _lock = threading.RLock()
 
   def __call__(cls, *args, **kwargs):
     if cls not in cls._instances:
@@ -0,0 +1,52 @@
+from threading import Lock
+from time import monotonic
+from typing import Dict, Hashable
+
+
+class _Circuit:
+
+    def __init__(self):
+        self.failures: int = 0
+        self.opened: int = 0  # Consecutive times the circuit was opened.
+        self.open_until: float = 0
+        self.trial: bool = False  # A half-open trial call is in progress.
+
+
+class CircuitBreaker:
+    """
+    Per key circuit breaker.
+
+    After `failures` consecutive failures the circuit of a key opens and the calls to it are skipped during
+    the cooldown, which doubles every time it opens again, up to `max_cooldown`. Once the cooldown expires
+    a single trial call is allowed: its success closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, failures: int, cooldown: float, max_cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.circuits: Dict[Hashable, _Circuit] = {}
+        self.lock = Lock()
+
+    def allow(self, key: Hashable) -> bool:
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or circuit.failures < self.failures:
+                return True
+            if circuit.trial or monotonic() < circuit.open_until:
+                return False
+            circuit.trial = True
+            return True
+
+    def record_success(self, key: Hashable):
+        with self.lock:
+            self.circuits.pop(key, None)
+
+    def record_failure(self, key: Hashable):
+        with self.lock:
+            circuit = self.circuits.setdefault(key, _Circuit())
+            circuit.failures += 1
+            circuit.trial = False
+            if circuit.failures >= self.failures:
+                circuit.opened += 1
+                circuit.open_until = monotonic() + min(self.cooldown * 2 ** (circuit.opened - 1), self.max_cooldown)
@@ -0,0 +1,54 @@
+import heapq
+from threading import Lock
+from typing import Dict, Hashable, List, Tuple
+
+
+class DeadlineHeap:
+    """
+    Min-heap of keys by deadline, where the deadline of a key can be moved at any time.
+
+    Moving or discarding a key does not search the heap, the previous entry is left there and skipped
+    when it reaches the top (it no longer matches the current deadline of its key).
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[float, Hashable]] = []
+        self.deadlines: Dict[Hashable, float] = {}
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.deadlines
+
+    def schedule(self, key: Hashable, deadline: float):
+        with self.lock:
+            if self.deadlines.get(key) == deadline:
+                return
+            self.deadlines[key] = deadline
+            heapq.heappush(self.heap, (deadline, key))
+            if len(self.heap) > 2 * len(self.deadlines) + 64:
+                self.__compact()
+
+    def discard(self, key: Hashable):
+        with self.lock:
+            self.deadlines.pop(key, None)
+
+    def pop_due(self, until: float) -> List[Hashable]:
+        """Removes and returns the keys whose deadline is not after `until`, earliest first."""
+        due = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= until:
+                deadline, key = heapq.heappop(self.heap)
+                if self.deadlines.get(key) == deadline:
+                    del self.deadlines[key]
+                    due.append(key)
+        return due
+
+    def __compact(self):
+        # Drops the stale entries once they outnumber the live ones.
+        self.heap = [(deadline, key) for key, deadline in self.deadlines.items()]
+        heapq.heapify(self.heap)
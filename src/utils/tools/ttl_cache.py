@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable, Tuple
+
+
+class TTLCache:
+    """
+    Bounded least recently used cache whose entries expire after `ttl` seconds, or their own ttl if set with one.
+
+    The writers of the cached data call invalidate() so readers see their changes before the entry expires.
+    A value loaded while an invalidation was in progress is not stored, so a load that raced with a
+    write can not put the previous value back in the cache.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()  # KEY : (EXPIRATION, VALUE)
+        self.version = 0  # Increased on every invalidation.
+        self.lock = Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Returns (True, value) on hit and (False, None) on miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key: Hashable, value: Any, version: int = None, ttl: float = None):
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            self.entries[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        hit, value = self.get(key)
+        if hit:
+            return value
+        version = self.version
+        value = load()
+        self.set(key, value, version=version)
+        return value
+
+    def invalidate(self, *keys: Hashable):
+        with self.lock:
+            self.version += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.entries.clear()
@@ -1,5 +1,4 @@
 import os
-import socket
 import typing
 from typing import Generator, Optional
 
@@ -9,9 +8,10 @@ from bee_rpc.client import Dir
 
 from protos import celaut_pb2 as celaut
 from protos import gateway_pb2
-from src.database.access_functions.peers import get_peer_ids, get_peer_directions
+from src.database.access_functions.peers import get_peer_ids
 from src.manager.resources_manager import mem_manager
 from src.utils import logger as log
+from src.utils.peer_health import PeerHealth
 from src.utils.verify import get_service_hex_main_hash
 from src.utils.env import EnvManager
 
@@ -236,19 +236,5 @@ def peers_id_iterator(ignore_network: str = None) -> Generator[str, None, None]:
 
 
 def generate_uris_by_peer_id(peer_id: str) -> typing.Generator[str, None, None]:
-    yield from (
-        ip + ':' + str(port) for ip, port in get_peer_directions(
-        peer_id=peer_id
-    ) if is_open(ip=ip, port=port)
-    )
-
-
-def is_open(ip: str, port: int) -> bool:
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1)
-        sock.connect((ip, port))
-        sock.close()
-        return True
-    except Exception:
-        return False
+    # Open uris first by connect time, from the background probes of PeerHealth.
+    yield from PeerHealth().reachable_uris(peer_id=peer_id)
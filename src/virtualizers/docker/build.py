@@ -92,8 +92,7 @@ def build_container_from_definition(service: celaut_pb2.Service,
                 service.ByteSize(),
                 biggest_block_size
             ]) * BUILD_CONTAINER_MEMORY_SIZE_FACTOR
-    ):
-        # TODO si el coste es mayor a la cantidad total se quedará esperando indefinidamente.
+    ):  # Raises RamRequestTooLarge if it is bigger than the whole pool, instead of waiting forever.
         l.LOGGER('Build process of ' + service_id + ': go to load all the buffer.')
         l.LOGGER('Build process of ' + service_id + ': filesystem load in memory.')
 
@@ -156,9 +155,6 @@ def build_container_from_definition(service: celaut_pb2.Service,
         check_output(F'{DOCKER_COMMAND} rmi ' + cache_id, shell=True)
         l.LOGGER('Build process of ' + service_id + ': finished.')
 
-        with actual_building_processes_lock:
-            actual_building_processes.remove(service_id)
-
 
 def build(
         service: celaut_pb2.Service,
@@ -189,8 +185,13 @@ def build(
             with actual_building_processes_lock:
                 actual_building_processes.add(service_id)
 
-            build_container_from_definition(
-                service=service,
-                metadata=metadata,
-                service_id=service_id
-            )
+            try:
+                build_container_from_definition(
+                    service=service,
+                    metadata=metadata,
+                    service_id=service_id
+                )
+            finally:
+                # Also on failure, so the other requests of the service do not wait for it forever.
+                with actual_building_processes_lock:
+                    actual_building_processes.discard(service_id)
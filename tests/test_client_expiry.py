@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.database.engine import SQLiteEngine
+from src.database.gas_functions import register_gas_functions
+from src.database.migrate import create_tables, create_client_expiry_index
+from src.database.sql_connection import (
+    SQLConnection, CLIENT_EXPIRATION_TIME, CLIENT_MIN_GAS_AMOUNT_TO_RESET_EXPIRATION_TIME
+)
+from src.utils.singleton import Singleton
+
+"""
+    SQLConnection.delete_expired_clients over a temporary database: which clients are reaped and how long
+    the sweep takes.
+"""
+
+CLIENTS = 100_000
+KINDS = 5  # The clients are spread over the cases of _client, in turns.
+
+ENOUGH_GAS = str(int(CLIENT_MIN_GAS_AMOUNT_TO_RESET_EXPIRATION_TIME) * 10)
+
+
+def _client(i: int, now: float):
+    kind = i % KINDS
+    if kind == 0:
+        return f"expired-{i}", "0", now - CLIENT_EXPIRATION_TIME - 1  # Out of gas since long ago.
+    if kind == 1:
+        return f"recent-{i}", "0", now - 1  # Out of gas recently.
+    if kind == 2:
+        return f"gas-{i}", ENOUGH_GAS, now - CLIENT_EXPIRATION_TIME - 1  # Old last usage, gas added since.
+    if kind == 3:
+        return f"boundary-{i}", "0", now - CLIENT_EXPIRATION_TIME  # Expires right now.
+    return f"unused-{i}", ENOUGH_GAS, None  # With gas, never ran out.
+
+
+def test_client_expiry():
+    with tempfile.TemporaryDirectory() as directory:
+        database_file = os.path.join(directory, "clients.sqlite")
+        conn = sqlite3.connect(database_file)
+        register_gas_functions(conn)
+        create_tables(conn.cursor())
+        create_client_expiry_index(conn.cursor())
+        now = time.time()
+        conn.executemany("INSERT INTO clients (id, gas, last_usage) VALUES (?, ?, ?)",
+                         (_client(i, now) for i in range(CLIENTS)))
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.commit()
+
+        previous = {cls: Singleton._instances.pop(cls, None) for cls in (SQLiteEngine, SQLConnection)}
+        engine = SQLiteEngine(database_file=database_file)
+        try:
+            start = time.perf_counter()
+            reaped = SQLConnection().delete_expired_clients(now=now)
+            elapsed = time.perf_counter() - start
+            print(f"\nExpiry sweep over {CLIENTS} clients: {len(reaped)} reaped in {elapsed * 1e3:.1f} ms")
+
+            expected = {_client(i, now)[0] for i in range(CLIENTS) if i % KINDS in (0, 3)}
+            assert sorted(reaped) == sorted(expected)
+
+            remaining = {row[0] for row in conn.execute("SELECT id FROM clients")}
+            assert len(remaining) == CLIENTS - len(expected)
+            assert not remaining & expected
+            assert all(client_id.split("-")[0] in ("recent", "gas", "unused") for client_id in remaining)
+
+            # A second sweep at the same time has nothing left to reap.
+            assert SQLConnection().delete_expired_clients(now=now) == []
+        finally:
+            engine.close()
+            for cls, instance in previous.items():
+                Singleton._instances.pop(cls, None)
+                if instance is not None:
+                    Singleton._instances[cls] = instance
+            conn.close()
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.database.access_functions.peers import get_peer_directions, get_peer_id_by_ip
+from src.database.engine import SQLiteEngine
+from src.database.gas_functions import register_gas_functions
+from src.database.migrate import create_tables, create_indexes
+from src.database.sql_connection import SQLConnection
+from src.utils.singleton import Singleton
+
+"""
+    Latency of the request path lookups before and after the schema indexes, through the access functions
+    and SQLConnection, and the query plan of the statements they run.
+"""
+
+PEERS = 10_000
+CONTAINERS = 10_000
+LOOKUPS = 1_000
+
+_ip = lambda i: f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+class _RecordingEngine(SQLiteEngine):
+    """Engine over the test database that keeps the statements it runs."""
+
+    def __init__(self, database_file: str):
+        super().__init__(database_file=database_file)
+        self.statements = []
+
+    def execute(self, query: str, params=()):
+        self.statements.append((query, params))
+        return super().execute(query, params)
+
+
+# Lookup run through the access layer, and the indexes its statement must be resolved on.
+LOOKUP_FUNCTIONS = {
+    "uri_exists": (
+        lambda i: SQLConnection().uri_exists(uri=f"{_ip(i)}:8000"),
+        ["idx_uri_ip_port"]
+    ),
+    "get_peer_id_by_ip": (
+        lambda i: get_peer_id_by_ip(ip=_ip(i)),
+        ["idx_uri_ip_port"]
+    ),
+    "get_peer_directions": (
+        lambda i: list(get_peer_directions(peer_id=f"peer-{i}")),
+        ["idx_slot_peer", "idx_uri_slot"]
+    ),
+    "get_internal_service_id_by_uri": (
+        lambda i: SQLConnection().get_internal_service_id_by_uri(uri=_ip(PEERS + i)),
+        ["idx_internal_services_ip"]
+    ),
+    "get_token_by_hashed_token": (
+        lambda i: SQLConnection().get_token_by_hashed_token(hashed_token=f"hash-{i}"),
+        ["idx_external_services_token_hash"]
+    ),
+    "get_deposit_tokens": (
+        lambda i: SQLConnection().get_deposit_tokens(status="pending"),
+        ["idx_deposit_tokens_status"]
+    ),
+}
+
+
+def _populate(conn: sqlite3.Connection):
+    conn.executemany(
+        "INSERT INTO peer (id, protocol_stack, client_id, gas) VALUES (?, NULL, '', '0')",
+        ((f"peer-{i}",) for i in range(PEERS))
+    )
+    conn.executemany(
+        "INSERT INTO slot (id, internal_port, transport_protocol, peer_id) VALUES (?, 8000, 'tcp', ?)",
+        ((i + 1, f"peer-{i}") for i in range(PEERS))
+    )
+    conn.executemany(
+        "INSERT INTO uri (ip, port, slot_id) VALUES (?, 8000, ?)",
+        ((_ip(i), i + 1) for i in range(PEERS))
+    )
+    conn.executemany(
+        "INSERT INTO internal_services (id, ip, father_id, gas, mem_limit, serialized_instance) "
+        "VALUES (?, ?, 'father', '0', 0, '')",
+        ((f"container-{i}", _ip(PEERS + i)) for i in range(CONTAINERS))
+    )
+    conn.executemany(
+        "INSERT INTO external_services (token, token_hash, peer_id, client_id, serialized_instance) "
+        "VALUES (?, ?, 'peer-0', 'client', '')",
+        ((f"token-{i}", f"hash-{i}") for i in range(CONTAINERS))
+    )
+    conn.executemany(
+        "INSERT INTO deposit_tokens (id, client_id, status) VALUES (?, 'client', ?)",
+        ((f"deposit-{i}", "pending" if i % 100 == 0 else "payed") for i in range(CONTAINERS))
+    )
+    conn.commit()
+
+
+def _measure() -> dict:
+    latencies = {}
+    for name, (lookup, _indexes) in LOOKUP_FUNCTIONS.items():
+        Singleton._instances.pop(SQLConnection, None)  # Starts with an empty lookup cache.
+        start = time.perf_counter()
+        for i in range(LOOKUPS):
+            lookup(i * (PEERS // LOOKUPS))
+        latencies[name] = (time.perf_counter() - start) / LOOKUPS * 1e6
+    return latencies
+
+
+def test_database_indexes():
+    with tempfile.TemporaryDirectory() as directory:
+        database_file = os.path.join(directory, "benchmark.sqlite")
+        conn = sqlite3.connect(database_file)
+        register_gas_functions(conn)
+        create_tables(conn.cursor())
+        _populate(conn)
+
+        # The access layer is bound to the test database until the end of the test.
+        previous = {cls: Singleton._instances.pop(cls, None) for cls in (SQLiteEngine, SQLConnection)}
+        engine = _RecordingEngine(database_file=database_file)
+        Singleton._instances[SQLiteEngine] = engine
+        try:
+            assert get_peer_id_by_ip(ip=_ip(7)) == "peer-7"
+            assert list(get_peer_directions(peer_id="peer-7")) == [(_ip(7), 8000)]
+            assert SQLConnection().uri_exists(uri=f"{_ip(7)}:8000")
+            assert SQLConnection().get_internal_service_id_by_uri(uri=_ip(PEERS + 7)) == "container-7"
+            assert SQLConnection().get_token_by_hashed_token(hashed_token="hash-7") == "token-7"
+            assert len(SQLConnection().get_deposit_tokens(status="pending")) == CONTAINERS // 100
+
+            before = _measure()
+            create_indexes(conn.cursor())
+            conn.commit()
+            conn.execute("ANALYZE")
+            conn.commit()
+            after = _measure()
+
+            print(f"\nLookup latency with {PEERS} peers and {CONTAINERS} containers (us per lookup):")
+            print(f"{'lookup':<34}{'no index':>12}{'indexed':>12}{'speedup':>10}")
+            for name in LOOKUP_FUNCTIONS:
+                print(f"{name:<34}{before[name]:>12.1f}{after[name]:>12.1f}{before[name] / after[name]:>9.1f}x")
+
+            # Every lookup must be resolved by an index search on its indexes, not a table scan.
+            for name, (lookup, indexes) in LOOKUP_FUNCTIONS.items():
+                Singleton._instances.pop(SQLConnection, None)
+                engine.statements.clear()
+                lookup(0)
+                assert len(engine.statements) == 1, f"{name} ran {len(engine.statements)} statements"
+                query, params = engine.statements[0]
+                plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params))
+                assert "SCAN" not in plan, f"{name} scans a table: {plan}"
+                for index in indexes:
+                    assert index in plan, f"{name} does not use {index}: {plan}"
+        finally:
+            engine.close()
+            for cls, instance in previous.items():
+                Singleton._instances.pop(cls, None)
+                if instance is not None:
+                    Singleton._instances[cls] = instance
+            Singleton._instances.pop(_RecordingEngine, None)
+            conn.close()
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.database.engine import SQLiteEngine
+from src.database.gas_functions import register_gas_functions
+from src.database.migrate import create_tables
+from src.database.sql_connection import SQLConnection, MANAGER_ITERATION_TIME
+from src.utils.singleton import Singleton
+
+"""
+    Projected exhaustion of the internal services balances, with balances too big for a float.
+"""
+
+HUGE_GAS = 10 ** 400  # Its exhaustion time would overflow a float.
+
+
+def test_gas_exhaustion():
+    with tempfile.TemporaryDirectory() as directory:
+        database_file = os.path.join(directory, "gas.sqlite")
+        conn = sqlite3.connect(database_file)
+        register_gas_functions(conn)
+        create_tables(conn.cursor())
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO internal_services (id, ip, father_id, gas, mem_limit, serialized_instance, "
+            "gas_rate, gas_settled_at) VALUES (?, '', 'father', ?, 0, '', ?, ?)",
+            [
+                ("huge", str(HUGE_GAS), "1", now),
+                ("short", "2", "1", now),  # Runs out after two periods.
+                ("long", "1000", "1", now),
+                ("idle", "0", "0", now),  # No rate, never runs out.
+            ]
+        )
+        conn.commit()
+
+        previous = {cls: Singleton._instances.pop(cls, None) for cls in (SQLiteEngine, SQLConnection)}
+        engine = SQLiteEngine(database_file=database_file)
+        try:
+            sc = SQLConnection()
+            until = now + 10 * MANAGER_ITERATION_TIME
+            assert sc.pop_exhausted_containers(until=until) == ["short"]
+
+            # Projected again after the balance changes, on its own and along with the others.
+            sc.update_gas_to_container(id="long", gas=HUGE_GAS)
+            sc.update_gas_to_container(id="huge", gas=1)
+            assert sc.pop_exhausted_containers(until=until) == ["huge"]
+            assert sc.pop_exhausted_containers(until=now + 10 ** 6 * MANAGER_ITERATION_TIME) == []
+        finally:
+            engine.close()
+            for cls, instance in previous.items():
+                Singleton._instances.pop(cls, None)
+                if instance is not None:
+                    Singleton._instances[cls] = instance
+            conn.close()